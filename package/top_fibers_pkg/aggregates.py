@@ -0,0 +1,433 @@
+"""
+Functions for building per-file post aggregates, which are merged into the posts
+of one FIB-index window by top_fibers_pkg.post_store.PostStore.
+
+A per-file aggregate holds one row per (post, user) pair found in a raw data file.
+Normally every post has a single user, but the data does not guarantee it, so a
+post is credited to every user it was seen with:
+    - post_id (str or int) : post ID
+    - user_id (category) : user ID (str or int) of the poster
+    - username (category) : the poster's username at the pair's last occurrence
+    - num_reshares (int) : reshare count, combined over all occurrences of the pair
+        with the platform's reshare rule (see RESHARE_RULES)
+    - timestamp (int) : epoch seconds when the post was sent
+    - url (str) : URL of the post at the pair's last occurrence (only if URLs are
+        kept)
+    - profile_image_url (str) : the poster's profile image link at the pair's last
+        occurrence that has one (only if images are kept)
+    - seq (int) : position of the pair's last occurrence within the file
+
+`seq` lets windows recover the most recent values of every post and user when
+aggregates from several files are merged. For Twitter, IDs are stored as int64
+and URLs are not kept (see `aggregate_post_records`), which makes aggregates much
+smaller. User IDs and usernames repeat a lot, so they are stored as
+categories.
+
+The aggregates of one month's files can be combined into a month aggregate and
+saved to disk (see `save_month_aggregate`). Each monthly window then only needs to
+parse the newest month of raw data and can read the other months' aggregates.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from array import array
+
+AGGREGATE_COLUMNS = [
+    "post_id",
+    "user_id",
+    "username",
+    "num_reshares",
+    "timestamp",
+    "url",
+    "profile_image_url",
+    "seq",
+]
+
+# How reshare counts of the same post are combined across occurrences
+#   - "max" : keep the largest count (Twitter, where every retweet embeds the count)
+#   - "last" : keep the latest count (CrowdTangle)
+RESHARE_RULES = ["max", "last"]
+
+AGGREGATE_VERSION = "4"
+AGGREGATE_FILE_SUFFIX = "__post_aggregate"
+
+
+def _check_reshare_rule(reshare_rule):
+    if reshare_rule not in RESHARE_RULES:
+        raise ValueError(f"`reshare_rule` must be one of {RESHARE_RULES}!")
+
+
+def get_latest_rows(codes, recency, num_codes):
+    """
+    Return the row with the largest `recency` of every code (0 to `num_codes` - 1),
+    or -1 for codes without rows. `recency` values must be unique.
+
+    Unlike grouping with pandas, this only takes a few passes over NumPy arrays.
+    """
+    latest = np.full(num_codes, np.iinfo(np.int64).min, dtype=np.int64)
+    np.maximum.at(latest, codes, recency)
+    is_latest = recency == latest[codes]
+    del latest
+    latest_rows = np.full(num_codes, -1, dtype=np.int64)
+    latest_rows[codes[is_latest]] = np.flatnonzero(is_latest)
+    return latest_rows
+
+
+def get_max_values(codes, values, num_codes):
+    """
+    Return the largest of the (int) `values` of every code (0 to `num_codes` - 1).
+    """
+    max_values = np.full(num_codes, np.iinfo(values.dtype).min, dtype=values.dtype)
+    np.maximum.at(max_values, codes, values)
+    return max_values
+
+
+def factorize_pairs(post_codes, user_codes, num_posts, num_users):
+    """
+    Number the (post, user) pair of every row in order of first appearance, like
+    pandas.factorize. Usually every post has a single user, and then pairs are
+    numbered like posts without hashing the rows again.
+
+    Parameters:
+    -----------
+    - post_codes (numpy.ndarray) : the post number of every row
+    - user_codes (numpy.ndarray) : the user number of every row
+    - num_posts (int) : number of posts
+    - num_users (int) : number of users
+
+    Returns:
+    -----------
+    - pair_codes (numpy.ndarray) : the pair number of every row
+    - pair_posts (numpy.ndarray) : the post number of every pair
+    - pair_users (numpy.ndarray) : the user number of every pair
+    """
+    post_users = np.zeros(num_posts, dtype=user_codes.dtype)
+    post_users[post_codes] = user_codes
+    if np.array_equal(post_users[post_codes], user_codes):
+        return post_codes, np.arange(num_posts), post_users
+    del post_users
+
+    user_base = max(num_users, 1)
+    pair_codes, pair_keys = pd.factorize(
+        post_codes.astype(np.int64) * user_base + user_codes
+    )
+    return pair_codes, pair_keys // user_base, pair_keys % user_base
+
+
+def aggregate_post_records(
+    records,
+    reshare_rule,
+    earliest_tstamp=None,
+    int_ids=False,
+    keep_urls=True,
+    keep_images=False,
+):
+    """
+    Aggregate the post records of one file into one row per (post, user) pair.
+
+    Parameters:
+    -----------
+    - records (iterable) : records ordered like post_cache.POST_CACHE_COLUMNS, as
+        yielded by post_cache.iter_post_records or post_cache.iter_cached_records
+    - reshare_rule (str) : one of RESHARE_RULES
+    - earliest_tstamp (int) : if provided, posts sent before this time are
+        skipped
+    - int_ids (bool) : if True, post and user IDs are stored as int64. Only use
+        this for platforms whose IDs are always decimal integers (Twitter).
+        Default = False
+    - keep_urls (bool) : if False, URLs are not stored, e.g., because they can be
+        rebuilt from the username and post ID (see post_store.TWEET_URL_TEMPLATE).
+        Default = True
+    - keep_images (bool) : if True, profile image links are stored (see
+        post_store.PostStore.write_profile_image_links). Default = False
+
+    Returns:
+    -----------
+    - aggregate (pandas.DataFrame) : one row per (post, user) pair, see
+        AGGREGATE_COLUMNS
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+    _check_reshare_rule(reshare_rule)
+
+    # Values are collected column by column: integers in compact arrays, user IDs
+    # and usernames (which repeat a lot) as codes into their first appearance, and
+    # repeated strings (images) as a single shared object
+    post_ids = array("q") if int_ids else []
+    user_codes = array("i")
+    username_codes = array("i")
+    reshare_counts = array("q")
+    timestamps = array("q")
+    urls = []
+    image_urls = []
+    seqs = array("q")
+    user_index = dict()
+    # Missing usernames get code -1, like in pandas.Categorical
+    username_index = {None: -1}
+    strings = dict()
+
+    for seq, record in enumerate(records):
+        post_id, user_id, username, reshare_count, timestamp, url, _, image_url = record
+        if earliest_tstamp is not None and timestamp < earliest_tstamp:
+            continue
+        if int_ids:
+            post_ids.append(int(post_id))
+            user_id = int(user_id)
+        else:
+            post_ids.append(post_id)
+        user_codes.append(user_index.setdefault(user_id, len(user_index)))
+        username_codes.append(
+            username_index.setdefault(username, len(username_index) - 1)
+        )
+        reshare_counts.append(reshare_count)
+        timestamps.append(timestamp)
+        if keep_urls:
+            urls.append(url)
+        if keep_images:
+            image_urls.append(strings.setdefault(image_url, image_url))
+        seqs.append(seq)
+
+    id_dtype = np.int64 if int_ids else object
+    del username_index[None]
+    occurrences = {
+        "post_id": np.asarray(post_ids, dtype=id_dtype),
+        "user_id": pd.Categorical.from_codes(
+            np.frombuffer(user_codes, dtype=np.int32),
+            pd.Index(list(user_index), dtype=id_dtype),
+        ),
+        "username": pd.Categorical.from_codes(
+            np.frombuffer(username_codes, dtype=np.int32),
+            pd.Index(list(username_index), dtype=object),
+        ),
+        "num_reshares": np.frombuffer(reshare_counts, dtype=np.int64),
+        "timestamp": np.frombuffer(timestamps, dtype=np.int64),
+        "seq": np.frombuffer(seqs, dtype=np.int64),
+    }
+    if keep_urls:
+        occurrences["url"] = np.asarray(urls, dtype=object)
+    if keep_images:
+        occurrences["profile_image_url"] = np.asarray(image_urls, dtype=object)
+    # The arrays above are now only referenced by `occurrences`, which
+    # `_reduce_occurrences` empties as it goes
+    del post_ids, user_codes, username_codes, reshare_counts, timestamps, urls
+    del image_urls, seqs, user_index, username_index, strings
+    return _reduce_occurrences(occurrences, reshare_rule)
+
+
+def _factorize(values):
+    """
+    Return the code of every value (numpy.ndarray or pandas.Categorical) and the
+    number of distinct values. Categorical values already hold their codes.
+    """
+    if isinstance(values, pd.Categorical):
+        return values.codes, len(values.categories)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return codes, len(uniques)
+
+
+def _reduce_occurrences(occurrences, reshare_rule):
+    """
+    Reduce occurrences of posts (dict of AGGREGATE_COLUMNS arrays, with user IDs
+    and usernames as numpy.ndarray or pandas.Categorical) to one row per
+    (post, user) pair, in order of first appearance. Every row holds the values of
+    the pair's latest occurrence (largest `seq`), with reshares combined by
+    `reshare_rule`. Profile images come from the latest occurrence that has one.
+
+    Working on the column arrays with integer pair codes avoids building (and
+    grouping) a DataFrame of every occurrence, which dominated peak memory. Each
+    column is removed from `occurrences` once it is reduced, so it can be freed.
+    """
+    post_codes, num_posts = _factorize(occurrences["post_id"])
+    user_codes, num_users = _factorize(occurrences["user_id"])
+    pairs, pair_posts, _ = factorize_pairs(post_codes, user_codes, num_posts, num_users)
+    num_pairs = len(pair_posts)
+    del post_codes, user_codes, pair_posts
+
+    seqs = occurrences["seq"]
+    latest_rows = get_latest_rows(pairs, seqs, num_pairs)
+    aggregate = dict()
+    if reshare_rule == "max":
+        aggregate["num_reshares"] = get_max_values(
+            pairs, occurrences.pop("num_reshares"), num_pairs
+        )
+
+    images = occurrences.pop("profile_image_url", None)
+    if images is not None:
+        image_rows = np.flatnonzero(pd.notna(images))
+        latest_images = get_latest_rows(pairs[image_rows], seqs[image_rows], num_pairs)
+        has_image = latest_images >= 0
+        aggregate["profile_image_url"] = np.full(num_pairs, None, dtype=object)
+        aggregate["profile_image_url"][has_image] = images[
+            image_rows[latest_images[has_image]]
+        ]
+        del image_rows, latest_images, has_image
+    del pairs, seqs, images
+
+    for name in list(occurrences):
+        aggregate[name] = occurrences.pop(name)[latest_rows]
+    for name in ["user_id", "username"]:
+        if not isinstance(aggregate[name], pd.Categorical):
+            # Categories keep the dtype of the values, so string categories stay
+            # out of Arrow memory (pandas>=3 str)
+            codes, labels = pd.factorize(aggregate[name])
+            aggregate[name] = pd.Categorical.from_codes(
+                codes, pd.Index(labels, dtype=labels.dtype)
+            )
+            del codes, labels
+    # The reduced columns are not copied again into a single block
+    columns = [name for name in AGGREGATE_COLUMNS if name in aggregate]
+    return pd.DataFrame(aggregate, columns=columns, copy=False)
+
+
+def combine_aggregates(aggregates, reshare_rule):
+    """
+    Combine the aggregates of consecutive files into one aggregate, identical to
+    the aggregate of all of their records read one file after another.
+
+    Parameters:
+    -----------
+    - aggregates (list) : per-file aggregates (see `aggregate_post_records`),
+        ordered like the (chronologically sorted) data files
+    - reshare_rule (str) : one of RESHARE_RULES
+
+    Returns:
+    -----------
+    - aggregate (pandas.DataFrame) : one row per (post, user) pair, see
+        AGGREGATE_COLUMNS
+
+    Exceptions:
+    -----------
+    - TypeError, ValueError
+    """
+    if not isinstance(aggregates, list):
+        raise TypeError("`aggregates` must be a list!")
+    _check_reshare_rule(reshare_rule)
+    if not aggregates:
+        return aggregate_post_records([], reshare_rule)
+    if len(aggregates) == 1:
+        return aggregates[0]
+
+    # Shift `seq` so it keeps increasing from one file to the next
+    names = [name for name in AGGREGATE_COLUMNS if name in aggregates[0]]
+    columns = {name: [] for name in names}
+    seq_offset = 0
+    for aggregate in aggregates:
+        for name in names:
+            columns[name].append(aggregate[name].to_numpy())
+        columns["seq"][-1] = columns["seq"][-1].astype(np.int64) + seq_offset
+        if len(aggregate) > 0:
+            seq_offset += int(aggregate["seq"].max()) + 1
+
+    occurrences = {name: np.concatenate(arrays) for name, arrays in columns.items()}
+    return _reduce_occurrences(occurrences, reshare_rule)
+
+
+def get_month_aggregate_path(aggregate_dir, month, platform):
+    """
+    Return the path of the saved aggregate of `month` inside `aggregate_dir`.
+    E.g.: 2023_01 -> {aggregate_dir}/2023_01__post_aggregate_twitter.parquet
+    """
+    return os.path.join(
+        aggregate_dir, f"{month}{AGGREGATE_FILE_SUFFIX}_{platform}.parquet"
+    )
+
+
+def _get_source_key(source_files, earliest_tstamp, reshare_rule, keep_images=False):
+    """
+    Return the key of a month aggregate: the name, size and mtime of every source
+    file (symlinks are followed), the earliest date kept, the reshare rule and
+    whether profile images were kept.
+    """
+    sources = []
+    for file in source_files:
+        stat = os.stat(file)
+        sources.append([os.path.basename(file), stat.st_size, stat.st_mtime_ns])
+    return {
+        b"top_fibers.aggregate_version": AGGREGATE_VERSION.encode(),
+        b"top_fibers.reshare_rule": reshare_rule.encode(),
+        b"top_fibers.source_files": json.dumps(sources).encode(),
+        b"top_fibers.earliest_tstamp": json.dumps(earliest_tstamp).encode(),
+        b"top_fibers.profile_images": json.dumps(keep_images).encode(),
+    }
+
+
+def is_month_aggregate_current(
+    path, source_files, earliest_tstamp, reshare_rule, keep_images=False
+):
+    """
+    Return True if `path` holds a month aggregate built from `source_files` as they
+    are now, which kept every post sent on or after `earliest_tstamp` (and profile
+    images, if `keep_images`).
+    """
+    if not os.path.exists(path):
+        return False
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+
+    source_key = _get_source_key(source_files, earliest_tstamp, reshare_rule)
+    saved_tstamp = json.loads(metadata.get(b"top_fibers.earliest_tstamp", b"0"))
+    if saved_tstamp is not None and (
+        earliest_tstamp is None or saved_tstamp > earliest_tstamp
+    ):
+        return False
+    # An aggregate with profile images also serves runs that do not need them
+    saved_images = json.loads(metadata.get(b"top_fibers.profile_images", b"false"))
+    if keep_images and not saved_images:
+        return False
+    return all(
+        metadata.get(key) == value
+        for key, value in source_key.items()
+        if key not in [b"top_fibers.earliest_tstamp", b"top_fibers.profile_images"]
+    )
+
+
+def save_month_aggregate(
+    aggregate, path, source_files, earliest_tstamp, reshare_rule, keep_images=False
+):
+    """
+    Save the aggregate of a month's data files as a Parquet file.
+
+    The file is written to a temporary file and then moved into place, so readers
+    never see a partial aggregate.
+
+    Parameters:
+    -----------
+    - aggregate (pandas.DataFrame) : see `combine_aggregates`
+    - path (str) : see `get_month_aggregate_path`
+    - source_files (list) : full paths to the month's data files
+    - earliest_tstamp (int) : the earliest date `aggregate` was filtered by
+    - reshare_rule (str) : one of RESHARE_RULES
+    - keep_images (bool) : whether `aggregate` holds profile images. Default = False
+
+    Returns:
+    -----------
+    None
+    """
+    aggregate_dir = os.path.dirname(path)
+    if aggregate_dir and not os.path.exists(aggregate_dir):
+        os.makedirs(aggregate_dir)
+
+    table = pa.Table.from_pandas(aggregate, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update(
+        _get_source_key(source_files, earliest_tstamp, reshare_rule, keep_images)
+    )
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_month_aggregate(path):
+    """
+    Read a month aggregate saved by `save_month_aggregate`.
+    """
+    return pq.read_table(path).to_pandas()
@@ -0,0 +1,305 @@
+"""
+Functions for the block index of raw data files, which lets readers skip straight
+to the parts of a file that can hold the posts of given users or time slices.
+
+Each raw file is split into blocks of whole lines that start where a gzip member
+starts, so every block can be decompressed on its own after seeking to it. For
+every block, the index records:
+    - offset (int) : byte offset of the block in the (compressed) file
+    - length (int) : compressed size of the block (bytes)
+    - num_lines (int) : number of lines in the block
+    - min_timestamp, max_timestamp (int) : range of post times in the block,
+        including retweeted and quoted tweets (None if no post has a time)
+    - num_users (int) : number of distinct users who posted in the block
+    - bloom, bloom_num_hashes : Bloom filter of those users' IDs (see
+        top_fibers_pkg.bloom)
+
+Blocks hold about INDEX_BLOCK_BYTES of decompressed data, but can only end where a
+gzip member ends. Files written by gzip_io.BgzfWriter have a member every 64 KiB.
+Files written by gzip usually have a single member, so their index has one block:
+it can rule out the whole file, but not seek inside it.
+
+Like post caches, indexes are keyed by the raw file's size and modification time.
+"""
+import io
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .bloom import BLOOM_FP_RATE, BloomFilter, hash_key
+from .data_model import Tweet_v1, FbIgPost
+from .decoding import get_post_decoder
+from .gzip_io import iter_gzip_member_data, iter_gzip_range_lines
+from .post_cache import RAW_FILE_SUFFIX
+
+INDEX_VERSION = "1"
+INDEX_FILE_SUFFIX = "__block_index.parquet"
+INDEX_BLOCK_BYTES = 1024 * 1024
+
+BLOCK_INDEX_SCHEMA = pa.schema(
+    [
+        ("offset", pa.int64()),
+        ("length", pa.int64()),
+        ("num_lines", pa.int64()),
+        ("min_timestamp", pa.int64()),
+        ("max_timestamp", pa.int64()),
+        ("num_users", pa.int64()),
+        ("bloom_num_hashes", pa.int8()),
+        ("bloom", pa.binary()),
+    ]
+)
+
+
+def get_block_index_path(raw_path, index_dir):
+    """
+    Return the path of the block index for `raw_path` inside `index_dir`.
+    E.g.: 2023-01-01__tweets_w_links.jsonl.gzip ->
+        2023-01-01__tweets_w_links__block_index.parquet
+    """
+    basename = os.path.basename(raw_path)
+    if basename.endswith(RAW_FILE_SUFFIX):
+        basename = basename[: -len(RAW_FILE_SUFFIX)]
+    return os.path.join(index_dir, f"{basename}{INDEX_FILE_SUFFIX}")
+
+
+def _get_source_key(raw_path):
+    """
+    Return the index key of a raw file: its size and mtime (symlinks are followed).
+    """
+    stat = os.stat(raw_path)
+    return {
+        b"top_fibers.index_version": INDEX_VERSION.encode(),
+        b"top_fibers.source_size": str(stat.st_size).encode(),
+        b"top_fibers.source_mtime_ns": str(stat.st_mtime_ns).encode(),
+    }
+
+
+def is_block_index_current(raw_path, index_dir):
+    """
+    Return True if `index_dir` holds a block index for `raw_path` that was built
+    from the raw file as it is now (same size and mtime).
+    """
+    index_path = get_block_index_path(raw_path, index_dir)
+    if not os.path.exists(index_path):
+        return False
+    try:
+        metadata = pq.read_schema(index_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    source_key = _get_source_key(raw_path)
+    return all(metadata.get(key) == value for key, value in source_key.items())
+
+
+def _get_line_reader(platform):
+    """
+    Return a function that takes one raw line and returns the (user ID, post time)
+    of every post it holds.
+    """
+    decode_post = get_post_decoder(platform)
+
+    if platform == "twitter":
+
+        def read_line(line):
+            tweet = Tweet_v1(decode_post(line))
+            if not tweet.is_valid():
+                return []
+            posts = [tweet]
+            if tweet.is_retweet:
+                posts.append(tweet.retweet_object)
+            if tweet.is_quote:
+                posts.append(tweet.quote_object)
+            return [
+                (post.get_user_ID(), post.get_post_time(timestamp=True))
+                for post in posts
+            ]
+
+        return read_line
+
+    elif platform == "facebook":
+
+        def read_line(line):
+            post = FbIgPost(decode_post(line))
+            if not post.is_valid():
+                return []
+            return [(post.get_user_ID(), post.get_post_time(timestamp=True))]
+
+        return read_line
+
+    raise ValueError("`platform` must be either 'twitter' or 'facebook'!")
+
+
+class _Block:
+    """
+    Summary of the lines of one block while the index is built.
+    """
+
+    __slots__ = ("offset", "size", "num_lines", "user_ids", "timestamps")
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.size = 0
+        self.num_lines = 0
+        self.user_ids = set()
+        self.timestamps = []
+
+    def add_line(self, posts):
+        self.num_lines += 1
+        for user_id, timestamp in posts:
+            if user_id is not None:
+                self.user_ids.add(str(user_id))
+            if timestamp is not None:
+                self.timestamps.append(timestamp)
+
+    def to_row(self, end, fp_rate):
+        bloom = BloomFilter.for_capacity(len(self.user_ids), fp_rate)
+        bloom.update(self.user_ids)
+        return {
+            "offset": self.offset,
+            "length": end - self.offset,
+            "num_lines": self.num_lines,
+            "min_timestamp": min(self.timestamps) if self.timestamps else None,
+            "max_timestamp": max(self.timestamps) if self.timestamps else None,
+            "num_users": len(self.user_ids),
+            "bloom_num_hashes": bloom.num_hashes,
+            "bloom": bloom.to_bytes(),
+        }
+
+
+def build_block_index(
+    raw_path,
+    index_dir,
+    platform,
+    block_bytes=INDEX_BLOCK_BYTES,
+    fp_rate=BLOOM_FP_RATE,
+):
+    """
+    Build the block index of a raw data file and save it as a Parquet file.
+
+    The index is written to a temporary file and then moved into place, so readers
+    never see a partial index.
+
+    Parameters:
+    -----------
+    - raw_path (str) : full path to a raw `*.jsonl.gzip` file
+    - index_dir (str) : directory where the index file is saved
+    - platform (str) : one of ["twitter", "facebook"]
+    - block_bytes (int) : smallest amount of decompressed data per block (the last
+        block may be smaller). Default = INDEX_BLOCK_BYTES
+    - fp_rate (float) : false positive rate of the Bloom filters. Default =
+        BLOOM_FP_RATE
+
+    Returns:
+    -----------
+    - index_path (str) : full path to the new index file
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+    read_line = _get_line_reader(platform)
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+
+    # Take the key before reading, so a file modified mid-read is rebuilt next time
+    schema = BLOCK_INDEX_SCHEMA.with_metadata(_get_source_key(raw_path))
+    index_path = get_block_index_path(raw_path, index_dir)
+    tmp_path = f"{index_path}.tmp"
+
+    rows = []
+    block = _Block(0)
+    remainder = b""
+    end_offset = 0
+    for data, member_end in iter_gzip_member_data(raw_path):
+        if remainder:
+            data = remainder + data
+        end = data.rfind(b"\n") + 1
+        remainder = data[end:]
+        for line in io.BytesIO(data[:end]):
+            block.add_line(read_line(line))
+        block.size += end
+
+        # A block can only end where a member ends, after a whole line
+        if member_end is not None:
+            end_offset = member_end
+            if not remainder and block.size >= block_bytes:
+                rows.append(block.to_row(member_end, fp_rate))
+                block = _Block(member_end)
+
+    if remainder:
+        block.add_line(read_line(remainder))
+    if block.num_lines > 0:
+        rows.append(block.to_row(end_offset, fp_rate))
+
+    pq.write_table(pa.Table.from_pylist(rows, schema=schema), tmp_path)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def read_block_index(raw_path, index_dir):
+    """
+    Read the block index of `raw_path` (see `build_block_index`).
+
+    Returns:
+    -----------
+    - index (pandas.DataFrame) : one row per block, in file order. Columns are
+        described in BLOCK_INDEX_SCHEMA.
+    """
+    return pq.read_table(get_block_index_path(raw_path, index_dir)).to_pandas()
+
+
+def select_blocks(index, user_ids=None, start_tstamp=None, end_tstamp=None):
+    """
+    Return the blocks of `index` that may hold posts of `user_ids` sent between
+    `start_tstamp` and `end_tstamp`. Blocks are never wrongly left out, but a
+    few extra blocks may be returned (Bloom filter false positives).
+
+    Parameters:
+    -----------
+    - index (pandas.DataFrame) : see `read_block_index`
+    - user_ids (iterable) : if provided, only blocks that may hold a post by one
+        of these users are returned
+    - start_tstamp (int) : if provided, only blocks that may hold a post sent on or
+        after this time are returned
+    - end_tstamp (int) : if provided, only blocks that may hold a post sent before
+        this time are returned
+
+    Returns:
+    -----------
+    - blocks (pandas.DataFrame) : the selected rows of `index`, in file order
+    """
+    keep = np.ones(len(index), dtype=bool)
+    if start_tstamp is not None:
+        keep &= (index["max_timestamp"] >= start_tstamp).to_numpy()
+    if end_tstamp is not None:
+        keep &= (index["min_timestamp"] < end_tstamp).to_numpy()
+
+    if user_ids is not None:
+        # Keys are hashed once and checked against the filter of every block
+        key_hashes = [hash_key(str(user_id)) for user_id in user_ids]
+        blooms = zip(index["bloom"], index["bloom_num_hashes"])
+        for row, (bits, num_hashes) in enumerate(blooms):
+            if keep[row]:
+                bloom = BloomFilter.from_bytes(bits, int(num_hashes))
+                keep[row] = any(bloom.contains_hash(h) for h in key_hashes)
+    return index[keep]
+
+
+def iter_block_lines(raw_path, blocks):
+    """
+    Yield the lines of the selected blocks of a raw data file.
+
+    Parameters:
+    -----------
+    - raw_path (str) : full path to the raw file `blocks` were indexed from
+    - blocks (pandas.DataFrame) : rows of its block index, in file order (see
+        `select_blocks`)
+
+    Yields:
+    -----------
+    - line (bytes) : one line of the file, including its trailing b"\\n"
+    """
+    with open(raw_path, "rb") as f:
+        for offset, length in zip(blocks["offset"], blocks["length"]):
+            yield from iter_gzip_range_lines(f, int(offset), int(length))
@@ -0,0 +1,131 @@
+"""
+A small Bloom filter: a compact set that answers "maybe present" or "definitely
+absent". Used to tell, without reading them, which parts of a raw data file cannot
+hold a given user (see top_fibers_pkg.block_index).
+"""
+import hashlib
+import math
+
+BLOOM_FP_RATE = 0.01
+
+
+def get_key_digest(key):
+    """
+    Return the 128-bit BLAKE2b digest (bytes) of `key` (str or bytes).
+    """
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    return hashlib.blake2b(key, digest_size=16).digest()
+
+
+def hash_digest(digest):
+    """
+    Return the pair of 64-bit hashes of a key from its digest (see `hash_key`).
+    """
+    return (
+        int.from_bytes(digest[:8], "little"),
+        int.from_bytes(digest[8:], "little") | 1,
+    )
+
+
+def hash_key(key):
+    """
+    Return the pair of 64-bit hashes from which the bit positions of `key` (str or
+    bytes) are derived in every BloomFilter, whatever its size.
+    """
+    return hash_digest(get_key_digest(key))
+
+
+class BloomFilter:
+    """
+    Set of keys (str or bytes) with no false negatives and a false positive rate
+    set by its size.
+
+    Each key is hashed once (BLAKE2b, 128 bits) and its `num_hashes` bit positions
+    are derived from the two halves of the digest (double hashing).
+
+    Parameters:
+    -----------
+    - num_bits (int) : size of the bit array. Rounded up to a multiple of 8
+    - num_hashes (int) : number of bits set per key
+    - bits (bytes) : the bit array of a saved filter (see `to_bytes`). Default =
+        None (an empty filter)
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+
+    __slots__ = ("num_bits", "num_hashes", "_bits")
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        if num_bits < 1 or num_hashes < 1:
+            raise ValueError("`num_bits` and `num_hashes` must be positive!")
+        num_bytes = (num_bits + 7) // 8
+        if bits is None:
+            self._bits = bytearray(num_bytes)
+        elif len(bits) == num_bytes:
+            self._bits = bytearray(bits)
+        else:
+            raise ValueError("`bits` must hold exactly `num_bits` bits!")
+        self.num_bits = num_bytes * 8
+        self.num_hashes = num_hashes
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate=BLOOM_FP_RATE):
+        """
+        Return an empty filter sized for `capacity` keys at `fp_rate` false
+        positives, i.e., -log2(fp_rate) hashes and 1.44 bits per key and hash.
+        """
+        if not 0 < fp_rate < 1:
+            raise ValueError("`fp_rate` must be between 0 and 1!")
+        num_hashes = max(1, round(-math.log2(fp_rate)))
+        num_bits = math.ceil(max(capacity, 1) * num_hashes / math.log(2))
+        return cls(num_bits, num_hashes)
+
+    @classmethod
+    def from_bytes(cls, bits, num_hashes):
+        """
+        Return the filter saved by `to_bytes`.
+        """
+        return cls(len(bits) * 8, num_hashes, bits)
+
+    def to_bytes(self):
+        """
+        Return the bit array of the filter (bytes).
+        """
+        return bytes(self._bits)
+
+    def _positions(self, key_hash):
+        h1, h2 = key_hash
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        self.add_hash(hash_key(key))
+
+    def add_hash(self, key_hash):
+        """
+        Same as `add`, with the key already hashed by `hash_key`.
+        """
+        bits = self._bits
+        for position in self._positions(key_hash):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def contains_hash(self, key_hash):
+        """
+        Same as `key in self`, with the key already hashed by `hash_key`. Saves
+        hashing a key again when checking it against many filters.
+        """
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key_hash)
+        )
+
+    def __contains__(self, key):
+        return self.contains_hash(hash_key(key))
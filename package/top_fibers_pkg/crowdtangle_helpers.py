@@ -1,8 +1,42 @@
 """
 Functions used to communicate with CrowdTangle API
 """
+import threading
+import time
+
+import numpy as np
 import requests
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CT_SEARCH_URL = "https://api.crowdtangle.com/posts/search"
+
+# Names of the search parameters in the CrowdTangle API, by `ct_get_search_posts`
+# argument name
+CT_SEARCH_PARAMS = {
+    "count": "count",
+    "start_time": "startDate",
+    "end_time": "endDate",
+    "include_history": "includeHistory",
+    "sort_by": "sortBy",
+    "types": "types",
+    "search_term": "searchTerm",
+    "account_types": "accountTypes",
+    "min_interactions": "minInteractions",
+    "offset": "offset",
+    "platforms": "platforms",
+    "lang": "language",
+}
+
+# Default retry policy of CrowdTangleClient. Retries are sent right away by the
+# HTTP adapter (after the backoff), so they are not seen by any rate limiter.
+# Rate limit errors (429) are therefore left to the caller.
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 2
+RETRY_STATUSES = (500, 502, 503, 504)
+REQUEST_TIMEOUT = (10, 300)  # (connect, read) seconds
+
 
 def ct_get_search_posts(
     count=100,
@@ -18,6 +52,7 @@ def ct_get_search_posts(
     api_token=None,
     platforms="facebook,instagram",
     lang=None,
+    url=CT_SEARCH_URL,
 ):
     """
     Retrieve posts from Facebook/Instagram based on the passed parameters.
@@ -94,6 +129,8 @@ def ct_get_search_posts(
             Default: None (no restrictions)
             Options: 2-letter code found in reference below. See ref above for some exceptions.
             REF:https://en.wikipedia.org/wiki/List_of_ISO_639-1_codes
+        - url (str, optional): the search endpoint, e.g. a local mock server for testing
+            Default: CT_SEARCH_URL
     Returns:
         [dict]: The Response contains both a status code and a result. The status will always
             be 200 if there is no error. The result contains an array of post objects and a
@@ -102,8 +139,6 @@ def ct_get_search_posts(
         ct_get_posts(include_history = 'true', api_token="AKJHXDFYTGEBKRJ6535")
     """
 
-    # API-endpoint
-    URL_BASE = "https://api.crowdtangle.com/posts/search"
     # Defining a params dict for the parameters to be sent to the API
     PARAMS = {
         "count": count,
@@ -132,9 +167,168 @@ def ct_get_search_posts(
         PARAMS["language"] = lang
 
     # sending get request and saving the response as response object
-    r = requests.get(url=URL_BASE, params=PARAMS)
+    r = requests.get(url=url, params=PARAMS)
     if r.status_code != 200:
         print(f"status: {r.status_code}")
         print(f"reason: {r.reason}")
         print(f"details: {r.raise_for_status()}")
     return r
+
+
+class ResponseMetrics:
+    """
+    Thread-safe record of the response times of a CrowdTangleClient.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.response_times = []
+        self.num_errors = 0
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.response_times.append(seconds)
+            if error:
+                self.num_errors += 1
+
+    def summary(self):
+        """
+        Return the number of requests and errors, and the mean, median, 95th
+        percentile and maximum response times (seconds) as a dictionary.
+        """
+        with self._lock:
+            times = np.array(self.response_times, dtype=float)
+            num_errors = self.num_errors
+        if len(times) == 0:
+            return {"requests": 0, "errors": num_errors}
+        return {
+            "requests": len(times),
+            "errors": num_errors,
+            "mean": float(times.mean()),
+            "p50": float(np.percentile(times, 50)),
+            "p95": float(np.percentile(times, 95)),
+            "max": float(times.max()),
+        }
+
+
+class CrowdTangleClient:
+    """
+    Client for the CrowdTangle search endpoint that reuses its connections.
+
+    Requests go through one `requests.Session`, whose connection pool keeps
+    connections alive between calls (no new TCP/TLS handshake per page), asks for
+    gzip-compressed responses, and retries failed requests (see `retries`). The
+    search parameters that do not change between calls are converted once, when
+    the client is created. The client can be shared by threads.
+
+    Parameters:
+    -----------
+    - api_token (str) : CrowdTangle API token
+    - url (str) : the search endpoint, e.g. a local mock server for testing.
+        Default = CT_SEARCH_URL
+    - pool_size (int) : number of connections kept alive. Set it to the number of
+        threads using the client. Default = 10
+    - retries (int or urllib3.util.retry.Retry) : retry policy for connection
+        errors and RETRY_STATUSES responses, or the number of retries with the
+        default policy. Default = RETRY_TOTAL
+    - backoff_factor (float) : the n-th retry waits backoff_factor * 2**(n - 1)
+        seconds. Ignored if `retries` is a Retry object.
+        Default = RETRY_BACKOFF_FACTOR
+    - timeout (float or tuple) : seconds to wait for the server, see `requests`.
+        Default = REQUEST_TIMEOUT
+    - search_params : search parameters sent with every search, named like the
+        arguments of `ct_get_search_posts` (e.g. count=10_000, platforms="facebook")
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+
+    def __init__(
+        self,
+        api_token,
+        url=CT_SEARCH_URL,
+        pool_size=10,
+        retries=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        timeout=REQUEST_TIMEOUT,
+        **search_params,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.metrics = ResponseMetrics()
+        self._base_params = {"token": api_token}
+        self._base_params.update(self._convert_params(search_params))
+
+        if not isinstance(retries, Retry):
+            retries = Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=["GET"],
+                raise_on_status=False,
+            )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retries
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        )
+
+    @staticmethod
+    def _convert_params(search_params):
+        """
+        Return `search_params` with API names, without those set to None.
+        """
+        params = dict()
+        for name, value in search_params.items():
+            if name not in CT_SEARCH_PARAMS:
+                raise ValueError(f"Unknown search parameter: `{name}`!")
+            if value is not None:
+                params[CT_SEARCH_PARAMS[name]] = value
+        return params
+
+    def search_posts(self, **search_params):
+        """
+        Retrieve posts from the search endpoint.
+
+        Parameters:
+        -----------
+        - search_params : search parameters for this call, named like the
+            arguments of `ct_get_search_posts`. They override the client's.
+
+        Returns:
+        -----------
+        - response (requests.Response) : the successful response
+
+        Exceptions:
+        -----------
+        - requests.RequestException (e.g., requests.HTTPError if the response has
+            an error status after all retries)
+        - ValueError
+        """
+        params = dict(self._base_params)
+        params.update(self._convert_params(search_params))
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.metrics.record(time.perf_counter() - start, error=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
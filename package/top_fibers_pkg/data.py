@@ -70,3 +70,80 @@ def get_dict_val(dictionary: dict, key_list: list = []):
         else:
             return None
     return retval
+
+
+def compile_key_path(key_list: list):
+    """
+    Return a function that takes a dictionary and returns the value at the end of
+    the key path `key_list`, exactly like `get_dict_val(dictionary, key_list)`.
+
+    `get_dict_val` checks its arguments and loops over the keys on every call. The
+    returned getter is specialized for the length of `key_list` once (e.g., at
+    import time), so reading a field of a post costs one or a few `dict.get` calls.
+    Unlike `get_dict_val`, the getter does not check that its argument is a dict.
+    Parameters:
+    ----------
+    - key_list (list) : list of strings indicating what dict_obj
+        item to retrieve
+    Returns:
+    ----------
+    - get_value (function) : takes a dictionary and returns the key value (if
+        present) or None (if not present)
+    Raises:
+    - TypeError
+    Examples:
+    ---------
+    get_share_count = compile_key_path(["statistics", "actual", "shareCount"])
+    get_share_count({"statistics": {"actual": {"shareCount": 3}}})
+    # Returns
+    3
+    """
+    if not isinstance(key_list, list):
+        raise TypeError("`key_list` must be of type `list`")
+
+    keys = tuple(key_list)
+    if len(keys) == 0:
+
+        def get_value(dictionary):
+            return dictionary
+
+    elif len(keys) == 1:
+        (key,) = keys
+
+        def get_value(dictionary):
+            return dictionary.get(key)
+
+    elif len(keys) == 2:
+        key_1, key_2 = keys
+
+        def get_value(dictionary):
+            value = dictionary.get(key_1)
+            if not isinstance(value, dict):
+                return None
+            return value.get(key_2)
+
+    elif len(keys) == 3:
+        key_1, key_2, key_3 = keys
+
+        def get_value(dictionary):
+            value = dictionary.get(key_1)
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key_2)
+            if not isinstance(value, dict):
+                return None
+            return value.get(key_3)
+
+    else:
+        last_key = keys[-1]
+        parent_keys = keys[:-1]
+
+        def get_value(dictionary):
+            value = dictionary
+            for k in parent_keys:
+                value = value.get(k)
+                if not isinstance(value, dict):
+                    return None
+            return value.get(last_key)
+
+    return get_value
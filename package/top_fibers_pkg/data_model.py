@@ -1,15 +1,170 @@
 """
 A data class that is used to extract the information needed in the
 fib calculation scripts.
+
+The classes use `__slots__` (no per-instance `__dict__`) because one object is
+created for every line of the raw data. Nested tweets (retweets and quotes) are
+only wrapped when they are accessed, and `rebind` lets a single instance be reused
+for every line of a file (flyweight, see `iter_post_wrappers`).
 """
 import datetime
+import functools
+import re
 
-from .data import get_dict_val
+from .data import compile_key_path, get_dict_val
 
 TWITTER_V1_DT_CONVERSION_STR = "%a %b %d %H:%M:%S %z %Y"
 TWITTER_V2_DT_CONVERSION_STR = None  # TODO: Update when V2 added
 CROWDTANGLE_DT_CONVERSION_STR = "%Y-%m-%d %H:%M:%S"
 
+# Fixed-width forms of the formats above, e.g.:
+#   Twitter V1  : "Wed Feb 01 13:45:07 +0000 2023"
+#   CrowdTangle : "2023-02-01 13:45:07"
+# Strings that do not match are parsed with strptime, so the results (including
+# None for invalid dates) are always the same as strptime's.
+TWITTER_V1_DT_PATTERN = re.compile(
+    r"(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) "
+    r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) "
+    r"(\d\d) ([01]\d|2[0-3]):([0-5]\d):([0-5]\d) ([+-])([01]\d|2[0-3])([0-5]\d) "
+    r"(\d{4})"
+)
+CROWDTANGLE_DT_PATTERN = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d) ([01]\d|2[0-3]):([0-5]\d):([0-5]\d)"
+)
+MONTH_ABBREVIATIONS = {
+    month: num
+    for num, month in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), start=1
+    )
+}
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# Number of date strings whose timestamp is memoized. Many posts share a second.
+TIMESTAMP_CACHE_SIZE = 2**16
+
+# Getters of the fields read for every post, compiled once (see compile_key_path)
+_get_tweet_created_at = compile_key_path(["created_at"])
+_get_tweet_retweet_count = compile_key_path(["retweet_count"])
+_get_tweet_id = compile_key_path(["id_str"])
+_get_tweet_user_id = compile_key_path(["user", "id_str"])
+_get_tweet_user_handle = compile_key_path(["user", "screen_name"])
+_get_tweet_user_image_url = compile_key_path(["user", "profile_image_url"])
+_get_tweet_urls = compile_key_path(["entities", "urls"])
+
+_get_ct_platform = compile_key_path(["platform"])
+_get_ct_date = compile_key_path(["date"])
+_get_ct_share_count = compile_key_path(["statistics", "actual", "shareCount"])
+_get_ct_post_id = compile_key_path(["platformId"])
+_get_ct_post_url = compile_key_path(["postUrl"])
+_get_ct_account_id = compile_key_path(["account", "platformId"])
+_get_ct_account_handle = compile_key_path(["account", "handle"])
+_get_ct_account_name = compile_key_path(["account", "name"])
+_get_ct_account_url = compile_key_path(["account", "url"])
+_get_ct_link = compile_key_path(["link"])
+_get_ct_expanded_links = compile_key_path(["expandedLinks"])
+
+
+def _strptime_timestamp(date_str, conversion_str):
+    """
+    Return `date_str` parsed with strptime as epoch seconds (int), or None.
+    """
+    try:
+        dt_obj = datetime.datetime.strptime(date_str, conversion_str)
+        return int(dt_obj.timestamp())
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+@functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_twitter_v1_time(created_at):
+    """
+    Convert a Twitter V1 "created_at" string to epoch seconds without strptime.
+
+    Parameters:
+    -----------
+    - created_at (str) : e.g., "Wed Feb 01 13:45:07 +0000 2023"
+
+    Returns:
+    -----------
+    - timestamp (int) : epoch seconds, or None if `created_at` is not a valid date
+        in TWITTER_V1_DT_CONVERSION_STR format
+    """
+    match = None
+    if isinstance(created_at, str):
+        match = TWITTER_V1_DT_PATTERN.fullmatch(created_at)
+    if match is None:
+        return _strptime_timestamp(created_at, TWITTER_V1_DT_CONVERSION_STR)
+
+    month, day, hour, minute, second, sign, off_hour, off_minute, year = match.groups()
+    try:
+        date_obj = datetime.date(int(year), MONTH_ABBREVIATIONS[month], int(day))
+    except ValueError:
+        return None
+    offset = int(off_hour) * 3600 + int(off_minute) * 60
+    if sign == "-":
+        offset = -offset
+    return (
+        (date_obj.toordinal() - EPOCH_ORDINAL) * 86400
+        + int(hour) * 3600
+        + int(minute) * 60
+        + int(second)
+        - offset
+    )
+
+
+@functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_crowdtangle_time(date):
+    """
+    Convert a CrowdTangle "date" string to epoch seconds without strptime.
+
+    Like strptime, the date is read as local time because it has no time zone.
+
+    Parameters:
+    -----------
+    - date (str) : e.g., "2023-02-01 13:45:07"
+
+    Returns:
+    -----------
+    - timestamp (int) : epoch seconds, or None if `date` is not a valid date in
+        CROWDTANGLE_DT_CONVERSION_STR format
+    """
+    match = None
+    if isinstance(date, str):
+        match = CROWDTANGLE_DT_PATTERN.fullmatch(date)
+    if match is None:
+        return _strptime_timestamp(date, CROWDTANGLE_DT_CONVERSION_STR)
+    try:
+        dt_obj = datetime.datetime(*map(int, match.groups()))
+        return int(dt_obj.timestamp())
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def iter_post_wrappers(post_objects, post_class, flyweight=False):
+    """
+    Wrap every post object in `post_class` (e.g., Tweet_v1 or FbIgPost).
+
+    Parameters:
+    -----------
+    - post_objects (iterable) : JSON objects (dict) of the posts
+    - post_class (class) : a PostBase subclass
+    - flyweight (bool) : if True, a single `post_class` instance is rebound to
+        every post (see PostBase.rebind) instead of creating one per post. The
+        yielded object must then not be kept after the next one is requested.
+        Default = False
+
+    Yields:
+    -----------
+    - post (post_class) : the wrapped post
+    """
+    post = None
+    for post_object in post_objects:
+        if post is None or not flyweight:
+            post = post_class(post_object)
+        else:
+            post.rebind(post_object)
+        yield post
+
 
 class PostBase:
     """
@@ -18,12 +173,24 @@ class PostBase:
     It defines the common functions that the children classes should have.
     """
 
+    __slots__ = ("post_object",)
+
     def __init__(self, post_object):
         """
         This function initializes the instance by binding the post_object
         Parameters:
             - post_object (dict): the JSON object of the social media post
         """
+        self.rebind(post_object)
+
+    def rebind(self, post_object):
+        """
+        Bind the instance to another post_object, so one instance can be reused
+        for every post of a file instead of creating a new one per post.
+        Children classes reset any values derived from the previous post here.
+        Parameters:
+            - post_object (dict): the JSON object of the social media post
+        """
         if post_object is None:
             raise ValueError("The post object cannot be None")
         self.post_object = post_object
@@ -107,6 +274,8 @@ class Tweet_v1(PostBase):
     Ref: https://developer.twitter.com/en/docs/twitter-api/v1/data-dictionary/object-model/tweet
     """
 
+    __slots__ = ("_retweet_object", "_quote_object")
+
     def __init__(self, tweet_object):
         """
         This function initializes the instance by binding the tweet_object
@@ -115,13 +284,54 @@ class Tweet_v1(PostBase):
         """
         super().__init__(tweet_object)
 
-        self.is_retweet = "retweeted_status" in self.post_object
-        if self.is_retweet:
-            self.retweet_object = Tweet_v1(self.post_object["retweeted_status"])
+    def rebind(self, tweet_object):
+        """
+        Bind the instance to another tweet_object (see PostBase.rebind).
+        Wrappers of the previous tweet's retweet and quote are dropped.
+        Parameters:
+            - tweet_object (dict): the JSON object of a tweet
+        """
+        super().rebind(tweet_object)
+        self._retweet_object = None
+        self._quote_object = None
+
+    @property
+    def is_retweet(self):
+        """
+        Whether the tweet is a retweet (bool)
+        """
+        return "retweeted_status" in self.post_object
+
+    @property
+    def is_quote(self):
+        """
+        Whether the tweet quotes another tweet (bool)
+        """
+        return "quoted_status" in self.post_object
+
+    @property
+    def retweet_object(self):
+        """
+        Return the retweeted tweet as a Tweet_v1 object, created on first access.
+        Raises AttributeError if the tweet is not a retweet.
+        """
+        if self._retweet_object is None:
+            if not self.is_retweet:
+                raise AttributeError("The tweet is not a retweet")
+            self._retweet_object = Tweet_v1(self.post_object["retweeted_status"])
+        return self._retweet_object
 
-        self.is_quote = "quoted_status" in self.post_object
-        if self.is_quote:
-            self.quote_object = Tweet_v1(self.post_object["quoted_status"])
+    @property
+    def quote_object(self):
+        """
+        Return the quoted tweet as a Tweet_v1 object, created on first access.
+        Raises AttributeError if the tweet is not a quote.
+        """
+        if self._quote_object is None:
+            if not self.is_quote:
+                raise AttributeError("The tweet is not a quote")
+            self._quote_object = Tweet_v1(self.post_object["quoted_status"])
+        return self._quote_object
 
     def is_valid(self):
         """
@@ -145,25 +355,22 @@ class Tweet_v1(PostBase):
 
         Returns:
         -----------
-        - post_time (str): if timestamp=False, return "created_at" time as is. If
-            timestamp=True, first convert "created_at" time to a timestamp
+        - post_time (str or int): if timestamp=False, return "created_at" time as
+            is (str). If timestamp=True, return it as epoch seconds (int), or None
+            if it cannot be parsed (see `parse_twitter_v1_time`)
         """
-        created_at = self.get_value(["created_at"])
+        created_at = _get_tweet_created_at(self.post_object)
         if not timestamp:
             return created_at
-        try:
-            dt_obj = datetime.datetime.strptime(
-                created_at, TWITTER_V1_DT_CONVERSION_STR
-            )
-            return str(int(dt_obj.timestamp()))
-        except:
+        if not isinstance(created_at, str):
             return None
+        return parse_twitter_v1_time(created_at)
 
     def get_reshare_count(self):
         """
         Return the number of of times this post was reshared (i.e., the retweet count)
         """
-        return self.get_value(["retweet_count"])
+        return _get_tweet_retweet_count(self.post_object)
 
     def get_post_ID(self):
         """
@@ -171,7 +378,7 @@ class Tweet_v1(PostBase):
         This is different from the id of the retweeted tweet or
         quoted tweet
         """
-        return self.get_value(["id_str"])
+        return _get_tweet_id(self.post_object)
 
     def get_link_to_post(self):
         """
@@ -186,19 +393,19 @@ class Tweet_v1(PostBase):
         """
         Return the ID of the base-level user (str)
         """
-        return self.get_value(["user", "id_str"])
+        return _get_tweet_user_id(self.post_object)
 
     def get_user_handle(self):
         """
         Return the screen_name of the user (str)
         """
-        return self.get_value(["user", "screen_name"])
+        return _get_tweet_user_handle(self.post_object)
     
     def get_user_profile_image_url(self):
         """
         Return the profile image URL for the poster of this tweet object
         """
-        return self.get_value(["user", "profile_image_url"])
+        return _get_tweet_user_image_url(self.post_object)
 
     def get_link_to_author(self):
         """
@@ -206,6 +413,18 @@ class Tweet_v1(PostBase):
         """
         return f"https://twitter.com/i/user/{self.get_user_handle()}"
 
+    def get_links(self):
+        """
+        Return the links (list of str) in the tweet's "entities", expanded when
+        possible. Links of the retweeted or quoted tweet are not included.
+        """
+        links = []
+        for url_object in _get_tweet_urls(self.post_object) or []:
+            link = url_object.get("expanded_url") or url_object.get("url")
+            if link:
+                links.append(link)
+        return links
+
     def __repr__(self):
         """
         Define the representation of the object.
@@ -228,6 +447,8 @@ class Tweet_v2(PostBase):
     Ref: https://developer.twitter.com/en/docs/twitter-api/data-dictionary/object-model/tweet
     """
 
+    __slots__ = ()
+
     def __init__(self, tweet_object):
         """
         This function initializes the instance by binding the tweet_object
@@ -245,6 +466,8 @@ class FbIgPost(PostBase):
     Response Ref: https://github.com/CrowdTangle/API/wiki/Search#response
     """
 
+    __slots__ = ("platform", "is_fb_post", "is_ig_post")
+
     def __init__(self, post_object):
         """
         This function initializes the instance by binding the post_object
@@ -253,11 +476,15 @@ class FbIgPost(PostBase):
         """
         super().__init__(post_object)
 
-        if post_object is None:
-            raise ValueError("The post object cannot be None")
-        self.post_object = post_object
+    def rebind(self, post_object):
+        """
+        Bind the instance to another post_object (see PostBase.rebind).
+        Parameters:
+            - post_object (dict): the JSON object of the social media post
+        """
+        super().rebind(post_object)
 
-        self.platform = self.get_value(["platform"])
+        self.platform = _get_ct_platform(self.post_object)
         self.is_fb_post = True if self.platform == "Facebook" else False
         self.is_ig_post = True if self.platform == "Instagram" else False
 
@@ -280,63 +507,71 @@ class FbIgPost(PostBase):
 
         Returns:
         -----------
-        - post_time (str): if timestamp=False, return "date" time as is. If
-            timestamp=True, first convert "date" time to a timestamp
+        - post_time (str or int): if timestamp=False, return "date" time as is
+            (str). If timestamp=True, return it as epoch seconds (int), or None if
+            it cannot be parsed (see `parse_crowdtangle_time`)
         """
-        created_at = self.get_value(["date"])
+        created_at = _get_ct_date(self.post_object)
         if not timestamp:
             return created_at
-        try:
-            dt_obj = datetime.datetime.strptime(
-                created_at, CROWDTANGLE_DT_CONVERSION_STR
-            )
-            return str(int(dt_obj.timestamp()))
-        except:
+        if not isinstance(created_at, str):
             return None
+        return parse_crowdtangle_time(created_at)
 
     def get_reshare_count(self):
         """
         Return the number of times that the post was reshared
         """
-        return self.get_value(["statistics", "actual", "shareCount"])
+        return _get_ct_share_count(self.post_object)
 
     def get_post_ID(self):
         """
         Return the ID of the post as a string
         """
-        return str(self.get_value(["platformId"]))
+        return str(_get_ct_post_id(self.post_object))
 
     def get_link_to_post(self):
         """
         Return the link to the post so that one can click it and check
         the post in a web browser
         """
-        return self.get_value(["postUrl"])
+        return _get_ct_post_url(self.post_object)
 
     def get_user_ID(self):
         """
         Return the ID of the user as a string
         """
-        return str(self.get_value(["account", "platformId"]))
+        return str(_get_ct_account_id(self.post_object))
 
     def get_user_handle(self):
         """
         Return the account handle of the user (str)
         """
-        return self.get_value(["account", "handle"])
+        return _get_ct_account_handle(self.post_object)
     
     def get_account_name(self):
         """
         Some accounts do not have "handles" and instead have "names." For example,
         if "accountType" is facebook_page or facebook_group.
         """
-        return self.get_value(["account", "name"])
+        return _get_ct_account_name(self.post_object)
 
     def get_link_to_author(self):
         """
         Return the link to the authors page
         """
-        return self.get_value(["account", "url"])
+        return _get_ct_account_url(self.post_object)
+
+    def get_links(self):
+        """
+        Return the links (list of str) shared in the post: its "link" and the
+        expanded and original URLs of its "expandedLinks"
+        """
+        links = [_get_ct_link(self.post_object)]
+        for link_object in _get_ct_expanded_links(self.post_object) or []:
+            links.append(link_object.get("expanded"))
+            links.append(link_object.get("original"))
+        return [link for link in links if link]
 
     def __repr__(self):
         """
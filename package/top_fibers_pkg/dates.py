@@ -98,14 +98,15 @@ def get_earliest_date(months_earlier, as_timestamp=False, month_calculated=None)
     Parameters:
     -----------
     - months_earlier (int): the number of months earlier from which to set the earliest date
-    - as_timestamp (bool) : if True, return as timestamp; if False, return as datetime object
+    - as_timestamp (bool) : if True, return as timestamp (int epoch seconds, like
+        the post timestamps it is compared to); if False, return as datetime object
         default = False
     - month_calculated (str) : the anchor date from which to identify the earliest date.
         Format must be "%Y_%m"
 
     Return:
     -----------
-    - earliest_date (datetime.datetime or timestamp) : the earliest date based on the
+    - earliest_date (datetime.datetime or int) : the earliest date based on the
         months_earlier input. Will always be the first day of that month.
 
     Exception:
@@ -138,5 +139,117 @@ def get_earliest_date(months_earlier, as_timestamp=False, month_calculated=None)
     earliest_dt = datetime.datetime(year=offset_dt.year, month=offset_dt.month, day=1)
 
     if as_timestamp:
-        return earliest_dt.timestamp()
+        return int(earliest_dt.timestamp())
     return earliest_dt
+
+
+def get_data_file_date(file_path):
+    """
+    Return the start date of the data in a raw data file, based on its name.
+
+    Example basenames:
+        Facebook: 2022-04-01--2022-04-30__fb_posts_w_links.jsonl.gzip
+        Twitter : 2022-11-01__tweets_w_links.jsonl.gzip
+
+    Parameters:
+    -----------
+    - file_path (str) : path to a raw data file (or a symbolic link to one)
+
+    Return:
+    -----------
+    - start_date (datetime.datetime) : the first date covered by the file
+    """
+    basename = os.path.basename(file_path)
+    start_date = basename.split("__")[0].split("--")[0]
+    return datetime.datetime.strptime(start_date, "%Y-%m-%d")
+
+
+def get_months_in_range(month_range):
+    """
+    Return every month in `month_range`, in chronological order.
+
+    Example:
+    get_months_in_range("2022_11..2023_02")
+    >>> ['2022_11', '2022_12', '2023_01', '2023_02']
+
+    get_months_in_range("2023_02")
+    >>> ['2023_02']
+
+    Parameters:
+    -----------
+    - month_range (str) : a single month ("YYYY_MM") or an inclusive range of
+        months ("YYYY_MM..YYYY_MM")
+
+    Return:
+    -----------
+    - months (list) : list of "YYYY_MM" strings
+
+    Exception:
+    -----------
+    TypeError, ValueError
+    """
+    if not isinstance(month_range, str):
+        raise TypeError(
+            "`month_range` must be a str. "
+            f"Currently its type is: {type(month_range)}"
+        )
+
+    first_month, _, last_month = month_range.partition("..")
+    if not last_month:
+        last_month = first_month
+    first_dt = datetime.datetime.strptime(first_month, "%Y_%m")
+    last_dt = datetime.datetime.strptime(last_month, "%Y_%m")
+    if last_dt < first_dt:
+        raise ValueError(f"`month_range` ends before it starts: {month_range}")
+
+    months = []
+    month_dt = first_dt
+    while month_dt <= last_dt:
+        months.append(month_dt.strftime("%Y_%m"))
+        month_dt += relativedelta(months=1)
+    return months
+
+
+def get_window_months(month_calculated, num_months):
+    """
+    Return the months whose data is used to calculate FIB indices for
+    `month_calculated`: the `num_months` months before it. This matches the files
+    selected by scripts/data_prep/create_data_file_symlinks.py.
+
+    Example:
+    get_window_months("2023_02", 3)
+    >>> ['2022_11', '2022_12', '2023_01']
+
+    Parameters:
+    -----------
+    - month_calculated (str) : the month FIB indices are calculated for ("YYYY_MM")
+    - num_months (int) : the number of months in the window
+
+    Return:
+    -----------
+    - months (list) : list of "YYYY_MM" strings, in chronological order
+    """
+    end = datetime.datetime.strptime(month_calculated, "%Y_%m")
+    start = end - relativedelta(months=num_months)
+    last = end - relativedelta(months=1)
+    return get_months_in_range(f"{start:%Y_%m}..{last:%Y_%m}")
+
+
+def group_files_by_month(data_files):
+    """
+    Group raw data files by the month their data starts in (see `get_data_file_date`).
+
+    Parameters:
+    -----------
+    - data_files (list) : full paths to raw data files
+
+    Return:
+    -----------
+    - month_files (dict) : {"YYYY_MM" : [paths of that month's files]}. Months and
+        files keep the order of `data_files`.
+    """
+    month_files = dict()
+    for file in data_files:
+        month = get_data_file_date(file).strftime("%Y_%m")
+        month_files.setdefault(month, []).append(file)
+    return month_files
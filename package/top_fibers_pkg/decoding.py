@@ -0,0 +1,207 @@
+"""
+Functions for decoding the new-line delimited JSON posts in our raw data files.
+
+The fastest installed JSON library is used, falling back to the standard library:
+    - Full decoding: orjson > msgspec > json
+    - Selective decoding (only the fields used by `data_model`): msgspec. If msgspec
+        is not installed, selective decoders fall back to full decoding.
+
+Both optional libraries can be installed with pip:
+    pip install orjson msgspec
+
+Lines can also be checked before decoding (see `get_line_date_filter`), so lines
+without any post inside a FIB window are never decoded.
+"""
+import json
+import re
+
+from typing import Any, Optional, Union
+
+from .data_model import parse_crowdtangle_time, parse_twitter_v1_time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+if orjson is not None:
+    DECODER_BACKEND = "orjson"
+    _loads = orjson.loads
+elif msgspec is not None:
+    DECODER_BACKEND = "msgspec"
+    _loads = msgspec.json.decode
+else:
+    DECODER_BACKEND = "json"
+    _loads = json.loads
+
+SELECTIVE_DECODER_BACKEND = "msgspec" if msgspec is not None else DECODER_BACKEND
+
+PLATFORMS = ["twitter", "facebook"]
+
+# Date fields read from the raw bytes of a line by `get_line_date_filter`
+TWITTER_CREATED_AT_PATTERN = re.compile(rb'"created_at":\s*"([^"]*)"')
+CROWDTANGLE_DATE_PATTERN = re.compile(rb'"date":\s*"([^"]*)"')
+
+
+def loads(line):
+    """
+    Decode one JSON line into a dictionary with the fastest installed backend.
+
+    Parameters:
+    -----------
+    - line (bytes or str) : one JSON object (e.g., a line from a raw data file)
+
+    Returns:
+    -----------
+    - post_object (dict) : the fully decoded object
+    """
+    return _loads(line)
+
+
+if msgspec is not None:
+    # Only the fields listed in these structs are decoded. Everything else in a
+    # post is skipped by msgspec without building Python objects. Fields that
+    # are missing from a post stay UNSET and are dropped by `to_builtins`, so
+    # the resulting dictionaries look like a (smaller) fully decoded post.
+    UNSET = msgspec.UNSET
+    _Field = Union[Any, msgspec.UnsetType]
+
+    class _TwitterUser(msgspec.Struct):
+        id_str: _Field = UNSET
+        screen_name: _Field = UNSET
+        profile_image_url: _Field = UNSET
+
+    class _Tweet(msgspec.Struct):
+        id_str: _Field = UNSET
+        text: _Field = UNSET
+        created_at: _Field = UNSET
+        retweet_count: _Field = UNSET
+        user: Union[Optional[_TwitterUser], msgspec.UnsetType] = UNSET
+        retweeted_status: Union[Optional["_Tweet"], msgspec.UnsetType] = UNSET
+        quoted_status: Union[Optional["_Tweet"], msgspec.UnsetType] = UNSET
+
+    class _CtAccount(msgspec.Struct):
+        platformId: _Field = UNSET
+        handle: _Field = UNSET
+        name: _Field = UNSET
+        url: _Field = UNSET
+
+    class _CtActualStatistics(msgspec.Struct):
+        shareCount: _Field = UNSET
+
+    class _CtStatistics(msgspec.Struct):
+        actual: Union[Optional[_CtActualStatistics], msgspec.UnsetType] = UNSET
+
+    class _FbIgPost(msgspec.Struct):
+        id: _Field = UNSET
+        platformId: _Field = UNSET
+        platform: _Field = UNSET
+        date: _Field = UNSET
+        postUrl: _Field = UNSET
+        account: Union[Optional[_CtAccount], msgspec.UnsetType] = UNSET
+        statistics: Union[Optional[_CtStatistics], msgspec.UnsetType] = UNSET
+
+    _PLATFORM_STRUCTS = {"twitter": _Tweet, "facebook": _FbIgPost}
+
+
+def get_post_decoder(platform):
+    """
+    Return a function that decodes one raw line into a dictionary containing only
+    the fields that `data_model.Tweet_v1` (platform="twitter") or
+    `data_model.FbIgPost` (platform="facebook") read.
+
+    NOTE: Do not use this decoder if the decoded post will be written back to disk,
+    as all other fields are dropped. Use `loads` instead.
+
+    Parameters:
+    -----------
+    - platform (str) : one of ["twitter", "facebook"]
+
+    Returns:
+    -----------
+    - decode_post (function) : takes one line (bytes or str) and returns a dict
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+    if platform not in PLATFORMS:
+        raise ValueError(f"`platform` must be one of {PLATFORMS}!")
+
+    if msgspec is None:
+        return loads
+
+    decoder = msgspec.json.Decoder(_PLATFORM_STRUCTS[platform])
+    to_builtins = msgspec.to_builtins
+
+    def decode_post(line):
+        return to_builtins(decoder.decode(line))
+
+    return decode_post
+
+
+def get_line_date_filter(platform, earliest_tstamp):
+    """
+    Return a function that tells, from the raw bytes of one line, whether the line
+    may hold a post sent on or after `earliest_tstamp`. Lines it rejects can be
+    skipped without decoding them.
+
+    A line is only rejected when that is certain:
+        - Twitter: every "created_at" value in the line is before `earliest_tstamp`.
+            This includes the retweeted and quoted tweets, so a line is kept when
+            the original of an old retweet is inside the window. (Users' account
+            creation dates are older than their tweets, so they never cause a
+            line to be rejected.)
+        - CrowdTangle: the post's top-level "date" is before `earliest_tstamp`.
+    Lines without a date that can be read are always kept.
+
+    Parameters:
+    -----------
+    - platform (str) : one of ["twitter", "facebook"]
+    - earliest_tstamp (int) : the earliest post time (epoch seconds) to keep
+
+    Returns:
+    -----------
+    - keep_line (function) : takes one line (bytes) and returns False if the line
+        can be skipped
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+    if platform not in PLATFORMS:
+        raise ValueError(f"`platform` must be one of {PLATFORMS}!")
+
+    if platform == "twitter":
+        find_dates = TWITTER_CREATED_AT_PATTERN.finditer
+
+        def keep_line(line):
+            found_date = False
+            for match in find_dates(line):
+                timestamp = parse_twitter_v1_time(
+                    match.group(1).decode("ascii", "replace")
+                )
+                if timestamp is None or timestamp >= earliest_tstamp:
+                    return True
+                found_date = True
+            return not found_date
+
+        return keep_line
+
+    find_date = CROWDTANGLE_DATE_PATTERN.search
+
+    def keep_line(line):
+        match = find_date(line)
+        # Only trust the date if no nested object was opened before it
+        if match is None or line.find(b"{", 1, match.start()) != -1:
+            return True
+        timestamp = parse_crowdtangle_time(match.group(1).decode("ascii", "replace"))
+        return timestamp is None or timestamp >= earliest_tstamp
+
+    return keep_line
@@ -0,0 +1,243 @@
+"""
+Functions and a class to match URLs against a list of domains (e.g., the Iffy
+News list of low-credibility domains).
+
+Domains are stored in a trie of their labels in reverse order (com -> example ->
+news), so the domains that match a host are found by walking its labels once,
+from the top-level domain down, whatever the size of the list. A host matches a
+domain if it is the domain or one of its subdomains. Hosts are cached, so URLs of
+a host that was already seen are matched with a single dictionary lookup.
+
+Matching is aware of public suffixes (e.g., "co.uk" or "blogspot.com"): a listed
+domain that is a public suffix only matches itself, as its subdomains belong to
+unrelated owners. `get_registered_domain` also uses them to tell that the domain
+of "news.bbc.co.uk" is "bbc.co.uk" (not "co.uk").
+
+A few common public suffixes are built in (PUBLIC_SUFFIXES). The full Public
+Suffix List (https://publicsuffix.org/list/public_suffix_list.dat) can be loaded
+with `load_public_suffixes`.
+"""
+import glob
+import os
+
+from .utils import load_lines
+
+# Common multi-label public suffixes. Single labels (e.g., "com") are always
+# treated as public suffixes.
+PUBLIC_SUFFIXES = frozenset(
+    [
+        "co.uk",
+        "org.uk",
+        "ac.uk",
+        "gov.uk",
+        "me.uk",
+        "ltd.uk",
+        "plc.uk",
+        "com.au",
+        "net.au",
+        "org.au",
+        "co.nz",
+        "org.nz",
+        "co.za",
+        "co.in",
+        "co.jp",
+        "ne.jp",
+        "or.jp",
+        "co.kr",
+        "com.br",
+        "com.cn",
+        "com.mx",
+        "com.ar",
+        "com.tr",
+        "com.sg",
+        "com.hk",
+        "com.tw",
+        "blogspot.com",
+        "wordpress.com",
+        "substack.com",
+        "github.io",
+        "herokuapp.com",
+    ]
+)
+
+MATCH_CACHE_SIZE = 1_000_000
+
+# Trie key of the domain that ends at a node (never a valid domain label)
+_DOMAIN_KEY = ""
+
+
+def load_public_suffixes(path):
+    """
+    Load the public suffixes of a Public Suffix List file. Wildcard rules (e.g.,
+    "*.ck") are kept as written, and exception rules (e.g., "!www.ck") are skipped.
+
+    Parameters:
+    -----------
+    - path (str) : full path to a `public_suffix_list.dat` file
+
+    Returns:
+    -----------
+    - suffixes (frozenset) : the public suffixes, in lower case
+    """
+    suffixes = set()
+    for line in load_lines(path):
+        rule = line.strip()
+        if not rule or rule.startswith("//") or rule.startswith("!"):
+            continue
+        suffixes.add(rule.split()[0].lower())
+    return frozenset(suffixes)
+
+
+def clean_domain(domain):
+    """
+    Return a domain from the Iffy list as a lower case host, without scheme, "www."
+    prefix, path, or wildcard (e.g., "https://www.Example.com/*" -> "example.com").
+    """
+    domain = domain.strip().lower()
+    if "://" in domain:
+        domain = domain.split("://", 1)[1]
+    domain = domain.split("/", 1)[0].rstrip(".*")
+    if domain.startswith("www."):
+        domain = domain[4:]
+    return domain
+
+
+def get_host(url):
+    """
+    Return the host of a URL in lower case, without user info, port or trailing
+    dot (e.g., "https://user@News.Example.com:443/a" -> "news.example.com").
+    URLs without a scheme (e.g., "example.com/a") are read as hosts followed by a
+    path. Returns an empty string if the URL has no host.
+    """
+    if not url:
+        return ""
+    if "://" in url:
+        url = url.split("://", 1)[1]
+    elif url.startswith("//"):
+        url = url[2:]
+    for delimiter in "/?#":
+        url = url.split(delimiter, 1)[0]
+    host = url.rsplit("@", 1)[-1]
+    if not host.startswith("["):
+        host = host.split(":", 1)[0]
+    return host.rstrip(".").lower()
+
+
+def is_public_suffix(host, public_suffixes=PUBLIC_SUFFIXES):
+    """
+    Return True if `host` is a public suffix: a single label, listed in
+    `public_suffixes`, or matched by a wildcard rule (e.g., "*.ck").
+    """
+    if "." not in host:
+        return True
+    if host in public_suffixes:
+        return True
+    parent = host.split(".", 1)[1]
+    return f"*.{parent}" in public_suffixes
+
+
+def get_registered_domain(host, public_suffixes=PUBLIC_SUFFIXES):
+    """
+    Return the registered domain of a host: its longest public suffix plus the
+    label before it (e.g., "news.bbc.co.uk" -> "bbc.co.uk"). A host that is a
+    public suffix is returned as is.
+    """
+    labels = host.split(".")
+    for idx in range(1, len(labels)):
+        if is_public_suffix(".".join(labels[idx:]), public_suffixes):
+            return ".".join(labels[idx - 1 :])
+    return host
+
+
+def get_latest_domains_file(domains_dir):
+    """
+    Return the full path to the latest `*iffy_list.txt` file in `domains_dir`.
+    Files are named by date, so the latest one sorts last.
+    """
+    all_domains_files = sorted(glob.glob(os.path.join(domains_dir, "*iffy_list.txt")))
+    return all_domains_files[-1]
+
+
+class DomainMatcher:
+    """
+    Matcher of URLs against a list of domains, see the module docstring.
+
+    Parameters:
+    -----------
+    - domains (iterable) : the domains to match. They are cleaned with
+        `clean_domain`, so Iffy list entries can be passed as they are.
+    - public_suffixes (frozenset) : see `load_public_suffixes`. Default =
+        PUBLIC_SUFFIXES
+
+    Attributes:
+    -----------
+    - domains (set) : the (cleaned) domains of the matcher
+    """
+
+    def __init__(self, domains=(), public_suffixes=PUBLIC_SUFFIXES):
+        self.public_suffixes = public_suffixes
+        self.domains = set()
+        self._trie = dict()
+        self._cache = dict()
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        """
+        Add one domain to the matcher. Empty domains are ignored.
+        """
+        domain = clean_domain(domain)
+        if not domain or domain in self.domains:
+            return
+        node = self._trie
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, dict())
+        # Public suffixes only match themselves, not their subdomains
+        node[_DOMAIN_KEY] = (domain, is_public_suffix(domain, self.public_suffixes))
+        self.domains.add(domain)
+        self._cache.clear()
+
+    def _match_labels(self, labels):
+        matches = []
+        node = self._trie
+        num_labels = len(labels)
+        for idx in range(num_labels - 1, -1, -1):
+            node = node.get(labels[idx])
+            if node is None:
+                break
+            entry = node.get(_DOMAIN_KEY)
+            if entry is not None and (idx == 0 or not entry[1]):
+                matches.append(entry[0])
+        return tuple(matches)
+
+    def match_host(self, host):
+        """
+        Return the domains that `host` is (or is a subdomain of), from the least to
+        the most specific (e.g., ("example.com", "news.example.com")). Returns an
+        empty tuple if none match.
+        """
+        matches = self._cache.get(host)
+        if matches is None:
+            if len(self._cache) >= MATCH_CACHE_SIZE:
+                self._cache.clear()
+            matches = self._match_labels(host.split("."))
+            self._cache[host] = matches
+        return matches
+
+    def match_url(self, url):
+        """
+        Return the domains matched by the host of `url`, see `match_host`.
+        """
+        return self.match_host(get_host(url))
+
+    def match_urls(self, urls):
+        """
+        Return the set of domains matched by any of `urls`.
+        """
+        matches = set()
+        for url in urls:
+            matches.update(self.match_url(url))
+        return matches
+
+    def __len__(self):
+        return len(self.domains)
@@ -0,0 +1,138 @@
+"""
+Checkpoints of CrowdTangle downloads (see
+scripts/data_collection/crowdtangle_dl_fb_links.py), so a download that stops
+partway through can resume where it left off.
+
+The checkpoint is a new-line delimited JSON file saved next to the output file.
+Every time a page of posts is written (and flushed) to the output, one line is
+appended with the state of its search:
+    - domain (str) : the domain searched
+    - window (str) : the start of the sub-window searched (see
+        top_fibers_pkg.download_planner), or None for the domain's first search
+        over the whole period
+    - end (str) : the pagination cursor: the `end` time of the next page (None
+        once the search is done)
+    - posts (int) : number of posts written so far by the search
+    - queries (int) : number of pages written so far by the search
+    - done (bool) : True once the search is finished
+    - windows (list) : the [start, end] of the sub-windows the rest of the domain
+        was split into, if any (first search only)
+    - output_size (int) : size of the output file right after the page
+
+A domain is finished once its first search and all of its sub-windows are.
+
+Lines are written in the order of the output, so the last line holds the size of
+the output file up to which every page is accounted for. Anything after it was
+written by a page that was never checkpointed, and is cut off when resuming.
+"""
+import json
+import os
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+def get_checkpoint_path(output_path):
+    """
+    Return the path of the checkpoint for `output_path`.
+    E.g.: 2023-01-01--2023-02-01__fb_posts_w_links.jsonl.gzip ->
+        2023-01-01--2023-02-01__fb_posts_w_links.jsonl.gzip.checkpoint
+    """
+    return f"{output_path}{CHECKPOINT_SUFFIX}"
+
+
+class DownloadCheckpoint:
+    """
+    Per-domain progress of a download, saved to a checkpoint file.
+
+    Parameters:
+    -----------
+    - output_path (str) : full path to the download's output file
+    - resume (bool) : if True, the state saved by an earlier run is loaded.
+        Otherwise any earlier checkpoint is discarded. Default = False
+
+    Attributes:
+    -----------
+    - searches (dict) : the latest saved state of every search, by (domain,
+        window) (see the module docstring)
+    - output_size (int) : size of the output file at the last checkpoint (0 if
+        there is none)
+    """
+
+    def __init__(self, output_path, resume=False):
+        self.path = get_checkpoint_path(output_path)
+        self.searches = dict()
+        self.output_size = 0
+        if resume and os.path.exists(self.path):
+            self._load()
+        self._file = open(self.path, "a" if resume else "w")
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    state = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash is the last one
+                    break
+                self.searches[(state["domain"], state["window"])] = state
+                self.output_size = state["output_size"]
+
+    def get_state(self, domain, window=None):
+        """
+        Return the saved state of a search, or None if it was never checkpointed.
+        """
+        return self.searches.get((domain, window))
+
+    def is_done(self, domain, window=None):
+        """
+        Return True if a search is finished. For a domain's first search (`window`
+        = None), all of its sub-windows must be finished too.
+        """
+        state = self.get_state(domain, window)
+        if state is None or not state["done"]:
+            return False
+        if window is None:
+            return all(
+                self.is_done(domain, window_start)
+                for window_start, _ in state.get("windows") or []
+            )
+        return True
+
+    def save(
+        self, domain, end, posts, queries, done, output_size, window=None, windows=None
+    ):
+        """
+        Save the state of a search after a page was written and flushed to the
+        output (see gzip_io.BgzfWriter.flush), which is then `output_size` bytes.
+        """
+        state = {
+            "domain": domain,
+            "window": window,
+            "end": end,
+            "posts": posts,
+            "queries": queries,
+            "done": done,
+            "windows": windows,
+            "output_size": output_size,
+        }
+        self._file.write(f"{json.dumps(state)}\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.searches[(domain, window)] = state
+        self.output_size = output_size
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        """
+        Close and delete the checkpoint file (e.g., once the download is complete).
+        """
+        self.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
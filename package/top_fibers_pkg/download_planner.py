@@ -0,0 +1,84 @@
+"""
+Functions that plan the CrowdTangle download of dense domains (see
+scripts/data_collection/crowdtangle_dl_fb_links.py).
+
+Posts are searched newest first and paged backward, one page after another. When
+the first page of a domain comes back full, its time span gives the domain's post
+rate, and the rest of the period is split into sub-windows that are each expected
+to hold about `posts_per_window` posts. Every sub-window is then paged on its own,
+so the pages of a dense domain can be requested in parallel.
+
+Consecutive sub-windows share their boundary second, so no post is lost whether
+the API treats `endDate` as inclusive or not. Posts sent on a boundary second can
+therefore be returned twice and must be deduplicated on their `platformId` (see
+top_fibers_pkg.post_dedup).
+"""
+import datetime
+import math
+
+CT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Sub-windows per dense domain, at most
+MAX_WINDOWS = 16
+
+# Pages each sub-window is expected to take
+WINDOW_PAGES = 5
+
+
+def parse_ct_date(date_str):
+    """
+    Parse the `date` of a CrowdTangle post (e.g., "2023-01-31 23:59:59").
+    """
+    return datetime.datetime.strptime(date_str, CT_DATE_FORMAT)
+
+
+def estimate_post_rate(num_posts, oldest, newest):
+    """
+    Return the number of posts per second of a page of `num_posts` posts sent
+    between `oldest` and `newest` (datetime objects). A page that spans less than
+    one second counts as one second.
+    """
+    seconds = max((newest - oldest).total_seconds(), 1)
+    return num_posts / seconds
+
+
+def plan_windows(start, end, post_rate, posts_per_window, max_windows=MAX_WINDOWS):
+    """
+    Split the period from `start` to `end` into consecutive sub-windows of equal
+    length, each expected to hold about `posts_per_window` posts at `post_rate`.
+
+    Parameters:
+    -----------
+    - start (datetime.datetime) : the start of the period
+    - end (datetime.datetime) : the end of the period
+    - post_rate (float) : expected posts per second (see `estimate_post_rate`)
+    - posts_per_window (int) : posts each sub-window should hold
+    - max_windows (int) : the most sub-windows returned. Default = MAX_WINDOWS
+
+    Returns:
+    -----------
+    - windows (list) : (window_start, window_end) datetime tuples, newest first.
+        Each window starts on the second its older neighbor ends. A single window
+        (the whole period) means the period does not need to be split.
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+    if posts_per_window < 1 or max_windows < 1:
+        raise ValueError("`posts_per_window` and `max_windows` must be positive!")
+    seconds = int((end - start).total_seconds())
+    if seconds <= 1:
+        return [(start, end)]
+
+    expected_posts = post_rate * seconds
+    num_windows = math.ceil(expected_posts / posts_per_window)
+    num_windows = max(1, min(num_windows, max_windows, seconds))
+
+    # Boundaries are whole seconds, so they match the dates of posts
+    bounds = [
+        start + datetime.timedelta(seconds=seconds * i // num_windows)
+        for i in range(num_windows + 1)
+    ]
+    windows = list(zip(bounds[:-1], bounds[1:]))
+    return windows[::-1]
@@ -1,15 +1,23 @@
 """
 A collection of functions that are utilized in the calc_fib_indices.py script.
 """
+import numpy as np
 import pandas as pd
 
 from collections import defaultdict, Counter
 
+# Lists with at least this many reshare counts are handled by the linear-time
+# counting kernel. Below it, sorting the (short) list is faster.
+FIB_COUNTING_KERNEL_MIN_POSTS = 256
+
 
 def calc_fib_index(rt_counts):
     """
     Calculate a user's FIB-index based a list of the retweet counts they earned.
 
+    NOTE: Long lists (>= FIB_COUNTING_KERNEL_MIN_POSTS) are passed to
+        `calc_fib_index_counting`, which does not sort.
+
     Parameters:
     -----------
     - rt_counts (list) : list of retweet count values for retweets sent by a user
@@ -25,6 +33,9 @@ def calc_fib_index(rt_counts):
     if not isinstance(rt_counts, list):
         raise TypeError("`rt_counts` must be a list!")
 
+    if len(rt_counts) >= FIB_COUNTING_KERNEL_MIN_POSTS:
+        return calc_fib_index_counting(rt_counts)
+
     rt_counts.sort()
     for fib_position in range(1, len(rt_counts) + 1)[::-1]:
         if rt_counts[-fib_position] >= fib_position:
@@ -35,6 +46,219 @@ def calc_fib_index(rt_counts):
     return fib_position
 
 
+def calc_fib_index_counting(rt_counts):
+    """
+    Calculate a user's FIB-index in linear time, without sorting.
+
+    A FIB index can never be larger than the number of posts (n), so every
+    count is placed in one of n + 1 buckets (counts above n share the last
+    bucket). Walking the buckets from the top, the FIB index is the first
+    position h where at least h posts have been seen.
+
+    Parameters:
+    -----------
+    - rt_counts (list or numpy.ndarray) : retweet count values for retweets sent by a user
+
+    Return:
+    -----------
+    - fib_position (int) : a user's FIB index
+
+    Errors:
+    -----------
+    - TypeError
+    """
+    if not isinstance(rt_counts, (list, np.ndarray)):
+        raise TypeError("`rt_counts` must be a list or numpy.ndarray!")
+
+    num_posts = len(rt_counts)
+    if num_posts == 0:
+        return 0
+
+    counts = np.asarray(rt_counts, dtype=np.int64)
+    buckets = np.bincount(np.clip(counts, 0, num_posts), minlength=num_posts + 1)
+
+    # num_at_least[h] = number of posts with at least h reshares
+    num_at_least = np.cumsum(buckets[::-1])[::-1]
+    positions = np.arange(num_posts + 1)
+    return int(np.flatnonzero(num_at_least >= positions)[-1])
+
+
+def build_reshare_csr(userid_reshare_lists):
+    """
+    Flatten a {user_id : [reshare counts]} mapping into a CSR-style layout that
+    can be handed to `calc_fib_indices_batch`.
+
+    Parameters:
+    -----------
+    - userid_reshare_lists (dict) : {userid_x : list([reshare count (int) for each post sent by user_x])}
+
+    Returns:
+    -----------
+    - user_ids (list) : user IDs, in the same order as `userid_reshare_lists`
+    - reshare_counts (numpy.ndarray) : all reshare counts, grouped by user
+    - offsets (numpy.ndarray) : array of length len(user_ids) + 1 where the counts
+        of user_ids[i] are stored in reshare_counts[offsets[i] : offsets[i + 1]]
+
+    Exceptions:
+    -----------
+    - TypeError
+    """
+    if not isinstance(userid_reshare_lists, dict):
+        raise TypeError("`userid_reshare_lists` must be a dict!")
+
+    user_ids = list(userid_reshare_lists.keys())
+    group_sizes = np.fromiter(
+        (len(counts) for counts in userid_reshare_lists.values()),
+        dtype=np.int64,
+        count=len(user_ids),
+    )
+    offsets = np.zeros(len(user_ids) + 1, dtype=np.int64)
+    np.cumsum(group_sizes, out=offsets[1:])
+
+    reshare_counts = np.fromiter(
+        (count for counts in userid_reshare_lists.values() for count in counts),
+        dtype=np.int64,
+        count=int(offsets[-1]),
+    )
+    return user_ids, reshare_counts, offsets
+
+
+def _calc_fib_indices_sorting(reshare_counts, offsets):
+    """
+    Calculate the FIB-index of every user (CSR layout, see
+    `calc_fib_indices_batch`) with one segmented sort.
+    """
+    num_users = len(offsets) - 1
+    if len(reshare_counts) == 0:
+        return np.zeros(num_users, dtype=np.int64)
+
+    group_sizes = np.diff(offsets)
+    id_dtype = np.int32 if num_users <= np.iinfo(np.int32).max else np.int64
+    group_ids = np.repeat(np.arange(num_users, dtype=id_dtype), group_sizes)
+
+    # A FIB index can never be larger than the user's number of posts, so counts
+    # are clipped to that size (and to 0) without changing the result. This keeps
+    # the values small enough to pack (user, descending count) into one int64 key,
+    # which sorts much faster than a two-key lexsort. The steps below work in
+    # place on `keys` so that only one int64 array per post is kept.
+    max_size = int(group_sizes.max())
+    keys = np.clip(reshare_counts, 0, group_sizes[group_ids]).astype(np.int64)
+    np.subtract(max_size, keys, out=keys)
+    keys += group_ids.astype(np.int64) * (max_size + 1)
+    keys.sort()
+
+    # Back to the (descending) counts of every user
+    np.remainder(keys, max_size + 1, out=keys)
+    np.subtract(max_size, keys, out=keys)
+
+    # Counts are descending and 1-based ranks ascending within a user, so the
+    # posts that satisfy count >= rank form a prefix whose length is the FIB
+    # index. With rank = position - offset + 1, that is
+    # count + offset - position > 0.
+    keys += offsets[group_ids]
+    keys -= np.arange(len(keys), dtype=np.int64)
+    qualifies = keys > 0
+    del keys
+    return np.bincount(group_ids[qualifies], minlength=num_users).astype(np.int64)
+
+
+def _calc_fib_indices_counting(reshare_counts, offsets):
+    """
+    Calculate the FIB-index of every user (CSR layout, see
+    `calc_fib_indices_batch`) in linear time, like `calc_fib_index_counting`
+    for all users at once.
+
+    User i gets n_i + 1 buckets (n_i = its number of posts), stored one user
+    after another. A user's bucket h qualifies if at least h of its posts have h
+    or more reshares. These buckets form a prefix (h = 0 always qualifies) whose
+    last position is the FIB index, so the FIB index is the number of qualifying
+    buckets minus one.
+    """
+    num_users = len(offsets) - 1
+    group_sizes = np.diff(offsets)
+    bucket_offsets = offsets + np.arange(num_users + 1, dtype=np.int64)
+
+    keys = np.clip(reshare_counts, 0, np.repeat(group_sizes, group_sizes))
+    keys += np.repeat(bucket_offsets[:-1], group_sizes)
+    buckets = np.bincount(keys, minlength=int(bucket_offsets[-1]))
+    del keys
+
+    # Bucket b of user i holds position h = b - bucket_offsets[i], and the posts
+    # of user i with fewer than h reshares are those in its buckets before b,
+    # i.e., (buckets + 1) summed over all buckets before b, minus b and minus
+    # offsets[i]. So "n_i - (posts below h) >= h" is
+    # "(buckets + 1) summed before b <= offsets[i + 1] + bucket_offsets[i]".
+    buckets += 1
+    summed_before = np.cumsum(buckets)
+    summed_before -= buckets
+    del buckets
+    qualifies = summed_before <= np.repeat(
+        offsets[1:] + bucket_offsets[:-1], group_sizes + 1
+    )
+    del summed_before
+    return np.add.reduceat(qualifies, bucket_offsets[:-1], dtype=np.int64) - 1
+
+
+def calc_fib_indices_batch(
+    reshare_counts, offsets, counting_min_posts=FIB_COUNTING_KERNEL_MIN_POSTS
+):
+    """
+    Calculate the FIB-index of many users at once.
+
+    Users are passed in a CSR-style layout: the reshare counts of user i are
+    stored in reshare_counts[offsets[i] : offsets[i + 1]]. Users with fewer than
+    `counting_min_posts` posts are handled in one segmented sort, and the others
+    with segmented bucket counting (see `calc_fib_index_counting`), which does
+    not sort their long lists. This returns the same values as calling
+    `calc_fib_index` on each user's list, without the per-user Python loop.
+
+    Parameters:
+    -----------
+    - reshare_counts (numpy.ndarray) : flat array of reshare counts, grouped by user
+    - offsets (numpy.ndarray) : monotonically increasing array of length num_users + 1.
+        The first value must be 0 and the last value must be len(reshare_counts)
+    - counting_min_posts (int) : users with at least this many posts are handled
+        by bucket counting. Default = FIB_COUNTING_KERNEL_MIN_POSTS
+
+    Return:
+    -----------
+    - fib_indices (numpy.ndarray) : FIB index (int64) of each user
+
+    Errors:
+    -----------
+    - TypeError, ValueError
+    """
+    if not isinstance(reshare_counts, np.ndarray):
+        raise TypeError("`reshare_counts` must be a numpy.ndarray!")
+    if not isinstance(offsets, np.ndarray):
+        raise TypeError("`offsets` must be a numpy.ndarray!")
+    if not isinstance(counting_min_posts, int):
+        raise TypeError("`counting_min_posts` must be an integer!")
+    if offsets.ndim != 1 or len(offsets) == 0:
+        raise ValueError("`offsets` must be a non-empty 1D array!")
+    if offsets[0] != 0 or offsets[-1] != len(reshare_counts):
+        raise ValueError("`offsets` must start at 0 and end at len(reshare_counts)!")
+
+    group_sizes = np.diff(offsets)
+    is_large = group_sizes >= counting_min_posts
+    if not is_large.any():
+        return _calc_fib_indices_sorting(reshare_counts, offsets)
+    if is_large.all():
+        return _calc_fib_indices_counting(reshare_counts, offsets)
+
+    # Split the users (and their counts) by kernel
+    fib_indices = np.zeros(len(group_sizes), dtype=np.int64)
+    row_is_large = np.repeat(is_large, group_sizes)
+    for kernel, users, rows in [
+        (_calc_fib_indices_sorting, ~is_large, ~row_is_large),
+        (_calc_fib_indices_counting, is_large, row_is_large),
+    ]:
+        user_offsets = np.zeros(int(users.sum()) + 1, dtype=np.int64)
+        np.cumsum(group_sizes[users], out=user_offsets[1:])
+        fib_indices[users] = kernel(reshare_counts[rows], user_offsets)
+    return fib_indices
+
+
 def create_userid_total_reshares(postid_num_reshares, userid_postids):
     """
     Create a dictionary mapping userIDs to the total number of reshares
@@ -129,18 +353,15 @@ def create_fib_frame(userid_reshare_lists, userid_username, userid_total_reshare
     if not isinstance(userid_reshare_lists, dict):
         raise TypeError("`userid_reshare_lists` must be a dict!")
 
-    user_records = []
     try:
-        for userid, rt_cnt_list in userid_reshare_lists.items():
-            user_records.append(
-                {
-                    "user_id": userid,
-                    "username": userid_username[userid],
-                    "fib_index": calc_fib_index(rt_cnt_list),
-                }
-            )
-
-        fib_frame = pd.DataFrame.from_records(user_records)
+        user_ids, reshare_counts, offsets = build_reshare_csr(userid_reshare_lists)
+        fib_frame = pd.DataFrame(
+            {
+                "user_id": user_ids,
+                "username": [userid_username[userid] for userid in user_ids],
+                "fib_index": calc_fib_indices_batch(reshare_counts, offsets),
+            }
+        )
 
         userid_total_reshares_frame = pd.DataFrame.from_records(
             list(userid_total_reshares.items()), columns=["user_id", "total_reshares"]
@@ -151,6 +372,50 @@ def create_fib_frame(userid_reshare_lists, userid_username, userid_total_reshare
         raise Exception(e)
 
 
+def get_top_k_indices(values, num):
+    """
+    Return the positions of the `num` largest `values`, from largest to smallest.
+    Ties are broken by position (earlier positions first), so the selection does
+    not depend on the sorting algorithm.
+
+    The cutoff value is found with np.partition in linear time and only the values
+    at or above it are sorted, so the full array is never sorted.
+
+    Parameters:
+    -----------
+    - values (numpy.ndarray) : 1D array of values to rank (e.g., FIB indices)
+    - num (int) : number of positions to return. If it is larger than the number
+        of values, all positions are returned
+
+    Returns:
+    -----------
+    - top_indices (numpy.ndarray) : int64 positions into `values`
+
+    Exceptions:
+    -----------
+    TypeError, ValueError
+    """
+    if not isinstance(values, np.ndarray):
+        raise TypeError("`values` must be a numpy.ndarray!")
+    if not isinstance(num, int):
+        raise TypeError("`num` must be an integer!")
+    if num < 0:
+        raise ValueError("`num` must be non-negative!")
+
+    num = min(num, len(values))
+    if num == 0:
+        return np.array([], dtype=np.int64)
+    if num < len(values):
+        cutoff = np.partition(values, len(values) - num)[len(values) - num]
+        candidates = np.flatnonzero(values >= cutoff)
+    else:
+        candidates = np.arange(len(values), dtype=np.int64)
+
+    # Ascending by (value, -position), reversed: descending values, ties by position
+    order = np.lexsort((-candidates, values[candidates]))[::-1]
+    return candidates[order[:num]].astype(np.int64)
+
+
 def get_top_spreaders(fib_frame, num, rank_type=None):
     """
     Return the top `num` spreaders of misinformation from the fib_frame.
@@ -160,14 +425,15 @@ def get_top_spreaders(fib_frame, num, rank_type=None):
     - fib_frame (pandas.DataFrame) : a dataframe containing the following columns:
         - user_id (str) : the user's Twitter user ID
         - username (str) : the user's username/handle
-        - fib_index (int) : the fib index for that user (sorted in descending order)
+        - fib_index (int) : the fib index for that user
     - num (int) : number of top spreaders to return
     - rank_type (str) : the column to utilize for ranking (descending order)
         - Options: ["total_reshares", "fib_index"]
 
     Return:
     -----------
-    - top_spreaders (set) : set of user IDs for the top spreaders
+    - top_spreaders (set) : set of user IDs for the top spreaders. Ties are broken
+        by row order (see `get_top_k_indices`)
 
     Exceptions:
     -----------
@@ -180,9 +446,9 @@ def get_top_spreaders(fib_frame, num, rank_type=None):
     if not isinstance(num, int):
         raise TypeError("`num` must be an integer!")
 
-    # Get top 50 users with most total retweets
-    fib_frame.sort_values(by=rank_type, ascending=False, inplace=True)
-    return set(list(fib_frame["user_id"].head(num)))
+    # Get top `num` users without sorting the whole frame
+    top_indices = get_top_k_indices(fib_frame[rank_type].to_numpy(), num)
+    return set(fib_frame["user_id"].to_numpy()[top_indices])
 
 
 def create_top_spreader_df(
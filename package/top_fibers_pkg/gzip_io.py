@@ -0,0 +1,485 @@
+"""
+Functions for reading and writing our gzipped raw data files (`*.jsonl.gzip`).
+
+Reading uses the fastest installed backend, falling back to the standard library:
+    isal (igzip) > zlib-ng > pigz (subprocess) > gzip
+
+The Python backends decompress in a background thread and pigz in its own
+process, so decompression overlaps with JSON parsing. Both optional libraries can
+be installed with pip:
+    pip install isal zlib-ng
+
+New raw files can be written as BGZF (see `BgzfWriter`): a series of small gzip
+members, like the files written by samtools/htslib. They are still valid gzip
+files that any tool can read, but their blocks can also be decompressed in
+parallel, which `iter_gzip_lines` does automatically.
+"""
+import gzip
+import io
+import os
+import shutil
+import struct
+import subprocess
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from isal import igzip_threaded
+except ImportError:
+    igzip_threaded = None
+
+try:
+    from zlib_ng import gzip_ng_threaded
+except ImportError:
+    gzip_ng_threaded = None
+
+PIGZ_PATH = shutil.which("pigz")
+
+if igzip_threaded is not None:
+    GZIP_READ_BACKEND = "isal"
+elif gzip_ng_threaded is not None:
+    GZIP_READ_BACKEND = "zlib-ng"
+elif PIGZ_PATH is not None:
+    GZIP_READ_BACKEND = "pigz"
+else:
+    GZIP_READ_BACKEND = "gzip"
+
+# Lines are read in batches of about this many (decompressed) bytes
+READ_BATCH_BYTES = 4 * 1024 * 1024
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Threads used to decompress the blocks of BGZF files
+BGZF_READ_THREADS = min(4, os.cpu_count() or 1)
+# Blocks decompressed ahead of the reader, per thread
+BGZF_READ_AHEAD = 16
+
+# BGZF blocks hold at most this many uncompressed bytes, so that a compressed
+# block always fits within the 64 KiB the block size field can describe
+BGZF_BLOCK_SIZE = 0xFF00
+BGZF_COMPRESS_LEVEL = 6
+
+# ID1 ID2 CM FLG | MTIME | XFL OS | XLEN | SI1 SI2 | SLEN | BSIZE - 1
+_BGZF_HEADER = struct.Struct("<4BI2BH2sHH")
+BGZF_HEADER_SIZE = _BGZF_HEADER.size
+# Empty block marking the end of a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def _get_bgzf_block_size(header):
+    """
+    Return the total size (bytes) of the BGZF block starting with `header`, or None
+    if `header` does not start a BGZF block.
+    """
+    if len(header) != BGZF_HEADER_SIZE:
+        return None
+    id1, id2, cm, flg, _, _, _, xlen, subfield, slen, bsize = _BGZF_HEADER.unpack(
+        header
+    )
+    if (id1, id2, cm, flg, xlen, subfield, slen) != (31, 139, 8, 4, 6, b"BC", 2):
+        return None
+    return bsize + 1
+
+
+def is_bgzf(path):
+    """
+    Return True if the file at `path` is a BGZF file (e.g., written by `BgzfWriter`).
+    """
+    with open(path, "rb") as f:
+        return _get_bgzf_block_size(f.read(BGZF_HEADER_SIZE)) is not None
+
+
+class _ProcessReader:
+    """
+    Read the standard output of a process (e.g., `pigz -dc file`) like a file.
+
+    The process is killed if the reader is closed before the end of its output.
+    Otherwise, an OSError is raised on close if the process failed.
+    """
+
+    def __init__(self, args):
+        self._args = args
+        self._process = subprocess.Popen(
+            args, stdout=subprocess.PIPE, bufsize=READ_BUFFER_SIZE
+        )
+        self._stdout = self._process.stdout
+        self._at_eof = False
+
+    def read(self, size=-1):
+        data = self._stdout.read(size)
+        self._at_eof = self._at_eof or not data
+        return data
+
+    def readlines(self, hint=-1):
+        lines = self._stdout.readlines(hint)
+        self._at_eof = self._at_eof or not lines
+        return lines
+
+    def __iter__(self):
+        yield from self._stdout
+        self._at_eof = True
+
+    def close(self):
+        if self._process.returncode is not None:
+            return
+        if not self._at_eof and self._process.poll() is None:
+            self._process.kill()
+        returncode = self._process.wait()
+        self._stdout.close()
+        if returncode > 0:
+            raise OSError(f"Command failed ({returncode}): {' '.join(self._args)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_gzip(path):
+    """
+    Open a gzipped file for reading (binary) with the fastest installed backend (see
+    GZIP_READ_BACKEND).
+
+    Parameters:
+    -----------
+    - path (str) : full path to a gzipped file
+
+    Returns:
+    -----------
+    - f (file object) : a readable binary file object, which can be used as a
+        context manager and iterated over line by line
+    """
+    if GZIP_READ_BACKEND == "isal":
+        return igzip_threaded.open(path, "rb", threads=1)
+    elif GZIP_READ_BACKEND == "zlib-ng":
+        return gzip_ng_threaded.open(path, "rb", threads=1)
+    elif GZIP_READ_BACKEND == "pigz":
+        return _ProcessReader([PIGZ_PATH, "-dc", path])
+    return io.BufferedReader(gzip.open(path, "rb"), buffer_size=READ_BUFFER_SIZE)
+
+
+def _iter_bgzf_blocks(f):
+    """
+    Yield the compressed data of every block of the BGZF file `f`, including the
+    CRC32 and size trailer.
+    """
+    while True:
+        header = f.read(BGZF_HEADER_SIZE)
+        if not header:
+            return
+        block_size = _get_bgzf_block_size(header)
+        if block_size is None:
+            raise OSError(f"Invalid BGZF block header in file: {f.name}")
+        block = f.read(block_size - BGZF_HEADER_SIZE)
+        if len(block) != block_size - BGZF_HEADER_SIZE:
+            raise EOFError(f"Truncated BGZF block in file: {f.name}")
+        yield block
+
+
+def _inflate_bgzf_block(block):
+    """
+    Decompress the data of one BGZF block and check it against its trailer.
+    """
+    data = zlib.decompress(block[:-8], -zlib.MAX_WBITS)
+    crc, size = struct.unpack("<II", block[-8:])
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise OSError("Corrupt BGZF block (CRC32 or size mismatch)")
+    return data
+
+
+def _iter_bgzf_data(path, threads):
+    """
+    Yield the decompressed data of every block of the BGZF file at `path`, in
+    order. Blocks are decompressed by a pool of threads (zlib releases the GIL).
+    """
+    with open(path, "rb") as f, ThreadPoolExecutor(threads) as executor:
+        pending = deque()
+        for block in _iter_bgzf_blocks(f):
+            pending.append(executor.submit(_inflate_bgzf_block, block))
+            if len(pending) >= threads * BGZF_READ_AHEAD:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _iter_data_lines(chunks):
+    """
+    Yield the lines (ending with b"\\n", except maybe the last one) of the data
+    in `chunks`. Lines may be split across chunks.
+    """
+    remainder = b""
+    for chunk in chunks:
+        data = remainder + chunk if remainder else chunk
+        end = data.rfind(b"\n") + 1
+        remainder = data[end:]
+        if end:
+            yield from io.BytesIO(data[:end])
+    if remainder:
+        yield remainder
+
+
+def iter_gzip_member_data(path):
+    """
+    Yield the decompressed data of a gzipped file in chunks, along with the
+    (compressed) offset at which each gzip member ends. A new member can be read
+    on its own by seeking to that offset.
+
+    Files written by `BgzfWriter` have a member every BGZF_BLOCK_SIZE bytes;
+    files written by gzip usually have a single member.
+
+    Parameters:
+    -----------
+    - path (str) : full path to a gzipped file
+
+    Yields:
+    -----------
+    - data (bytes) : the next chunk of decompressed data
+    - member_end (int) : if `data` is the end of a member, the offset of the
+        first byte after that member. Otherwise, None.
+
+    Exceptions:
+    -----------
+    - EOFError
+    """
+    with open(path, "rb") as f:
+        yield from _inflate_members(_iter_file_chunks(f), path)
+
+
+def iter_gzip_lines_with_offsets(path):
+    """
+    Yield the lines of a gzipped file along with the (compressed) offset of the
+    gzip member each line starts in. Reading from that offset (e.g., with
+    `iter_gzip_range_lines`) finds the line again without reading the whole file.
+
+    Parameters:
+    -----------
+    - path (str) : full path to a gzipped file
+
+    Yields:
+    -----------
+    - offset (int) : offset of the gzip member where the line starts
+    - line (bytes) : one line of the file, including its trailing b"\\n"
+    """
+    member_start = 0
+    remainder = b""
+    remainder_start = 0
+    for data, member_end in iter_gzip_member_data(path):
+        # Only the first line may have started in an earlier member
+        start = member_start
+        if remainder:
+            data = remainder + data
+            start = remainder_start
+        end = data.rfind(b"\n") + 1
+        for line in io.BytesIO(data[:end]):
+            yield start, line
+            start = member_start
+        remainder = data[end:]
+        remainder_start = start
+        if member_end is not None:
+            member_start = member_end
+    if remainder:
+        yield remainder_start, remainder
+
+
+def _iter_file_chunks(f, length=None):
+    """
+    Yield the next `length` bytes (default: all remaining bytes) of the open file
+    `f` in chunks of at most READ_BUFFER_SIZE bytes.
+    """
+    while length is None or length > 0:
+        size = READ_BUFFER_SIZE if length is None else min(READ_BUFFER_SIZE, length)
+        data = f.read(size)
+        if not data:
+            return
+        if length is not None:
+            length -= len(data)
+        yield data
+
+
+def _inflate_members(chunks, name):
+    """
+    Decompress the gzip members in `chunks` (compressed bytes) and yield the same
+    (data, member_end) pairs as `iter_gzip_member_data`, with offsets relative to
+    the first chunk.
+    """
+    offset = 0
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    in_member = False
+    for data in chunks:
+        while data:
+            chunk = decompressor.decompress(data)
+            in_member = True
+            if decompressor.eof:
+                unused = decompressor.unused_data
+                offset += len(data) - len(unused)
+                yield chunk, offset
+                data = unused
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                in_member = False
+            else:
+                offset += len(data)
+                data = b""
+                if chunk:
+                    yield chunk, None
+    if in_member:
+        raise EOFError(f"Truncated gzip member in file: {name}")
+
+
+def iter_gzip_range_lines(f, offset, length):
+    """
+    Yield the lines of the whole gzip members stored in `length` bytes at `offset`
+    of an open gzipped file (e.g., one block of a block index, see
+    top_fibers_pkg.block_index).
+
+    Parameters:
+    -----------
+    - f (file object) : a gzipped file opened in binary mode
+    - offset (int) : offset of the first member
+    - length (int) : total compressed size of the members
+
+    Yields:
+    -----------
+    - line (bytes) : one line of the members' data, including its trailing b"\n"
+
+    Exceptions:
+    -----------
+    - EOFError
+    """
+    f.seek(offset)
+    members = _inflate_members(_iter_file_chunks(f, length), f.name)
+    yield from _iter_data_lines(data for data, _ in members)
+
+
+def iter_gzip_lines(path, threads=None):
+    """
+    Yield the lines of a gzipped file. Lines are read in large batches, with
+    the fastest installed backend (see `open_gzip`), or in parallel if the file is
+    BGZF (see `BgzfWriter`).
+
+    Parameters:
+    -----------
+    - path (str) : full path to a gzipped file
+    - threads (int) : number of threads decompressing BGZF files. Default = None
+        (BGZF_READ_THREADS)
+
+    Yields:
+    -----------
+    - line (bytes) : one line of the file, including its trailing b"\\n"
+    """
+    if threads is None:
+        threads = BGZF_READ_THREADS
+    if threads > 1 and is_bgzf(path):
+        yield from _iter_data_lines(_iter_bgzf_data(path, threads))
+        return
+
+    with open_gzip(path) as f:
+        while True:
+            lines = f.readlines(READ_BATCH_BYTES)
+            if not lines:
+                return
+            yield from lines
+
+
+class BgzfWriter:
+    """
+    Write a BGZF file: a gzip file made of independent blocks of at most
+    BGZF_BLOCK_SIZE uncompressed bytes, followed by an empty end-of-file block.
+
+    Blocks end on a new line whenever possible, so every block of a new-line
+    delimited JSON file holds whole lines. The result can be read by any gzip
+    reader, and in parallel by `iter_gzip_lines`.
+
+    Parameters:
+    -----------
+    - path (str) : full path to the output file
+    - compresslevel (int) : zlib compression level (0-9). Default = 6
+    - append (bool) : if True, blocks are added to the end of an existing file,
+        which should have been cut right before its end-of-file block (see
+        `flush`). Default = False (the file is overwritten)
+
+    Example:
+    -----------
+    with BgzfWriter("2023-01-01__tweets_w_links.jsonl.gzip") as f:
+        f.write(b'{"id_str": "1"}\\n')
+    """
+
+    def __init__(self, path, compresslevel=BGZF_COMPRESS_LEVEL, append=False):
+        self.name = path
+        self.compresslevel = compresslevel
+        self._file = open(path, "ab" if append else "wb")
+        self._buffer = bytearray()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def write(self, data):
+        """
+        Write `data` (bytes) and return the number of bytes written.
+        """
+        buffer = self._buffer
+        buffer += data
+        start = 0
+        while len(buffer) - start >= BGZF_BLOCK_SIZE:
+            limit = start + BGZF_BLOCK_SIZE
+            end = buffer.rfind(b"\n", start, limit) + 1
+            if end <= start:
+                # A single line longer than a block is split across blocks
+                end = limit
+            self._write_block(buffer[start:end])
+            start = end
+        del buffer[:start]
+        return len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(
+            self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = BGZF_HEADER_SIZE + len(compressed) + 8
+        header = _BGZF_HEADER.pack(
+            31, 139, 8, 4, 0, 0, 255, 6, b"BC", 2, block_size - 1
+        )
+        trailer = struct.pack("<II", zlib.crc32(data), len(data))
+        self._file.write(header + compressed + trailer)
+
+    def flush(self, sync=False):
+        """
+        Write the buffered data as a (possibly short) block and flush the file, so
+        everything written so far is a valid run of gzip members. If `sync`, the
+        data is also forced to disk (os.fsync).
+
+        Returns:
+        -----------
+        - size (int) : size of the file. Cutting the file to this size after a
+            crash keeps all data written before this call.
+        """
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        """
+        Write the remaining data and the end-of-file block, then close the file.
+        """
+        if self._file.closed:
+            return
+        try:
+            if self._buffer:
+                self._write_block(bytes(self._buffer))
+                self._buffer.clear()
+            self._file.write(BGZF_EOF)
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
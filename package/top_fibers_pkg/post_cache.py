@@ -0,0 +1,354 @@
+"""
+Functions for the columnar post cache.
+
+Each raw `*.jsonl.gzip` file is converted once into a slim Parquet table holding
+only what the FIB calculation needs. Because our FIB windows span three months,
+every raw file is otherwise parsed three times (more when backfilling).
+
+Cache files are keyed by the raw file's size and modification time. If the raw
+file changes, its cache is considered stale and readers fall back to the raw file.
+"""
+import itertools
+import math
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .data_model import Tweet_v1, FbIgPost, iter_post_wrappers
+from .decoding import get_line_date_filter, get_post_decoder
+from .gzip_io import iter_gzip_lines
+
+CACHE_VERSION = "2"
+CACHE_FILE_SUFFIX = ".parquet"
+RAW_FILE_SUFFIX = ".jsonl.gzip"
+CACHE_BATCH_ROWS = 500_000
+
+# Values of the `post_type` column. Retweeted and quoted posts are the original
+# posts embedded in a retweet or quote (Twitter only).
+POST_TYPE_BASE = 0
+POST_TYPE_RETWEETED = 1
+POST_TYPE_QUOTED = 2
+
+# Order of the values in every record yielded by `iter_post_records`
+POST_CACHE_COLUMNS = [
+    "post_id",
+    "user_id",
+    "username",
+    "reshare_count",
+    "timestamp",
+    "url",
+    "post_type",
+    "profile_image_url",
+]
+POST_CACHE_SCHEMA = pa.schema(
+    [
+        ("post_id", pa.string()),
+        ("user_id", pa.string()),
+        ("username", pa.string()),
+        ("reshare_count", pa.int64()),
+        ("timestamp", pa.int64()),
+        ("url", pa.string()),
+        ("post_type", pa.int8()),
+        ("profile_image_url", pa.string()),
+    ]
+)
+
+
+def _tweet_record(tweet, post_type, with_urls=True, with_images=True):
+    """
+    Return the cache record for one Tweet_v1 object (or None if it has no time).
+    """
+    timestamp = tweet.get_post_time(timestamp=True)
+    if timestamp is None:
+        return None
+    return (
+        tweet.get_post_ID(),
+        tweet.get_user_ID(),
+        tweet.get_user_handle(),
+        tweet.get_reshare_count(),
+        timestamp,
+        tweet.get_link_to_post() if with_urls else None,
+        post_type,
+        tweet.get_user_profile_image_url() if with_images else None,
+    )
+
+
+def _iter_lines(file, platform, earliest_tstamp):
+    """
+    Return the lines of a raw data file, without those that cannot hold a post
+    sent on or after `earliest_tstamp` (if provided, see
+    decoding.get_line_date_filter).
+    """
+    lines = iter_gzip_lines(file)
+    if earliest_tstamp is None:
+        return lines
+    return filter(get_line_date_filter(platform, earliest_tstamp), lines)
+
+
+def _iter_tweet_records(
+    file, logger=None, with_urls=True, earliest_tstamp=None, with_images=True
+):
+    decode_post = get_post_decoder("twitter")
+    lines = _iter_lines(file, "twitter", earliest_tstamp)
+    # Records are built right away, so one wrapper is reused for every line
+    tweets = iter_post_wrappers(map(decode_post, lines), Tweet_v1, flyweight=True)
+    for tweet in tweets:
+
+        if not tweet.is_valid():
+            if logger is not None:
+                logger.info("Skipping invalid tweet!!")
+                logger.info("-" * 50)
+                logger.info(tweet.post_object)
+                logger.info("-" * 50)
+            continue
+
+        # The base tweet comes first, followed by the posts it embeds
+        record = _tweet_record(tweet, POST_TYPE_BASE, with_urls, with_images)
+        if record is not None:
+            yield record
+        if tweet.is_retweet:
+            record = _tweet_record(
+                tweet.retweet_object, POST_TYPE_RETWEETED, with_urls, with_images
+            )
+            if record is not None:
+                yield record
+        if tweet.is_quote:
+            record = _tweet_record(
+                tweet.quote_object, POST_TYPE_QUOTED, with_urls, with_images
+            )
+            if record is not None:
+                yield record
+
+
+def _iter_fb_records(file, logger=None, with_urls=True, earliest_tstamp=None):
+    decode_post = get_post_decoder("facebook")
+    lines = _iter_lines(file, "facebook", earliest_tstamp)
+    # Records are built right away, so one wrapper is reused for every line
+    posts = iter_post_wrappers(map(decode_post, lines), FbIgPost, flyweight=True)
+    for post_obj in posts:
+        if not post_obj.is_valid():
+            continue
+
+        timestamp = post_obj.get_post_time(timestamp=True)
+        if timestamp is None:
+            continue
+
+        # This handles certain types of accounts like groups and pages that
+        # do not have "handles" (or don't provide one) but instead have "names"
+        username = post_obj.get_user_handle()
+        if username in [None, ""]:
+            username = post_obj.get_account_name()
+        reshare_count = post_obj.get_reshare_count()
+        if reshare_count is None:
+            reshare_count = 0
+
+        yield (
+            post_obj.get_post_ID(),
+            post_obj.get_user_ID(),
+            username,
+            reshare_count,
+            timestamp,
+            post_obj.get_link_to_post() if with_urls else None,
+            POST_TYPE_BASE,
+            None,
+        )
+
+
+def iter_post_records(
+    file, platform, logger=None, with_urls=True, earliest_tstamp=None, with_images=True
+):
+    """
+    Yield one record per post found in a raw data file.
+
+    Each record is a tuple ordered like POST_CACHE_COLUMNS:
+        (post_id, user_id, username, reshare_count, timestamp, url, post_type,
+        profile_image_url)
+    where `timestamp` is an int (epoch seconds) and `profile_image_url` is the
+    poster's profile image link in the post (Twitter only, None for Facebook). For Twitter, retweeted and quoted
+    posts are yielded right after the tweet that embeds them. Invalid posts and
+    posts whose time cannot be parsed are skipped.
+
+    Parameters:
+    -----------
+    - file (str) : full path to a raw `*.jsonl.gzip` file
+    - platform (str) : one of ["twitter", "facebook"]
+    - logger : logging object. If provided, invalid tweets are logged.
+    - with_urls (bool) : if False, `url` is None in every record, which saves
+        building a URL string for every post when they are only needed for a few
+        (e.g., tweet URLs can be rebuilt for the top spreaders, see
+        post_store.TWEET_URL_TEMPLATE). Default = True
+    - earliest_tstamp (int) : if provided, lines are checked before they are
+        decoded and lines that cannot hold a post sent on or after this time are
+        skipped (see decoding.get_line_date_filter). Other old posts are still
+        yielded. Default = None
+    - with_images (bool) : if False, `profile_image_url` is None in every record.
+        Default = True
+
+    Yields:
+    -----------
+    - record (tuple) : see above
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+    if platform == "twitter":
+        return _iter_tweet_records(
+            file, logger, with_urls, earliest_tstamp, with_images
+        )
+    elif platform == "facebook":
+        return _iter_fb_records(file, logger, with_urls, earliest_tstamp)
+    raise ValueError("`platform` must be either 'twitter' or 'facebook'!")
+
+
+def get_cache_path(raw_path, cache_dir):
+    """
+    Return the path of the cache file for `raw_path` inside `cache_dir`.
+    E.g.: 2023-01-01__tweets_w_links.jsonl.gzip -> 2023-01-01__tweets_w_links.parquet
+    """
+    basename = os.path.basename(raw_path)
+    if basename.endswith(RAW_FILE_SUFFIX):
+        basename = basename[: -len(RAW_FILE_SUFFIX)]
+    return os.path.join(cache_dir, f"{basename}{CACHE_FILE_SUFFIX}")
+
+
+def _get_source_key(raw_path):
+    """
+    Return the cache key of a raw file: its size and mtime (symlinks are followed).
+    """
+    stat = os.stat(raw_path)
+    return {
+        b"top_fibers.cache_version": CACHE_VERSION.encode(),
+        b"top_fibers.source_size": str(stat.st_size).encode(),
+        b"top_fibers.source_mtime_ns": str(stat.st_mtime_ns).encode(),
+    }
+
+
+def is_cache_current(raw_path, cache_dir):
+    """
+    Return True if `cache_dir` holds a cache file for `raw_path` that was built
+    from the raw file as it is now (same size and mtime).
+    """
+    cache_path = get_cache_path(raw_path, cache_dir)
+    if not os.path.exists(cache_path):
+        return False
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    source_key = _get_source_key(raw_path)
+    return all(metadata.get(key) == value for key, value in source_key.items())
+
+
+def build_post_cache(raw_path, cache_dir, platform, logger=None):
+    """
+    Convert a raw data file into a Parquet cache file.
+
+    Rows are written in batches of CACHE_BATCH_ROWS so memory does not grow with
+    the size of the raw file. The cache is written to a temporary file and then
+    moved into place, so readers never see a partial cache.
+
+    Parameters:
+    -----------
+    - raw_path (str) : full path to a raw `*.jsonl.gzip` file
+    - cache_dir (str) : directory where the cache file is saved
+    - platform (str) : one of ["twitter", "facebook"]
+    - logger : logging object. If provided, invalid tweets are logged.
+
+    Returns:
+    -----------
+    - cache_path (str) : full path to the new cache file
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Take the key before reading, so a file modified mid-read is rebuilt next time
+    schema = POST_CACHE_SCHEMA.with_metadata(_get_source_key(raw_path))
+    cache_path = get_cache_path(raw_path, cache_dir)
+    tmp_path = f"{cache_path}.tmp"
+
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        batch = []
+        for record in iter_post_records(raw_path, platform, logger):
+            batch.append(record)
+            if len(batch) >= CACHE_BATCH_ROWS:
+                writer.write_table(_records_to_table(batch, schema))
+                batch = []
+        if batch:
+            writer.write_table(_records_to_table(batch, schema))
+
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def _records_to_table(records, schema):
+    columns = list(zip(*records))
+    return pa.Table.from_arrays(
+        [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def read_post_cache(raw_path, cache_dir, earliest_tstamp=None, columns=None):
+    """
+    Read the cache file for `raw_path`.
+
+    Parameters:
+    -----------
+    - raw_path (str) : full path to the raw file the cache was built from
+    - cache_dir (str) : directory holding the cache files
+    - earliest_tstamp (int) : if provided, only posts sent on or after this
+        time are returned
+    - columns (list) : columns to read. Default = all POST_CACHE_COLUMNS
+
+    Returns:
+    -----------
+    - table (pyarrow.Table) : the cached posts, in the order they were found in
+        the raw file
+    """
+    filters = None
+    if earliest_tstamp is not None:
+        filters = [("timestamp", ">=", math.ceil(earliest_tstamp))]
+    return pq.read_table(
+        get_cache_path(raw_path, cache_dir),
+        columns=columns or POST_CACHE_COLUMNS,
+        filters=filters,
+    )
+
+
+def iter_cached_records(
+    raw_path, cache_dir, earliest_tstamp=None, with_urls=True, with_images=True
+):
+    """
+    Yield the same records as `iter_post_records`, but from the cache file.
+
+    Parameters:
+    -----------
+    - raw_path (str) : full path to the raw file the cache was built from
+    - cache_dir (str) : directory holding the cache files
+    - earliest_tstamp (int) : if provided, only posts sent on or after this
+        time are yielded
+    - with_urls (bool) : if False, the `url` column is not read and `url` is None
+        in every record. Default = True
+    - with_images (bool) : if False, the `profile_image_url` column is not read and
+        `profile_image_url` is None in every record. Default = True
+
+    Yields:
+    -----------
+    - record (tuple) : ordered like POST_CACHE_COLUMNS
+    """
+    # Skipped columns are put back as None, in order of POST_CACHE_COLUMNS
+    skipped = []
+    if not with_urls:
+        skipped.append("url")
+    if not with_images:
+        skipped.append("profile_image_url")
+    columns = [column for column in POST_CACHE_COLUMNS if column not in skipped]
+
+    table = read_post_cache(raw_path, cache_dir, earliest_tstamp, columns)
+    for batch in table.to_batches(max_chunksize=CACHE_BATCH_ROWS):
+        values = [column.to_pylist() for column in batch.columns]
+        for column in skipped:
+            values.insert(POST_CACHE_COLUMNS.index(column), itertools.repeat(None))
+        yield from zip(*values)
@@ -0,0 +1,113 @@
+"""
+A compact set of the IDs of posts already written, so that each post is written
+only once. E.g., a CrowdTangle post that links to several domains is returned by
+the search of every one of them (see
+scripts/data_collection/crowdtangle_dl_fb_links.py).
+
+IDs are first checked against Bloom filters (see top_fibers_pkg.bloom), which rule
+out almost every new ID right away. Only the IDs they flag as maybe seen (the
+duplicates and about BLOOM_FP_RATE of the new IDs) are checked against the exact
+set: the 128-bit BLAKE2b digests of every ID added, kept in sorted NumPy arrays.
+A digest takes 16 bytes, a fraction of what a set of ID strings takes.
+"""
+import numpy as np
+
+from .bloom import BLOOM_FP_RATE, BloomFilter, get_key_digest, hash_digest
+
+DEDUP_CAPACITY = 1_000_000
+DEDUP_RUN_SIZE = 65_536
+DIGEST_DTYPE = np.dtype("V16")
+
+
+class SeenPostIds:
+    """
+    Set of post IDs (str) that only grows, see the module docstring.
+
+    Parameters:
+    -----------
+    - capacity (int) : number of IDs the first Bloom filter is sized for. Once it
+        holds that many, a filter twice as large is added, so the false positive
+        rate stays close to `fp_rate`. Default = DEDUP_CAPACITY
+    - fp_rate (float) : false positive rate of the Bloom filters. Default =
+        BLOOM_FP_RATE
+
+    Attributes:
+    -----------
+    - num_checked (int) : number of IDs that were checked against the exact set
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+
+    def __init__(self, capacity=DEDUP_CAPACITY, fp_rate=BLOOM_FP_RATE):
+        if capacity < 1:
+            raise ValueError("`capacity` must be positive!")
+        self.fp_rate = fp_rate
+        self.num_checked = 0
+        self._filters = [BloomFilter.for_capacity(capacity, fp_rate)]
+        self._filter_capacity = capacity
+        self._filter_size = 0
+        # Digests that are not sorted into a run yet
+        self._pending = set()
+        self._runs = []
+        self._num_ids = 0
+
+    def _contains_digest(self, digest):
+        self.num_checked += 1
+        if digest in self._pending:
+            return True
+        key = np.frombuffer(digest, dtype=DIGEST_DTYPE)
+        for run in self._runs:
+            idx = np.searchsorted(run, key)[0]
+            if idx < len(run) and run[idx] == key[0]:
+                return True
+        return False
+
+    def _sort_pending(self):
+        run = np.sort(np.frombuffer(b"".join(self._pending), dtype=DIGEST_DTYPE))
+        self._pending = set()
+        # Runs no larger than the new one are merged into it, so there are only
+        # about log2(len(self) / DEDUP_RUN_SIZE) runs to search
+        while self._runs and len(self._runs[-1]) <= len(run):
+            run = np.sort(np.concatenate([self._runs.pop(), run]))
+        self._runs.append(run)
+
+    def add(self, post_id):
+        """
+        Add `post_id` to the set. Return True if it was not in the set yet.
+        """
+        digest = get_key_digest(post_id)
+        key_hash = hash_digest(digest)
+        maybe_seen = any(bloom.contains_hash(key_hash) for bloom in self._filters)
+        if maybe_seen and self._contains_digest(digest):
+            return False
+
+        if self._filter_size >= self._filter_capacity:
+            self._filter_capacity *= 2
+            self._filters.append(
+                BloomFilter.for_capacity(self._filter_capacity, self.fp_rate)
+            )
+            self._filter_size = 0
+        self._filters[-1].add_hash(key_hash)
+        self._filter_size += 1
+
+        self._pending.add(digest)
+        if len(self._pending) >= DEDUP_RUN_SIZE:
+            self._sort_pending()
+        self._num_ids += 1
+        return True
+
+    def update(self, post_ids):
+        for post_id in post_ids:
+            self.add(post_id)
+
+    def __contains__(self, post_id):
+        digest = get_key_digest(post_id)
+        key_hash = hash_digest(digest)
+        if not any(bloom.contains_hash(key_hash) for bloom in self._filters):
+            return False
+        return self._contains_digest(digest)
+
+    def __len__(self):
+        return self._num_ids
@@ -0,0 +1,633 @@
+"""
+A compact, array-backed store of the posts in one FIB-index window.
+
+The dictionaries previously used to calculate FIB indices (post ID -> reshares,
+post ID -> timestamp, user ID -> set of post IDs, ...) cost several hundred bytes
+per post. Here, user and post IDs are interned as int64 values and every per-post
+value is kept in a NumPy array, so a post costs a few dozen bytes. Strings (IDs,
+timestamps and URLs) are only created for the posts of the top spreaders.
+
+Users' latest profile image links can also be kept (Twitter only), so they can be
+saved with the FIB results instead of being looked up in the raw data again.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .aggregates import (
+    RESHARE_RULES,
+    factorize_pairs,
+    get_latest_rows,
+    get_max_values,
+)
+from .fib_helpers import calc_fib_indices_batch, get_top_k_indices
+
+# Tweet URLs are not stored; they are rebuilt from the username and tweet ID
+TWEET_URL_TEMPLATE = "https://twitter.com/{username}/status/{post_id}"
+
+# Users per row group when the FIB frame is written (see PostStore.write_fib_frame)
+FIB_FRAME_CHUNK_ROWS = 1_000_000
+FIB_FRAME_SCHEMA = pa.schema(
+    [
+        ("user_id", pa.string()),
+        ("username", pa.string()),
+        ("fib_index", pa.int64()),
+        ("total_reshares", pa.int64()),
+    ]
+)
+PROFILE_IMAGE_LINKS_SCHEMA = pa.schema(
+    [
+        ("user_id", pa.string()),
+        ("profile_image_url", pa.string()),
+    ]
+)
+
+
+def intern_ids(codes, uniques):
+    """
+    Intern factorized IDs as int64 values.
+
+    Integer IDs (e.g., Twitter IDs) are stored as the integers themselves. Any other
+    IDs are stored as their codes into an array of the unique IDs.
+
+    Parameters:
+    -----------
+    - codes (numpy.ndarray) : codes returned by pandas.factorize
+    - uniques (numpy.ndarray) : uniques returned by pandas.factorize
+
+    Returns:
+    -----------
+    - values (numpy.ndarray) : int64 value of every ID
+    - labels (numpy.ndarray) : the unique IDs that `values` index into, or None if
+        `values` are the IDs themselves
+    """
+    if np.issubdtype(uniques.dtype, np.integer):
+        return uniques[codes].astype(np.int64), None
+    return codes.astype(np.int64), np.asarray(uniques, dtype=object)
+
+
+def get_id_strings(values, labels):
+    """
+    Return the (str) IDs of interned `values` (see `intern_ids`) as a list.
+    """
+    if labels is None:
+        return [str(value) for value in values.tolist()]
+    return labels[values].tolist()
+
+
+class _IdNumbering:
+    """
+    Numbers IDs in order of first appearance, like pandas.factorize over the IDs of
+    every aggregate, but one aggregate at a time. The new IDs of every aggregate
+    are kept with their sort order (a run) and later IDs are looked up in every
+    run by binary search, so the IDs of all aggregates are never hashed together.
+
+    Parameters:
+    -----------
+    - dtype (numpy.dtype) : dtype of the numbers. Default = numpy.int64
+    """
+
+    def __init__(self, dtype=np.int64):
+        self.dtype = dtype
+        self.num_ids = 0
+        self._runs = []
+
+    def add(self, ids):
+        """
+        Number the IDs in `ids` (pandas.Series). IDs not seen before are numbered
+        after all earlier IDs.
+
+        Returns:
+        -----------
+        - codes (numpy.ndarray) : the code of every ID into `numbers`
+        - numbers (numpy.ndarray) : the number of every distinct ID in `ids`
+        """
+        codes, uniques = ids.factorize(use_na_sentinel=False)
+        uniques = np.asarray(uniques)
+        numbers = np.full(len(uniques), -1, dtype=self.dtype)
+        for first_number, run_ids, order in self._runs:
+            positions = np.searchsorted(run_ids, uniques, sorter=order)
+            positions[positions == len(run_ids)] = 0
+            run_numbers = order[positions]
+            found = run_ids[run_numbers] == uniques
+            numbers[found] = run_numbers[found] + first_number
+            del positions, run_numbers, found
+
+        is_new = numbers < 0
+        new_ids = uniques[is_new]
+        numbers[is_new] = np.arange(
+            self.num_ids, self.num_ids + len(new_ids), dtype=self.dtype
+        )
+        if len(new_ids) > 0:
+            order = np.argsort(new_ids, kind="stable").astype(self.dtype)
+            self._runs.append((self.num_ids, new_ids, order))
+            self.num_ids += len(new_ids)
+        return codes, numbers
+
+    def get_uniques(self):
+        """
+        Return the IDs in order of their number.
+        """
+        if not self._runs:
+            return np.array([], dtype=object)
+        return np.concatenate([run_ids for _, run_ids, _ in self._runs])
+
+
+def _get_codes(values):
+    """
+    Return the code of every value (pandas.Series, categorical in aggregates) into
+    the returned labels (numpy.ndarray), with -1 for missing values.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), np.asarray(values.cat.categories)
+    codes, labels = values.factorize()
+    return codes, np.asarray(labels)
+
+
+def _set_latest_values(updates, size):
+    """
+    Return an object array of `size` values (None by default), set by the
+    (numbers, values) `updates` in order, so later updates win.
+    """
+    latest_values = np.full(size, None, dtype=object)
+    for numbers, values in updates:
+        latest_values[numbers] = values
+    return latest_values
+
+
+def _reduce_aggregates(
+    aggregates, reshare_rule, earliest_tstamp, keep_urls, keep_images=False
+):
+    """
+    Reduce the aggregates, one at a time, to the values of every post and user.
+
+    Aggregates are ordered like the data, so the values of a post (or user) in a
+    later aggregate replace those of earlier ones, and within an aggregate the
+    values of the latest row (largest `seq`) are kept. Every aggregate is removed
+    from the `aggregates` list once it is read, so it can be freed before the next
+    one is read (unless the caller holds other references to it). Only the post
+    and user numbers of every row are kept, not the rows themselves.
+
+    Returns:
+    -----------
+    - row_posts (numpy.ndarray) : the post number of every row
+    - row_users (numpy.ndarray) : the user number of every row
+    - post_values (dict) : numpy.ndarray `num_reshares`, `timestamp`,
+        `username_code` and, if `keep_urls`, `url` of every post number
+    - user_values (dict) : numpy.ndarray `username_code` and, if `keep_images`,
+        `profile_image_url` of every user number
+    - post_uniques (numpy.ndarray) : the ID of every post number
+    - user_uniques (numpy.ndarray) : the ID of every user number
+    - username_labels (numpy.ndarray) : the username of every username code. Its
+        last label is None, so missing usernames (code -1) map to None
+    """
+    # Only the posts sent in the window are read
+    keeps = []
+    num_rows = 0
+    for aggregate in aggregates:
+        keep = slice(None)
+        if earliest_tstamp is not None:
+            keep = aggregate["timestamp"].to_numpy() >= earliest_tstamp
+        keeps.append(keep)
+        num_rows += len(aggregate) if earliest_tstamp is None else int(keep.sum())
+
+    # Numbers are below the number of rows, so they usually fit in int32. There
+    # are at most as many posts and users as rows, and pages of the arrays below
+    # are only used as they are filled.
+    code_dtype = np.int32 if num_rows < np.iinfo(np.int32).max else np.int64
+    row_posts = np.empty(num_rows, dtype=code_dtype)
+    row_users = np.empty(num_rows, dtype=code_dtype)
+    post_values = {
+        "num_reshares": np.empty(num_rows, dtype=np.int64),
+        "timestamp": np.empty(num_rows, dtype=np.int64),
+        "username_code": np.empty(num_rows, dtype=code_dtype),
+    }
+    user_values = {"username_code": np.empty(num_rows, dtype=code_dtype)}
+    url_updates = []
+    image_updates = []
+    posts = _IdNumbering(code_dtype)
+    users = _IdNumbering(code_dtype)
+    username_labels = []
+    num_labels = 0
+
+    start = 0
+    while aggregates:
+        aggregate = aggregates.pop(0)
+        keep = keeps.pop(0)
+        seq = aggregate["seq"].to_numpy(dtype=np.int64)[keep]
+        end = start + len(seq)
+
+        # Usernames are handled as codes, so a string is only built per username
+        username_codes, labels = _get_codes(aggregate["username"])
+        username_codes = username_codes[keep].astype(code_dtype)
+        username_codes[username_codes >= 0] += num_labels
+        username_labels.append(labels.astype(object))
+        num_labels += len(labels)
+
+        num_known = posts.num_ids
+        codes, numbers = posts.add(aggregate["post_id"][keep])
+        row_posts[start:end] = numbers[codes]
+        latest_rows = get_latest_rows(codes, seq, len(numbers))
+        reshares = aggregate["num_reshares"].to_numpy()[keep]
+        if reshare_rule == "max":
+            reshares = get_max_values(codes, reshares, len(numbers))
+            is_known = numbers < num_known
+            reshares[is_known] = np.maximum(
+                reshares[is_known], post_values["num_reshares"][numbers[is_known]]
+            )
+            del is_known
+        else:
+            reshares = reshares[latest_rows]
+        post_values["num_reshares"][numbers] = reshares
+        post_values["timestamp"][numbers] = aggregate["timestamp"].to_numpy()[keep][
+            latest_rows
+        ]
+        post_values["username_code"][numbers] = username_codes[latest_rows]
+        if keep_urls:
+            urls = aggregate["url"].to_numpy()[keep][latest_rows]
+            url_updates.append((numbers, urls))
+        del codes, numbers, latest_rows, reshares
+
+        # User IDs are codes too, so only the distinct IDs of the kept rows are
+        # numbered, in order of their first row
+        codes, labels = _get_codes(aggregate["user_id"])
+        codes = codes[keep]
+        first_rows = get_latest_rows(
+            codes, np.arange(len(codes), 0, -1, dtype=np.int64), len(labels)
+        )
+        used = np.flatnonzero(first_rows >= 0)
+        used = used[np.argsort(first_rows[used], kind="stable")]
+        _, numbers = users.add(pd.Series(labels[used]))
+        label_numbers = np.full(len(labels), -1, dtype=code_dtype)
+        label_numbers[used] = numbers
+        row_users[start:end] = label_numbers[codes]
+        latest_rows = get_latest_rows(codes, seq, len(labels))[used]
+        user_values["username_code"][numbers] = username_codes[latest_rows]
+        if keep_images:
+            images = aggregate["profile_image_url"].to_numpy()[keep]
+            image_rows = np.flatnonzero(pd.notna(images))
+            latest_images = get_latest_rows(
+                codes[image_rows], seq[image_rows], len(labels)
+            )[used]
+            has_image = latest_images >= 0
+            image_updates.append(
+                (numbers[has_image], images[image_rows[latest_images[has_image]]])
+            )
+            del images, image_rows, latest_images, has_image
+        del aggregate, keep, seq, username_codes, labels, codes, numbers, latest_rows
+        del first_rows, used, label_numbers
+        start = end
+
+    post_values = {
+        name: values[: posts.num_ids] for name, values in post_values.items()
+    }
+    user_values = {
+        name: values[: users.num_ids] for name, values in user_values.items()
+    }
+    if keep_urls:
+        post_values["url"] = _set_latest_values(url_updates, posts.num_ids)
+    if keep_images:
+        user_values["profile_image_url"] = _set_latest_values(
+            image_updates, users.num_ids
+        )
+    username_labels.append(np.array([None], dtype=object))
+    return (
+        row_posts,
+        row_users,
+        post_values,
+        user_values,
+        posts.get_uniques(),
+        users.get_uniques(),
+        np.concatenate(username_labels),
+    )
+
+
+def _write_user_chunks(path, schema, get_chunk, users, chunk_rows):
+    """
+    Write the rows of `users` (user numbers) to a Parquet file, building them with
+    `get_chunk` in row groups of `chunk_rows` users.
+    """
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, len(users), chunk_rows):
+            chunk = get_chunk(users[start : start + chunk_rows])
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            )
+
+
+class PostStore:
+    """
+    Posts of one FIB-index window, with one row per (post, user) pair.
+
+    Rows and users are in order of first appearance. Every row holds the number of
+    its user, its post ID, and the number of reshares and timestamp of its post.
+    Reshares are combined over all occurrences of a post with `reshare_rule`, and
+    all other values come from the latest occurrence (of the post or user).
+
+    Parameters:
+    -----------
+    - aggregates (list) : per-file (or per-month) aggregates (see
+        top_fibers_pkg.aggregates), ordered like the (chronologically sorted) data.
+        The list is emptied as the aggregates are read, so that each one can be
+        freed once its posts are copied
+    - reshare_rule (str) : one of top_fibers_pkg.aggregates.RESHARE_RULES
+    - earliest_tstamp (int) : if provided, posts sent before this time are
+        dropped. Default = None
+    - url_template (str) : if provided, post URLs are not stored and are instead
+        built with `url_template.format(username=..., post_id=...)` (see
+        TWEET_URL_TEMPLATE), using the username of the post's latest occurrence.
+        Otherwise the aggregates' `url` column is kept. Default = None
+    - keep_profile_images (bool) : if True, the latest profile image link of every
+        user is kept from the aggregates' `profile_image_url` column (see
+        `write_profile_image_links`). Default = False
+
+    Exceptions:
+    -----------
+    - TypeError, ValueError
+    """
+
+    def __init__(
+        self,
+        aggregates,
+        reshare_rule,
+        earliest_tstamp=None,
+        url_template=None,
+        keep_profile_images=False,
+    ):
+        if not isinstance(aggregates, list):
+            raise TypeError("`aggregates` must be a list!")
+        if reshare_rule not in RESHARE_RULES:
+            raise ValueError(f"`reshare_rule` must be one of {RESHARE_RULES}!")
+        self.url_template = url_template
+
+        (
+            row_posts,
+            row_users,
+            post_values,
+            user_values,
+            post_uniques,
+            user_uniques,
+            self.username_labels,
+        ) = _reduce_aggregates(
+            aggregates,
+            reshare_rule,
+            earliest_tstamp,
+            keep_urls=url_template is None,
+            keep_images=keep_profile_images,
+        )
+        self.num_posts = len(post_uniques)
+        self.num_users = len(user_uniques)
+        self.usernames = self.username_labels[user_values["username_code"]]
+        self.profile_image_urls = user_values.get("profile_image_url")
+        del user_values
+
+        # Number (post, user) pairs in order of first appearance
+        _, pair_posts, self.post_users = factorize_pairs(
+            row_posts, row_users, self.num_posts, self.num_users
+        )
+        del row_posts, row_users
+
+        self.num_reshares = post_values["num_reshares"][pair_posts].astype(np.int64)
+        self.timestamps = post_values["timestamp"][pair_posts].astype(np.int64)
+        self.urls = None
+        self.post_username_codes = None
+        if url_template is None:
+            self.urls = post_values["url"][pair_posts]
+        else:
+            self.post_username_codes = post_values["username_code"][pair_posts]
+        del post_values
+
+        self.post_ids, self.post_labels = intern_ids(pair_posts, post_uniques)
+        self.user_ids, self.user_labels = intern_ids(
+            np.arange(self.num_users), user_uniques
+        )
+        self._fib_results = None
+
+    def get_user_id_strings(self, users=None):
+        """
+        Return the (str) ID of every user in `users` (user numbers, default = all
+        users, in order of user number) as a list.
+        """
+        if users is None:
+            return get_id_strings(self.user_ids, self.user_labels)
+        return get_id_strings(self.user_ids[users], self.user_labels)
+
+    def calc_fib_indices(self):
+        """
+        Calculate the FIB index and total reshares of every user, in order of user
+        number. Results are computed once and then reused.
+
+        Returns:
+        -----------
+        - fib_indices (numpy.ndarray) : FIB index (int64) of every user
+        - total_reshares (numpy.ndarray) : total reshares (int64) earned by every user
+        """
+        if self._fib_results is not None:
+            return self._fib_results
+
+        # Group every user's reshare counts together, as expected by the batch kernel
+        order = np.argsort(self.post_users, kind="stable")
+        reshare_counts = self.num_reshares[order]
+        del order
+        offsets = np.zeros(self.num_users + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(self.post_users, minlength=self.num_users))
+
+        total_reshares = np.zeros(self.num_users, dtype=np.int64)
+        if self.num_users > 0:
+            total_reshares = np.add.reduceat(reshare_counts, offsets[:-1])
+
+        fib_indices = calc_fib_indices_batch(reshare_counts, offsets)
+        self._fib_results = (fib_indices, total_reshares.astype(np.int64))
+        return self._fib_results
+
+    def _get_fib_frame_chunk(self, users):
+        fib_indices, total_reshares = self.calc_fib_indices()
+        return pd.DataFrame(
+            {
+                "user_id": self.get_user_id_strings(users),
+                "username": self.usernames[users],
+                "fib_index": fib_indices[users],
+                "total_reshares": total_reshares[users],
+            }
+        )
+
+    def get_fib_frame(self):
+        """
+        Return the FIB index and total reshares of every user.
+
+        Returns:
+        -----------
+        - fib_frame (pandas.DataFrame) : the same columns, rows and order as
+            top_fibers_pkg.fib_helpers.create_fib_frame:
+            - user_id (str) : the user's ID
+            - username (str) : the user's username/handle
+            - fib_index (int) : the FIB index of that user
+            - total_reshares (int) : total number of reshares earned by that user
+        """
+        return self._get_fib_frame_chunk(np.arange(self.num_users))
+
+    def get_top_spreaders(self, num, rank_type=None):
+        """
+        Return the top `num` spreaders, like
+        top_fibers_pkg.fib_helpers.get_top_spreaders but without building the
+        FIB frame: only the selected users' IDs are converted to strings.
+
+        Parameters:
+        -----------
+        - num (int) : number of top spreaders to return
+        - rank_type (str) : the value utilized for ranking (descending order)
+            - Options: ["total_reshares", "fib_index"]
+
+        Returns:
+        -----------
+        - top_spreaders (set) : set of (str) user IDs for the top spreaders. Ties
+            are broken by user number (i.e., order of first appearance)
+
+        Exceptions:
+        -----------
+        TypeError, ValueError
+        """
+        if rank_type not in ["total_reshares", "fib_index"]:
+            raise ValueError(
+                "`rank_type` must be either 'total_reshares' or 'fib_index'!"
+            )
+        fib_indices, total_reshares = self.calc_fib_indices()
+        values = fib_indices if rank_type == "fib_index" else total_reshares
+        return set(self.get_user_id_strings(get_top_k_indices(values, num)))
+
+    def write_fib_frame(self, path, chunk_rows=FIB_FRAME_CHUNK_ROWS):
+        """
+        Save the FIB frame (see `get_fib_frame`) to a Parquet file, sorted by FIB
+        index (descending; ties in order of user number).
+
+        Rows are built and written in row groups of `chunk_rows` users, so the
+        user ID and username strings of all users never exist at once.
+
+        Parameters:
+        -----------
+        - path (str) : full path of the output file
+        - chunk_rows (int) : number of users per row group.
+            Default = FIB_FRAME_CHUNK_ROWS
+
+        Exceptions:
+        -----------
+        TypeError, ValueError
+        """
+        if not isinstance(chunk_rows, int):
+            raise TypeError("`chunk_rows` must be an integer!")
+        if chunk_rows < 1:
+            raise ValueError("`chunk_rows` must be positive!")
+
+        fib_indices, _ = self.calc_fib_indices()
+        order = get_top_k_indices(fib_indices, self.num_users)
+        _write_user_chunks(
+            path, FIB_FRAME_SCHEMA, self._get_fib_frame_chunk, order, chunk_rows
+        )
+
+    def _get_profile_image_chunk(self, users):
+        return pd.DataFrame(
+            {
+                "user_id": self.get_user_id_strings(users),
+                "profile_image_url": self.profile_image_urls[users],
+            }
+        )
+
+    def write_profile_image_links(
+        self, path, num_users=None, chunk_rows=FIB_FRAME_CHUNK_ROWS
+    ):
+        """
+        Save the latest profile image link of the top `num_users` users by FIB index
+        (in the same order as `write_fib_frame`) to a Parquet file. Users without
+        a profile image link are left out.
+
+        Parameters:
+        -----------
+        - path (str) : full path of the output file
+        - num_users (int) : number of top users to consider. Default = None (all
+            users)
+        - chunk_rows (int) : number of users per row group.
+            Default = FIB_FRAME_CHUNK_ROWS
+
+        Exceptions:
+        -----------
+        TypeError, ValueError
+        """
+        if self.profile_image_urls is None:
+            raise ValueError(
+                "Profile images were not kept (see `keep_profile_images`)!"
+            )
+        if num_users is not None and not isinstance(num_users, int):
+            raise TypeError("`num_users` must be an integer!")
+        if not isinstance(chunk_rows, int):
+            raise TypeError("`chunk_rows` must be an integer!")
+        if chunk_rows < 1:
+            raise ValueError("`chunk_rows` must be positive!")
+
+        fib_indices, _ = self.calc_fib_indices()
+        if num_users is None:
+            num_users = self.num_users
+        order = get_top_k_indices(fib_indices, min(num_users, self.num_users))
+        order = order[pd.notna(self.profile_image_urls[order])]
+        _write_user_chunks(
+            path,
+            PROFILE_IMAGE_LINKS_SCHEMA,
+            self._get_profile_image_chunk,
+            order,
+            chunk_rows,
+        )
+
+    def get_top_spreader_df(self, top_spreaders):
+        """
+        Create a dataframe containing all posts sent by the top spreaders.
+
+        Parameters:
+        ------------
+        - top_spreaders (set) : top spreader user IDs
+
+        Returns:
+        -----------
+        - top_spreaders_df (pandas.DataFrame) : the same columns as
+            top_fibers_pkg.fib_helpers.create_top_spreader_df:
+            - user_id (str) : unique user ID of the poster
+            - post_id (str) : unique ID of the post
+            - num_reshares (int) : the number of reshares of `post_id`
+            - timestamp (str) : timestamp string
+            - post_url (str) : full URL to the post
+
+        Exceptions:
+        -----------
+        TypeError
+        """
+        if not isinstance(top_spreaders, set):
+            raise TypeError("`top_spreaders` must be a set!")
+
+        # Match the interned IDs, so the IDs of other users are never built
+        if self.user_labels is None:
+            top_ids = [int(user_id) for user_id in top_spreaders]
+            top_users = np.flatnonzero(np.isin(self.user_ids, top_ids))
+        else:
+            top_users = np.flatnonzero(np.isin(self.user_labels, list(top_spreaders)))
+        rows = np.flatnonzero(np.isin(self.post_users, top_users))
+        row_users = self.post_users[rows]
+
+        post_ids = get_id_strings(self.post_ids[rows], self.post_labels)
+        if self.urls is not None:
+            post_urls = self.urls[rows].tolist()
+        else:
+            post_urls = [
+                self.url_template.format(username=username, post_id=post_id)
+                for username, post_id in zip(
+                    self.username_labels[self.post_username_codes[rows]], post_ids
+                )
+            ]
+
+        return pd.DataFrame(
+            {
+                "user_id": self.get_user_id_strings(row_users),
+                "post_id": post_ids,
+                "num_reshares": self.num_reshares[rows],
+                "timestamp": [str(tstamp) for tstamp in self.timestamps[rows].tolist()],
+                "post_url": post_urls,
+            }
+        )
@@ -0,0 +1,264 @@
+"""
+Functions for the Twitter profile index: the latest profile image link seen for
+every user, so profile images can be refreshed with a lookup instead of scanning
+raw files.
+
+The index holds one row per user:
+    - user_id (str) : Twitter user ID
+    - file (str) : full path to the raw file of the user's latest tweet
+    - offset (int) : offset of the gzip member that holds the tweet's line (see
+        gzip_io.iter_gzip_lines_with_offsets)
+    - profile_image_url (str) : the user's profile image link in that tweet
+    - timestamp (int) : epoch seconds when the tweet was sent
+
+The latest tweet is the latest one of the newest file (raw file names start with
+their date, so newer files sort last), like a newest-first scan would find.
+
+The index is updated incrementally: only raw files that are new (or that changed,
+which rebuilds the index) are scanned. Its Parquet metadata lists the files it was
+built from along with their size and modification time.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from array import array
+
+from .data_model import Tweet_v1
+from .decoding import get_post_decoder
+from .gzip_io import iter_gzip_lines_with_offsets
+
+PROFILE_INDEX_VERSION = "1"
+PROFILE_MERGE_ROWS = 5_000_000
+PROFILE_INDEX_COLUMNS = [
+    "user_id",
+    "file",
+    "offset",
+    "profile_image_url",
+    "timestamp",
+]
+PROFILE_INDEX_SCHEMA = pa.schema(
+    [
+        ("user_id", pa.string()),
+        ("file", pa.string()),
+        ("offset", pa.int64()),
+        ("profile_image_url", pa.string()),
+        ("timestamp", pa.int64()),
+    ]
+)
+
+
+def scan_profile_images(raw_path):
+    """
+    Return the latest profile image link of every user who tweeted in a raw Twitter
+    file. Only base-level tweets are used, and tweets without a user ID, time or
+    profile image link are skipped.
+
+    Parameters:
+    -----------
+    - raw_path (str) : full path to a raw `*.jsonl.gzip` Twitter file
+
+    Returns:
+    -----------
+    - entries (pandas.DataFrame) : one row per user, see PROFILE_INDEX_COLUMNS
+    """
+    decode_post = get_post_decoder("twitter")
+    user_ids = []
+    image_urls = []
+    offsets = array("q")
+    timestamps = array("q")
+
+    # Entries are built right away, so one wrapper is reused for every line
+    tweet = Tweet_v1({})
+    for offset, line in iter_gzip_lines_with_offsets(raw_path):
+        tweet.rebind(decode_post(line))
+        if not tweet.is_valid():
+            continue
+        user_id = tweet.get_user_ID()
+        image_url = tweet.get_user_profile_image_url()
+        timestamp = tweet.get_post_time(timestamp=True)
+        if user_id is None or image_url is None or timestamp is None:
+            continue
+        user_ids.append(user_id)
+        image_urls.append(image_url)
+        offsets.append(offset)
+        timestamps.append(timestamp)
+
+    entries = pd.DataFrame(
+        {
+            "user_id": pd.Series(user_ids, dtype=object),
+            "file": raw_path,
+            "offset": np.frombuffer(offsets, dtype=np.int64),
+            "profile_image_url": pd.Series(image_urls, dtype=object),
+            "timestamp": np.frombuffer(timestamps, dtype=np.int64),
+        },
+        columns=PROFILE_INDEX_COLUMNS,
+    )
+    # A stable sort keeps file order among tweets sent at the same time
+    entries = entries.sort_values("timestamp", kind="mergesort")
+    return entries.drop_duplicates("user_id", keep="last").reset_index(drop=True)
+
+
+def merge_profile_entries(index, entries):
+    """
+    Merge new entries into a profile index, keeping the latest entry of every user:
+    the one from the newest file (by file name), then the latest tweet. Ties go to
+    the entries that come last.
+
+    Parameters:
+    -----------
+    - index (pandas.DataFrame) : the current index (see PROFILE_INDEX_COLUMNS)
+    - entries (list) : DataFrames of new entries, e.g. from `scan_profile_images`
+
+    Returns:
+    -----------
+    - index (pandas.DataFrame) : the merged index, see PROFILE_INDEX_COLUMNS
+    """
+    merged = pd.concat([index, *entries], ignore_index=True)
+    merged["file_name"] = merged["file"].map(os.path.basename)
+    merged = merged.sort_values(["file_name", "timestamp"], kind="mergesort")
+    merged = merged.drop_duplicates("user_id", keep="last")
+    return merged[PROFILE_INDEX_COLUMNS].reset_index(drop=True)
+
+
+def _get_source_stats(raw_paths):
+    """
+    Return the [size, mtime] (symlinks are followed) of every raw file, by path.
+    """
+    stats = dict()
+    for raw_path in raw_paths:
+        stat = os.stat(raw_path)
+        stats[raw_path] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def read_profile_index(index_path):
+    """
+    Read a profile index saved by `update_profile_index`.
+
+    Returns:
+    -----------
+    - index (pandas.DataFrame) : see PROFILE_INDEX_COLUMNS. Empty if `index_path`
+        does not exist
+    - sources (dict) : the [size, mtime] of every raw file the index was built
+        from, by path
+    """
+    if not os.path.exists(index_path):
+        empty = PROFILE_INDEX_SCHEMA.empty_table().to_pandas()
+        return empty, dict()
+    table = pq.read_table(index_path)
+    metadata = table.schema.metadata or {}
+    if metadata.get(b"top_fibers.profile_index_version") != (
+        PROFILE_INDEX_VERSION.encode()
+    ):
+        empty = PROFILE_INDEX_SCHEMA.empty_table().to_pandas()
+        return empty, dict()
+    sources = json.loads(metadata.get(b"top_fibers.source_files", b"{}"))
+    return table.to_pandas(), sources
+
+
+def save_profile_index(index, index_path, sources):
+    """
+    Save a profile index as a Parquet file, along with the [size, mtime] of the
+    raw files it was built from (`sources`, by path).
+
+    The index is written to a temporary file and then moved into place, so readers
+    never see a partial index.
+    """
+    index_dir = os.path.dirname(index_path)
+    if index_dir and not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+
+    metadata = {
+        b"top_fibers.profile_index_version": PROFILE_INDEX_VERSION.encode(),
+        b"top_fibers.source_files": json.dumps(sources).encode(),
+    }
+    table = pa.Table.from_pandas(
+        index[PROFILE_INDEX_COLUMNS],
+        schema=PROFILE_INDEX_SCHEMA.with_metadata(metadata),
+        preserve_index=False,
+    )
+    tmp_path = f"{index_path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, index_path)
+
+
+def update_profile_index(index_path, raw_paths, logger=None):
+    """
+    Add the raw files that are not in the profile index yet and save it.
+
+    Files in the index that are not in `raw_paths` are kept. However, if a file
+    already in the index has changed (size or mtime), the entries it added cannot
+    be told apart from newer ones, so the index is rebuilt from `raw_paths` only.
+
+    New entries are merged into the index every PROFILE_MERGE_ROWS rows, rather
+    than after every file.
+
+    Parameters:
+    -----------
+    - index_path (str) : full path to the index file (created if missing)
+    - raw_paths (list) : full paths to raw `*.jsonl.gzip` Twitter files
+    - logger : logging object. If provided, progress is logged.
+
+    Returns:
+    -----------
+    - index (pandas.DataFrame) : the updated index, see PROFILE_INDEX_COLUMNS
+    """
+    index, sources = read_profile_index(index_path)
+    current = _get_source_stats(raw_paths)
+
+    changed = [
+        raw_path
+        for raw_path, stats in current.items()
+        if raw_path in sources and sources[raw_path] != stats
+    ]
+    if changed:
+        if logger is not None:
+            logger.info(f"{len(changed)} indexed file(s) changed, rebuilding index...")
+        index = PROFILE_INDEX_SCHEMA.empty_table().to_pandas()
+        sources = dict()
+
+    new_paths = sorted(
+        [raw_path for raw_path in current if raw_path not in sources],
+        key=os.path.basename,
+    )
+    entries = []
+    num_rows = 0
+    for fnum, raw_path in enumerate(new_paths, start=1):
+        if logger is not None:
+            logger.info(f"Indexing file ({fnum}/{len(new_paths)}): {raw_path}")
+        entries.append(scan_profile_images(raw_path))
+        num_rows += len(entries[-1])
+        sources[raw_path] = current[raw_path]
+        if num_rows >= PROFILE_MERGE_ROWS:
+            index = merge_profile_entries(index, entries)
+            entries = []
+            num_rows = 0
+    if entries:
+        index = merge_profile_entries(index, entries)
+
+    if new_paths or changed or not os.path.exists(index_path):
+        save_profile_index(index, index_path, sources)
+    return index
+
+
+def lookup_profile_image_links(index, user_ids):
+    """
+    Return the latest profile image link of every user in `user_ids` found in the
+    profile index.
+
+    Parameters:
+    -----------
+    - index (pandas.DataFrame) : see `read_profile_index`
+    - user_ids (iterable) : Twitter user IDs (str)
+
+    Returns:
+    -----------
+    - image_link_df (pandas.DataFrame) : columns user_id and profile_image_url
+    """
+    found = index[index["user_id"].isin(set(user_ids))]
+    return found[["user_id", "profile_image_url"]].reset_index(drop=True)
@@ -0,0 +1,73 @@
+"""
+A token-bucket rate limiter shared by the coroutines of one asyncio event loop,
+used to keep concurrent API calls within a quota (e.g., CrowdTangle's calls per
+minute, see scripts/data_collection/crowdtangle_dl_fb_links.py).
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Rate limiter that lets `rate` calls through per second on average, with bursts
+    of up to `capacity` calls after idle time.
+
+    Tokens are added continuously, up to `capacity`, and every call takes one.
+    Callers wait in the order they arrive, so a busy caller cannot starve others.
+
+    Parameters:
+    -----------
+    - rate (float) : tokens added per second
+    - capacity (int) : the most tokens the bucket can hold. The bucket starts full.
+        Default = 1 (calls are evenly spaced)
+
+    Exceptions:
+    -----------
+    - ValueError
+    """
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError("`rate` must be positive!")
+        if capacity < 1:
+            raise ValueError("`capacity` must be at least 1!")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        # Created on first use, so it belongs to the running event loop
+        self._lock = None
+
+    @classmethod
+    def per_minute(cls, calls, capacity=1):
+        """
+        Return a bucket that lets `calls` calls through per minute.
+        """
+        return cls(calls / 60, capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self):
+        """
+        Wait until a token is available and take it.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
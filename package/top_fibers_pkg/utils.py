@@ -2,10 +2,17 @@
 Some simple utility functions used throughout the project.
 """
 import argparse
+import ctypes
 import logging
 import os
 import sys
 
+# glibc `mallopt` parameter for the size above which blocks are mmapped
+M_MMAP_THRESHOLD = -3
+
+# Blocks of at least this many bytes are mmapped (glibc's initial threshold)
+MMAP_THRESHOLD_BYTES = 128 * 1024
+
 
 def parse_cl_args_symlinks(script_purpose="", logger=None):
     """
@@ -108,7 +115,9 @@ def parse_cl_args_fib(script_purpose="", logger=None):
     # Add long and short argument
     msg = (
         "Full path to the directory containing symbolic links to data files "
-        "used in FIB calculations. E.g.: /home/data/apps/topfibers/repo/data/symbolic_links/twitter/2022_02"
+        "used in FIB calculations. E.g.: /home/data/apps/topfibers/repo/data/symbolic_links/twitter/2022_02. "
+        "If a range of months is passed to --month-calculated, this must be the "
+        "directory of raw data files. E.g.: /home/data/apps/topfibers/repo/data/raw/twitter"
     )
     parser.add_argument(
         "-d",
@@ -134,7 +143,10 @@ def parse_cl_args_fib(script_purpose="", logger=None):
         "-m",
         "--month-calculated",
         metavar="Month calculated",
-        help="The month for which you'd like to calculate FIB indices (YYYY_MM)",
+        help=(
+            "The month for which you'd like to calculate FIB indices (YYYY_MM), "
+            "or an inclusive range of months (YYYY_MM..YYYY_MM)"
+        ),
         required=True,
     )
     parser.add_argument(
@@ -144,6 +156,50 @@ def parse_cl_args_fib(script_purpose="", logger=None):
         help="The number of months to consider (e.g., input 3 to consider three months)",
         required=True,
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        metavar="Number of workers",
+        help="The number of processes used to parse data files in parallel (default: 1)",
+        default=1,
+    )
+    msg = (
+        "Full path to the directory of Parquet post caches for this platform "
+        "(created by scripts/data_prep/build_post_cache.py). Data files with a "
+        "current cache are read from it instead of the raw JSON. "
+        "E.g.: /home/data/apps/topfibers/repo/data/derived/post_cache/twitter"
+    )
+    parser.add_argument(
+        "-c",
+        "--cache-dir",
+        metavar="Cache Directory",
+        help=msg,
+        default=None,
+    )
+    msg = (
+        "Full path to the directory of saved month aggregates for this platform. "
+        "Months with a current aggregate are read from it instead of being parsed "
+        "again, and the aggregates of all other months are saved there. "
+        "E.g.: /home/data/apps/topfibers/repo/data/derived/post_aggregates/twitter"
+    )
+    parser.add_argument(
+        "-a",
+        "--aggregate-dir",
+        metavar="Aggregate Directory",
+        help=msg,
+        default=None,
+    )
+    msg = (
+        "If included, the latest profile image link of every user is kept while "
+        "the data is parsed and the links of the top FIBers are saved with the "
+        "FIB results (Twitter only)"
+    )
+    parser.add_argument(
+        "-p",
+        "--profile-images",
+        help=msg,
+        action="store_true",
+    )
 
     # Read parsed arguments from the command line into "args"
     args = parser.parse_args()
@@ -214,6 +270,50 @@ def parse_cl_args_ct_dl(script_purpose="", logger=None):
         help="The number of months that you'd like to download (works backwards from --last-month)",
         required=True,
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        metavar="Number of workers",
+        help="The number of domains downloaded concurrently (default: 4)",
+        default=4,
+    )
+    parser.add_argument(
+        "-r",
+        "--calls-per-minute",
+        metavar="Calls per minute",
+        help=(
+            "The most API calls made per minute, shared by all workers. "
+            "Set this to our CrowdTangle quota (default: 7.5)"
+        ),
+        default=7.5,
+    )
+    parser.add_argument(
+        "--api-url",
+        metavar="API URL",
+        help=(
+            "The CrowdTangle search endpoint, e.g. a local mock server for testing "
+            "(default: the CrowdTangle API)"
+        ),
+        default=None,
+    )
+    msg = (
+        "If included, resume an interrupted download from its checkpoint: finished "
+        "domains are skipped and the others continue from their last page"
+    )
+    parser.add_argument(
+        "--resume",
+        help=msg,
+        action="store_true",
+    )
+    msg = (
+        "If included, only posts with a link to one of the domains (or their "
+        "subdomains) are saved. Posts that only mention a domain are dropped"
+    )
+    parser.add_argument(
+        "--match-links",
+        help=msg,
+        action="store_true",
+    )
 
     # Read parsed arguments from the command line into "args"
     args = parser.parse_args()
@@ -246,6 +346,36 @@ def load_lines(file_path):
         return [line.rstrip() for line in f]
 
 
+def set_fixed_mmap_threshold(threshold=MMAP_THRESHOLD_BYTES):
+    """
+    Have glibc allocate every block of at least `threshold` bytes (e.g., NumPy
+    arrays) with its own memory map, which is returned to the system as soon as
+    the block is freed.
+
+    By default, glibc raises this threshold (up to 32 MB) every time such a block
+    is freed. Large arrays then come from the heap, where freed arrays leave holes
+    that stay resident, so building a window (see post_store.PostStore) can use
+    far more memory than it holds. Setting the threshold turns this off. Child
+    processes forked afterwards keep the setting.
+
+    Parameters:
+    ------------
+    - threshold (int) : size in bytes. Default = MMAP_THRESHOLD_BYTES
+
+    Returns:
+    ------------
+    - is_set (bool) : False if glibc is not available (e.g., macOS), in which
+        case nothing is changed
+    """
+    if not isinstance(threshold, int):
+        raise TypeError("`threshold` must be an integer!")
+    try:
+        libc = ctypes.CDLL("libc.so.6")
+        return libc.mallopt(M_MMAP_THRESHOLD, threshold) == 1
+    except (OSError, AttributeError):
+        return False
+
+
 def get_logger(log_dir, log_fname, script_name=None, also_print=False):
     """Create logger."""
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Purpose:
+    Benchmark matching URLs against an Iffy-sized list of domains with the
+    reversed-label trie of `top_fibers_pkg.domains.DomainMatcher`, against the
+    old approach of `parse_raw_files.py`: `urlparse`, keep the last two labels of
+    the host, and look them up in a set.
+
+    The matches of the trie are checked against a brute-force reference that
+    tries every suffix of the host against the set of domains. Hosts under
+    multi-label public suffixes (e.g., "bbc.co.uk") and subdomains of listed
+    domains are included, and the number of URLs that the two-label approach
+    gets wrong is reported.
+
+Inputs:
+    -n / --num-urls: number of synthetic URLs (default: 2,000,000)
+    -d / --num-domains: number of listed domains (default: 2,000)
+    -s / --num-hosts: number of distinct hosts the URLs are drawn from (default: 200,000)
+
+Outputs:
+    URLs matched per second by each approach are printed to the console.
+
+Author: Matthew DeVerna
+"""
+import argparse
+import random
+import time
+
+from urllib.parse import urlparse
+
+from top_fibers_pkg.domains import DomainMatcher, get_host
+
+TLDS = ["com", "org", "net", "info", "news", "co.uk", "com.au", "blogspot.com"]
+
+
+def parse_cl_args():
+    """
+    Read command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the DomainMatcher trie against two-label set lookups."
+    )
+    parser.add_argument(
+        "-n",
+        "--num-urls",
+        type=int,
+        default=2_000_000,
+        help="Number of synthetic URLs. Default: 2,000,000",
+    )
+    parser.add_argument(
+        "-d",
+        "--num-domains",
+        type=int,
+        default=2_000,
+        help="Number of listed domains. Default: 2,000",
+    )
+    parser.add_argument(
+        "-s",
+        "--num-hosts",
+        type=int,
+        default=200_000,
+        help="Number of distinct hosts the URLs are drawn from. Default: 200,000",
+    )
+    return parser.parse_args()
+
+
+def make_data(num_urls, num_domains, num_hosts, seed=0):
+    """
+    Return a list of domains and a list of URLs. About a quarter of the hosts are
+    listed domains or their subdomains.
+    """
+    rng = random.Random(seed)
+    domains = [f"site{i}.{rng.choice(TLDS)}" for i in range(num_domains)]
+
+    hosts = []
+    for i in range(num_hosts):
+        if rng.random() < 0.25:
+            host = rng.choice(domains)
+            if rng.random() < 0.5:
+                host = f"{rng.choice(['www', 'news', 'm'])}.{host}"
+        else:
+            host = f"{rng.choice(['', 'www.'])}other{i}.{rng.choice(TLDS)}"
+        hosts.append(host)
+
+    urls = [
+        f"https://{rng.choice(hosts)}/{rng.randrange(10**6)}?ref=feed"
+        for _ in range(num_urls)
+    ]
+    return domains, urls
+
+
+def get_base_domain(url):
+    """
+    The old `parse_raw_files.get_base_domain`: the last two labels of the host.
+    """
+    parsed_url = urlparse(url)
+    domain_parts = parsed_url.netloc.split(".")
+    return ".".join(domain_parts[-2:])
+
+
+def match_reference(host, domains_set):
+    """
+    Return the listed domains that `host` is (or is a subdomain of), from the least
+    to the most specific, by trying every suffix of the host.
+    """
+    labels = host.split(".")
+    suffixes = [".".join(labels[idx:]) for idx in range(len(labels) - 1, -1, -1)]
+    return tuple(suffix for suffix in suffixes if suffix in domains_set)
+
+
+if __name__ == "__main__":
+    args = parse_cl_args()
+    domains, urls = make_data(args.num_urls, args.num_domains, args.num_hosts)
+    domains_set = set(domains)
+    print(f"URLs: {len(urls):,}, domains: {len(domains):,}")
+
+    start = time.perf_counter()
+    old_matches = [get_base_domain(url) in domains_set for url in urls]
+    old_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = DomainMatcher(domains)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_matches = [matcher.match_url(url) for url in urls]
+    new_seconds = time.perf_counter() - start
+
+    wrong = 0
+    for url, old_match, new_match in zip(urls, old_matches, new_matches):
+        expected = match_reference(get_host(url), domains_set)
+        if new_match != expected:
+            raise ValueError(f"Matches differ for URL: {url}")
+        wrong += old_match != bool(expected)
+
+    print(f"{'approach':<28} {'seconds':>8} {'URLs/second':>12}")
+    print(
+        f"{'urlparse + two labels':<28} {old_seconds:>8.2f} "
+        f"{len(urls) / old_seconds:>12,.0f}"
+    )
+    print(
+        f"{'DomainMatcher':<28} {new_seconds:>8.2f} "
+        f"{len(urls) / new_seconds:>12,.0f}"
+    )
+    print(f"Trie built in {build_seconds:.3f} seconds")
+    print(f"Speedup: {old_seconds / new_seconds:.1f}x")
+    print(f"URLs the two-label approach gets wrong: {wrong:,}")
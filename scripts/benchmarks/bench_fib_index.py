@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Purpose:
+    Benchmark the batch FIB-index engine (`calc_fib_indices_batch`) against the
+    per-user path (`calc_fib_index`) on synthetic reshare counts, and check that
+    both return identical FIB indices.
+
+    Also times the sort-based and counting (`calc_fib_index_counting`) kernels on
+    single users of increasing size, which is how FIB_COUNTING_KERNEL_MIN_POSTS
+    was chosen, and the batch engine with only its segmented sort, with bucket
+    counting for users with at least FIB_COUNTING_KERNEL_MIN_POSTS posts (the
+    default), and with bucket counting only, on the synthetic users and on
+    HEAVY_USERS users with HEAVY_USER_POSTS posts each.
+
+Inputs:
+    -u / --num-users: number of synthetic users (default: 1,000,000)
+    -s / --seed: random seed (default: 42)
+    -r / --repeats: number of timed runs per path; the fastest is reported (default: 3)
+
+Outputs:
+    Timings are printed to the console.
+
+Author: Matthew DeVerna
+"""
+import argparse
+import time
+
+import numpy as np
+
+from top_fibers_pkg.fib_helpers import (
+    build_reshare_csr,
+    calc_fib_index,
+    calc_fib_index_counting,
+    calc_fib_indices_batch,
+    FIB_COUNTING_KERNEL_MIN_POSTS,
+)
+
+KERNEL_SIZES = [10, 100, 1_000, 10_000, 100_000]
+HEAVY_USERS = 1_000
+HEAVY_USER_POSTS = 10_000
+
+
+def parse_cl_args():
+    """
+    Read command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the batch FIB-index engine against the per-user path."
+    )
+    parser.add_argument(
+        "-u",
+        "--num-users",
+        type=int,
+        default=1_000_000,
+        help="Number of synthetic users. Default: 1,000,000",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed. Default: 42",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of timed runs per path; the fastest is reported. Default: 3",
+    )
+    return parser.parse_args()
+
+
+def best_time(func, repeats):
+    """
+    Return the result of `func()` and the fastest of `repeats` timed calls.
+    """
+    best_secs = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best_secs = min(best_secs, time.perf_counter() - start)
+    return result, best_secs
+
+
+def sort_kernel(rt_counts):
+    """
+    The sort-based kernel that `calc_fib_index` uses for short lists.
+    """
+    rt_counts = sorted(rt_counts)
+    for fib_position in range(1, len(rt_counts) + 1)[::-1]:
+        if rt_counts[-fib_position] >= fib_position:
+            return fib_position
+    return 0
+
+
+def make_synthetic_reshare_lists(num_users, seed):
+    """
+    Create {user_id : [reshare counts]} where both the number of posts per user
+    and the reshare counts are heavy-tailed, like our real data.
+
+    Parameters:
+    -----------
+    - num_users (int) : number of users to create
+    - seed (int) : random seed
+
+    Returns:
+    -----------
+    - userid_reshare_lists (dict) : {userid_x : list([reshare counts])}
+    """
+    rng = np.random.default_rng(seed)
+    num_posts = rng.zipf(2.0, size=num_users).clip(max=50_000)
+    counts = rng.zipf(1.8, size=int(num_posts.sum())).clip(max=1_000_000) - 1
+
+    userid_reshare_lists = dict()
+    start = 0
+    for user_num, n in enumerate(num_posts):
+        userid_reshare_lists[str(user_num)] = counts[start : start + n].tolist()
+        start += n
+    return userid_reshare_lists
+
+
+if __name__ == "__main__":
+    args = parse_cl_args()
+
+    print(f"Creating {args.num_users:,} synthetic users...")
+    userid_reshare_lists = make_synthetic_reshare_lists(args.num_users, args.seed)
+    num_posts = sum(len(counts) for counts in userid_reshare_lists.values())
+    print(f"\t- Total posts: {num_posts:,}")
+
+    print("Per-user path (calc_fib_index)...")
+    loop_fibs, loop_secs = best_time(
+        lambda: [
+            calc_fib_index(list(counts)) for counts in userid_reshare_lists.values()
+        ],
+        args.repeats,
+    )
+    print(f"\t- {loop_secs:.2f} seconds")
+
+    print("Batch path (build_reshare_csr + calc_fib_indices_batch)...")
+    (_, reshare_counts, offsets), csr_secs = best_time(
+        lambda: build_reshare_csr(userid_reshare_lists), args.repeats
+    )
+    batch_fibs, batch_secs = best_time(
+        lambda: calc_fib_indices_batch(reshare_counts, offsets), args.repeats
+    )
+    print(f"\t- {csr_secs:.2f} seconds building the CSR arrays")
+    print(f"\t- {batch_secs:.2f} seconds calculating FIB indices")
+
+    if not np.array_equal(np.asarray(loop_fibs), batch_fibs):
+        raise ValueError("Batch FIB indices do not match `calc_fib_index`!")
+    print("Results match.")
+    print(f"Speedup (end-to-end): {loop_secs / (csr_secs + batch_secs):.1f}x")
+
+    print("Batch kernels (sort only | counting for long lists | counting only)...")
+    rng = np.random.default_rng(args.seed)
+    heavy_counts = rng.zipf(1.8, size=HEAVY_USERS * HEAVY_USER_POSTS) - 1
+    heavy_offsets = np.arange(HEAVY_USERS + 1, dtype=np.int64) * HEAVY_USER_POSTS
+    batches = [
+        ("synthetic users", reshare_counts, offsets),
+        (f"{HEAVY_USERS:,} x {HEAVY_USER_POSTS:,} posts", heavy_counts, heavy_offsets),
+    ]
+    for name, counts, user_offsets in batches:
+        kernel_fibs = []
+        kernel_secs = []
+        for min_posts in [len(counts) + 1, FIB_COUNTING_KERNEL_MIN_POSTS, 0]:
+            fibs, secs = best_time(
+                lambda: calc_fib_indices_batch(
+                    counts, user_offsets, counting_min_posts=min_posts
+                ),
+                args.repeats,
+            )
+            kernel_fibs.append(fibs)
+            kernel_secs.append(f"{secs:.2f}")
+        if not all(np.array_equal(kernel_fibs[0], fibs) for fibs in kernel_fibs):
+            raise ValueError("Batch kernels do not match!")
+        print(f"\t- {name}: {' | '.join(kernel_secs)} seconds")
+
+    print("Single-user kernels (sort vs. counting)...")
+    print(f"\t- Counting kernel threshold: {FIB_COUNTING_KERNEL_MIN_POSTS:,} posts")
+    rng = np.random.default_rng(args.seed)
+    for size in KERNEL_SIZES:
+        counts = (rng.zipf(1.8, size=size).clip(max=1_000_000) - 1).tolist()
+        sort_fib, sort_secs = best_time(lambda: sort_kernel(counts), args.repeats)
+        count_fib, count_secs = best_time(
+            lambda: calc_fib_index_counting(counts), args.repeats
+        )
+        if sort_fib != count_fib:
+            raise ValueError("Counting kernel does not match the sort kernel!")
+        print(
+            f"\t- {size:>7,} posts: sort {sort_secs * 1e6:>9,.1f} us | "
+            f"counting {count_secs * 1e6:>9,.1f} us"
+        )
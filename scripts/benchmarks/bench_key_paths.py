@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Purpose:
+    Benchmark the per-field cost of reading post fields with `get_dict_val` (how
+    every `data_model` getter used to work) against the compiled getters returned
+    by `compile_key_path`, and check that both return the same values.
+
+    Every key path read by `Tweet_v1` and `FbIgPost` is timed on a synthetic post
+    that has the field, and on one where the path is missing.
+
+Inputs:
+    -n / --number: number of calls per timing (default: 1,000,000)
+    -r / --repeats: number of timed runs per getter; the fastest is reported (default: 3)
+
+Outputs:
+    Nanoseconds per call of each getter are printed to the console.
+
+Author: Matthew DeVerna
+"""
+import argparse
+import timeit
+
+from top_fibers_pkg.data import compile_key_path, get_dict_val
+
+TWEET = {
+    "id_str": "1600000000000000000",
+    "text": "A tweet",
+    "created_at": "Wed Feb 01 00:00:00 +0000 2023",
+    "retweet_count": 3,
+    "user": {
+        "id_str": "1000000000",
+        "screen_name": "user",
+        "profile_image_url": "http://pbs.twimg.com/profile_images/1/a.jpg",
+    },
+}
+FB_POST = {
+    "id": "1000000000|1000000000_1",
+    "platformId": "1000000000_1",
+    "platform": "Facebook",
+    "date": "2023-02-01 00:00:00",
+    "postUrl": "https://www.facebook.com/1000000000/posts/1",
+    "account": {
+        "platformId": 1000000000,
+        "handle": "page",
+        "name": "A page",
+        "url": "https://www.facebook.com/1000000000",
+    },
+    "statistics": {"actual": {"shareCount": 3}},
+}
+
+# Key paths read by data_model.Tweet_v1 and data_model.FbIgPost
+KEY_PATHS = [
+    ("twitter", ["created_at"]),
+    ("twitter", ["retweet_count"]),
+    ("twitter", ["id_str"]),
+    ("twitter", ["user", "id_str"]),
+    ("twitter", ["user", "screen_name"]),
+    ("twitter", ["user", "profile_image_url"]),
+    ("facebook", ["platform"]),
+    ("facebook", ["date"]),
+    ("facebook", ["statistics", "actual", "shareCount"]),
+    ("facebook", ["platformId"]),
+    ("facebook", ["postUrl"]),
+    ("facebook", ["account", "platformId"]),
+    ("facebook", ["account", "handle"]),
+    ("facebook", ["account", "name"]),
+    ("facebook", ["account", "url"]),
+]
+
+
+def parse_cl_args():
+    """
+    Read command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark get_dict_val against compiled key-path getters."
+    )
+    parser.add_argument(
+        "-n",
+        "--number",
+        type=int,
+        default=1_000_000,
+        help="Number of calls per timing. Default: 1,000,000",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of timed runs per getter; the fastest is reported. Default: 3",
+    )
+    return parser.parse_args()
+
+
+def ns_per_call(func, number, repeats):
+    """
+    Return the fastest time (nanoseconds) per call of `func()` over `repeats` runs.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeats)) / number * 1e9
+
+
+if __name__ == "__main__":
+    args = parse_cl_args()
+    posts = {"twitter": TWEET, "facebook": FB_POST}
+
+    print(f"{'key path':<50} {'get_dict_val':>12} {'compiled':>9} {'speedup':>8}")
+    totals = {"old": 0, "new": 0}
+    for platform, key_list in KEY_PATHS:
+        get_value = compile_key_path(key_list)
+
+        # The second post is missing the path, which must return None in both cases
+        for post in [posts[platform], {key_list[0]: None}]:
+            if get_value(post) != get_dict_val(post, key_list):
+                raise ValueError(f"Values differ for key path: {key_list}")
+
+        post = posts[platform]
+        old_ns = ns_per_call(
+            lambda: get_dict_val(post, key_list), args.number, args.repeats
+        )
+        new_ns = ns_per_call(lambda: get_value(post), args.number, args.repeats)
+        totals["old"] += old_ns
+        totals["new"] += new_ns
+
+        label = f"{platform}: {key_list}"
+        print(
+            f"{label:<50} {old_ns:>10.0f}ns {new_ns:>7.0f}ns {old_ns / new_ns:>7.1f}x"
+        )
+
+    num_paths = len(KEY_PATHS)
+    print(
+        f"{'mean per field':<50} {totals['old'] / num_paths:>10.0f}ns "
+        f"{totals['new'] / num_paths:>7.0f}ns {totals['old'] / totals['new']:>7.1f}x"
+    )
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Purpose:
+    Compare the peak memory (RSS) of building a 3-month Twitter FIB window with
+    dictionaries keyed by string IDs (how `extract_data_from_files` used to work)
+    against the per-file aggregates and compact `PostStore`, and check that both
+    return identical FIB indices.
+
+    Each path runs in a fresh process on the same synthetic tweets: a mix of
+    original tweets and retweets, which also yield the retweeted tweet.
+
+Inputs:
+    -p / --num-posts: number of synthetic tweets per month (default: 1,000,000)
+    -u / --num-users: number of synthetic users (default: 100,000)
+    -s / --seed: random seed (default: 42)
+
+Outputs:
+    Peak RSS increase of each path is printed to the console.
+
+Author: Matthew DeVerna
+"""
+import argparse
+import multiprocessing
+import resource
+
+import numpy as np
+
+from collections import defaultdict
+
+from top_fibers_pkg.aggregates import aggregate_post_records
+from top_fibers_pkg.fib_helpers import (
+    create_fib_frame,
+    create_top_spreader_df,
+    create_userid_reshare_lists,
+    create_userid_total_reshares,
+    get_top_spreaders,
+)
+from top_fibers_pkg.post_store import PostStore, TWEET_URL_TEMPLATE
+from top_fibers_pkg.utils import set_fixed_mmap_threshold
+
+NUM_MONTHS = 3
+NUM_SPREADERS = 50
+FIRST_TWEET_ID = 1_600_000_000_000_000_000
+FIRST_USER_ID = 1_000_000_000
+FIRST_TIMESTAMP = 1_672_531_200
+
+
+def parse_cl_args():
+    """
+    Read command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare the peak memory of dictionary and PostStore windows."
+    )
+    parser.add_argument(
+        "-p",
+        "--num-posts",
+        type=int,
+        default=1_000_000,
+        help="Number of synthetic tweets per month. Default: 1,000,000",
+    )
+    parser.add_argument(
+        "-u",
+        "--num-users",
+        type=int,
+        default=100_000,
+        help="Number of synthetic users. Default: 100,000",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed. Default: 42",
+    )
+    return parser.parse_args()
+
+
+def iter_month_records(month, num_posts, num_users, seed):
+    """
+    Yield the records (ordered like post_cache.POST_CACHE_COLUMNS) of one month.
+    Half of the tweets are retweets of an earlier tweet of the same month.
+    """
+    rng = np.random.default_rng(seed + month)
+    first_id = FIRST_TWEET_ID + month * num_posts
+    user_nums = rng.integers(0, num_users, size=num_posts)
+    rt_counts = rng.zipf(2.0, size=num_posts) - 1
+    is_retweet = rng.random(num_posts) < 0.5
+
+    for i in range(num_posts):
+        tweet_id = first_id + i
+        user_id = FIRST_USER_ID + int(user_nums[i])
+        username = f"user{user_id}"
+        timestamp = FIRST_TIMESTAMP + month * 2_592_000 + i
+        url = TWEET_URL_TEMPLATE.format(username=username, post_id=tweet_id)
+        yield (str(tweet_id), str(user_id), username, 0, timestamp, url, 0, None)
+
+        if is_retweet[i] and i > 0:
+            orig = first_id + int(rng.integers(0, i))
+            orig_user_id = FIRST_USER_ID + int(user_nums[orig - first_id])
+            orig_username = f"user{orig_user_id}"
+            orig_url = TWEET_URL_TEMPLATE.format(username=orig_username, post_id=orig)
+            yield (
+                str(orig),
+                str(orig_user_id),
+                orig_username,
+                int(rt_counts[orig - first_id]),
+                FIRST_TIMESTAMP + month * 2_592_000 + orig - first_id,
+                orig_url,
+                1,
+                None,
+            )
+
+
+def build_with_dicts(num_posts, num_users, seed):
+    """
+    Build the window with string-keyed dictionaries and return its FIB indices.
+    """
+    tweetid_timestamp = dict()
+    tweetid_url = dict()
+    tweetid_max_rts = defaultdict(int)
+    userid_tweetids = defaultdict(set)
+    userid_username = dict()
+
+    for month in range(NUM_MONTHS):
+        records = iter_month_records(month, num_posts, num_users, seed)
+        for tweet_id, user_id, username, rt_count, timestamp, url, _, _ in records:
+            tweetid_max_rts[tweet_id] = max(tweetid_max_rts[tweet_id], rt_count)
+            tweetid_timestamp[tweet_id] = str(timestamp)
+            tweetid_url[tweet_id] = url
+            userid_tweetids[user_id].add(tweet_id)
+            userid_username[user_id] = username
+
+    userid_total_reshares = create_userid_total_reshares(
+        tweetid_max_rts, userid_tweetids
+    )
+    userid_reshare_lists = create_userid_reshare_lists(tweetid_max_rts, userid_tweetids)
+    fib_frame = create_fib_frame(
+        userid_reshare_lists, userid_username, userid_total_reshares
+    )
+    top_spreaders = get_top_spreaders(fib_frame, NUM_SPREADERS, "fib_index")
+    create_top_spreader_df(
+        top_spreaders, userid_tweetids, tweetid_max_rts, tweetid_timestamp, tweetid_url
+    )
+    return dict(zip(fib_frame["user_id"], fib_frame["fib_index"]))
+
+
+def build_with_store(num_posts, num_users, seed):
+    """
+    Build the window with per-file aggregates and a PostStore and return its FIB
+    indices.
+    """
+    aggregates = []
+    for month in range(NUM_MONTHS):
+        records = iter_month_records(month, num_posts, num_users, seed)
+        aggregates.append(
+            aggregate_post_records(records, "max", int_ids=True, keep_urls=False)
+        )
+    post_store = PostStore(aggregates, "max", url_template=TWEET_URL_TEMPLATE)
+    del aggregates
+
+    top_spreaders = post_store.get_top_spreaders(NUM_SPREADERS, "fib_index")
+    post_store.get_top_spreader_df(top_spreaders)
+    fib_frame = post_store.get_fib_frame()
+    return dict(zip(fib_frame["user_id"], fib_frame["fib_index"]))
+
+
+def measure_peak_rss(build_func, num_posts, num_users, seed):
+    """
+    Return the peak RSS increase (MB) of `build_func` and its FIB indices.
+    Both paths use the allocator setting of the FIB scripts.
+    """
+    set_fixed_mmap_threshold()
+    start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fib_indices = build_func(num_posts, num_users, seed)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak_kb - start_kb) / 1024, fib_indices
+
+
+if __name__ == "__main__":
+    args = parse_cl_args()
+    print(
+        f"Window: {NUM_MONTHS} months x {args.num_posts:,} tweets, "
+        f"{args.num_users:,} users"
+    )
+
+    # Every path runs in a fresh process so peak RSS is not shared between them
+    results = dict()
+    context = multiprocessing.get_context("spawn")
+    for name, build_func in [("dicts", build_with_dicts), ("store", build_with_store)]:
+        with context.Pool(1) as pool:
+            peak_mb, fib_indices = pool.apply(
+                measure_peak_rss,
+                (build_func, args.num_posts, args.num_users, args.seed),
+            )
+        results[name] = fib_indices
+        print(f"- {name:<5} : peak RSS increase {peak_mb:,.0f} MB")
+
+    if results["dicts"] != results["store"]:
+        raise ValueError("FIB indices do not match!")
+    print("FIB indices match.")
@@ -7,6 +7,24 @@ Purpose:
         Particularly important are:
             - NUMBER_OF_MONTHS_TO_PULL
             - OFFSET
+        - Several domains are downloaded at once (--workers), while the pages of
+            each domain are still requested one after another. All API calls
+            share a token-bucket rate limiter set by --calls-per-minute, which
+            should match our CrowdTangle quota.
+        - If the first page of a domain is full, the rest of the period is split
+            into sub-windows sized by the domain's post rate, which are searched
+            in parallel (see top_fibers_pkg.download_planner).
+        - Each post is written once, even if several domains return it (see
+            top_fibers_pkg.post_dedup). The other copies are set aside and, once
+            every domain is done, the copy with the most shares is kept (see
+            `select_post_copies`), so the output does not depend on the order in
+            which the searches finished.
+        - With --match-links, posts that do not link to any of the domains (see
+            top_fibers_pkg.domains) are dropped.
+        - Progress is checkpointed after every page (see
+            top_fibers_pkg.download_checkpoint). If the script stops partway,
+            run it again with --resume to skip finished domains and continue the
+            others from their last page.
 
 Inputs:
     Those loaded by top_fibers_pkg.utils.parse_cl_args_ct_dl
@@ -24,15 +42,26 @@ Outputs:
 Author:
     Matthew R. DeVerna
 """
+import asyncio
 import datetime
-import glob
-import gzip
 import json
 import os
-import time
 
 from top_fibers_pkg.dates import get_start_and_end_dates
-from top_fibers_pkg.crowdtangle_helpers import ct_get_search_posts
+from top_fibers_pkg.data_model import FbIgPost
+from top_fibers_pkg.download_checkpoint import DownloadCheckpoint
+from top_fibers_pkg.decoding import loads
+from top_fibers_pkg.domains import DomainMatcher, get_latest_domains_file
+from top_fibers_pkg.download_planner import (
+    WINDOW_PAGES,
+    estimate_post_rate,
+    parse_ct_date,
+    plan_windows,
+)
+from top_fibers_pkg.gzip_io import BgzfWriter, iter_gzip_lines
+from top_fibers_pkg.post_dedup import SeenPostIds
+from top_fibers_pkg.crowdtangle_helpers import CT_SEARCH_URL, CrowdTangleClient
+from top_fibers_pkg.rate_limit import TokenBucket
 from top_fibers_pkg.utils import parse_cl_args_ct_dl, load_lines, get_logger
 
 SCRIPT_PURPOSE = "Download Facebook posts from CrowdTangle based on a list of links."
@@ -41,10 +70,11 @@ LOG_DIR = "./logs"
 LOG_FNAME = "top_fibers_fb_link_dl.log"
 SUCCESS_FNAME = "success.log"
 
-NUMBER_OF_POSTS_PER_CALL = 10_000
+# Added to the output file path to name the file of the copies of posts already
+# written (see select_post_copies)
+COPIES_SUFFIX = ".copies"
 
-# Number of seconds to wait before every query, regardless of success or error
-WAIT_BTWN_POSTS = 8
+NUMBER_OF_POSTS_PER_CALL = 10_000
 
 # Base number of seconds to wait after encountering an error, raised to the number of try counts
 WAIT_BTWN_ERROR_BASE = 2
@@ -55,6 +85,581 @@ MAX_ATTEMPTS = 5
 # Maximum number of times to retry (*consecutive* failures) for domains that return no posts
 MAX_EMPTY_ATTEMPTS = 2
 
+# Sub-windows of a dense domain searched at once (see download_domain)
+WINDOW_CONCURRENCY = 4
+
+API_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def get_client(ct_token, api_url=CT_SEARCH_URL, pool_size=1):
+    """
+    Return the CrowdTangle client used for every search (see
+    top_fibers_pkg.crowdtangle_helpers.CrowdTangleClient).
+    """
+    # count = 10000 only if you request it, otherwise it's 100
+    # NOTE: This is more than the function says is allowed because we requested
+    # increased API limits from CrowdTangle folks.
+    return CrowdTangleClient(
+        ct_token,
+        url=api_url,
+        pool_size=pool_size,
+        count=NUMBER_OF_POSTS_PER_CALL,
+        sort_by="date",
+        min_interactions=0,
+        offset=0,
+        platforms="facebook",
+    )
+
+
+def search_domain(client, domain, start, end):
+    """
+    Return the decoded response to one search for posts that match `domain`,
+    sent between `start` and `end` (most recent first).
+    """
+    response = client.search_posts(search_term=domain, start_time=start, end_time=end)
+    return response.json()
+
+
+async def download_window(
+    domain,
+    window_start,
+    end,
+    client,
+    limiter,
+    f,
+    checkpoint,
+    seen,
+    copies,
+    window=None,
+    plan=False,
+    matcher=None,
+):
+    """
+    Download all posts that match one domain, sent between `window_start` and
+    `end`, and write them to `f`.
+
+    Pages are requested one after another, from the most recent posts backward.
+    Each API call first takes a token from the shared `limiter`, and waits after
+    errors do not hold up the other searches. If `checkpoint` holds the state of
+    this search, it is skipped if finished or continues from its last page.
+
+    Parameters:
+    -----------
+    - domain (str) : the domain to search for
+    - window_start (datetime.datetime) : the earliest time to download
+    - end (datetime.date or str) : the latest time to download (API_DATE_FORMAT)
+    - client (top_fibers_pkg.crowdtangle_helpers.CrowdTangleClient) : client
+        shared by all domains (see `get_client`)
+    - limiter (top_fibers_pkg.rate_limit.TokenBucket) : rate limiter shared by all
+        domains
+    - f (top_fibers_pkg.gzip_io.BgzfWriter) : the output file. Each page is written
+        and flushed in one call, so it is a run of whole gzip members and pages of
+        different domains are never mixed.
+    - checkpoint (top_fibers_pkg.download_checkpoint.DownloadCheckpoint) : the
+        state of the search is saved after every page
+    - seen (top_fibers_pkg.post_dedup.SeenPostIds) : IDs of the posts written by
+        all searches. Posts already written (e.g., posts that link to several
+        domains, or sent on the boundary of two sub-windows) are skipped
+    - copies (file) : the binary file that the skipped copies are added to (see
+        `select_post_copies`)
+    - window (str) : the start of the sub-window searched (API_DATE_FORMAT), or
+        None for the domain's first search. Default = None
+    - plan (bool) : if True and the first page is full, the rest of the period is
+        split into sub-windows by post rate, which ends this search. Default = False
+    - matcher (top_fibers_pkg.domains.DomainMatcher) : if provided, only posts that
+        link to one of its domains are written. Default = None
+
+    Returns:
+    -----------
+    - total_posts (int) : number of (new) posts written
+    - windows (list) : the [start, end] (API_DATE_FORMAT) of the planned
+        sub-windows, newest first, or None if the period was not split
+    """
+    total_posts = 0
+    try_count = 0
+    query_count = 0
+    max_attempts = MAX_ATTEMPTS
+    zero_post_count = 0
+    max_empty_attempts = MAX_EMPTY_ATTEMPTS
+    windows = None
+
+    # Log lines name the sub-window, if any
+    label = domain if window is None else f"{domain} {window}"
+    start = window_start.strftime(API_DATE_FORMAT)
+    state = checkpoint.get_state(domain, window)
+    if state is not None:
+        if state["done"]:
+            return state["posts"], state["windows"]
+        end = state["end"]
+        total_posts = state["posts"]
+        query_count = state["queries"]
+        logger.info(f"[{label}] Resuming from end date: {end}")
+
+    while True:
+        response_json = None
+        try:
+            await limiter.acquire()
+            # The blocking request runs in a thread, so other domains keep going
+            response_json = await asyncio.to_thread(
+                search_domain, client, domain, start, end
+            )
+
+            # Returns a list of dictionaries where each dict represents one post.
+            # We sort by `date` so the MOST RECENT post will be at the first index.
+            posts = response_json["result"]["posts"]
+
+            # If we get no results, we try a few more times and then break the loop
+            num_posts = len(posts)
+
+        except Exception as e:  # 6 calls/minute limit if you request them
+            logger.exception(f"[{label}] {e}")
+            try:
+                logger.info(f"[{label}] FB message: {response_json['message']}")
+            except:
+                pass
+
+            # Handle the retries...
+            try_count += 1
+            logger.info(f"[{label}] There are {max_attempts-try_count} tries left.")
+            if (max_attempts - try_count) <= 0:
+                logger.info(f"[{label}] Breaking out of loop!")
+                break
+            else:
+                await wait_before_retry(label, try_count)
+                continue
+
+        else:
+            # Returned CT results successfully, with zero posts
+            if num_posts == 0:
+                logger.info(f"[{label}] Zero posts were returned.")
+                try_count += 1
+                zero_post_count += 1
+                logger.info(
+                    f"[{label}] Empty retries remaining: "
+                    f"{max_empty_attempts-try_count}"
+                )
+                logger.info(
+                    f"[{label}] Total retries remaining: {max_attempts-try_count}"
+                )
+                if zero_post_count >= MAX_EMPTY_ATTEMPTS:
+                    logger.info(
+                        f"[{label}] Two consecutive queries with no posts. "
+                        "Breaking out of loop!"
+                    )
+                    break
+
+                elif (max_attempts - try_count) <= 0:
+                    logger.info(f"[{label}] Breaking out of loop!")
+                    break
+                else:
+                    await wait_before_retry(label, try_count)
+                    continue
+
+            # Returned CT results successfully, with new posts
+            else:
+                # Reset the retry count to zero
+                try_count = 0
+                zero_post_count = 0
+
+                most_recent_date_str = posts[0]["date"]
+                oldest_date_str = posts[-1]["date"]
+                if matcher is not None:
+                    posts = [post for post in posts if links_to_domain(post, matcher)]
+                is_new = [is_new_post(post, seen) for post in posts]
+                logger.info(
+                    f"[{label}]\t|--> {oldest_date_str} - {most_recent_date_str}"
+                    f": {num_posts:,} posts ({sum(is_new):,} new)."
+                )
+
+                # Copies are written first, so none is lost if we stop in between
+                copies.write(
+                    "".join(
+                        f"{json.dumps(post)}\n"
+                        for post, new in zip(posts, is_new)
+                        if not new
+                    ).encode(encoding="utf-8")
+                )
+                copies.flush()
+                posts = [post for post, new in zip(posts, is_new) if new]
+
+                # Convert each post into bytes with a new-line (`\n`)
+                f.write(
+                    "".join(f"{json.dumps(post)}\n" for post in posts).encode(
+                        encoding="utf-8"
+                    )
+                )
+                output_size = f.flush(sync=True)
+
+                total_posts += len(posts)
+                logger.info(f"[{label}] Total posts collected: {total_posts:,}")
+
+                # Update the time period we're searching.
+                # ---------------------------------------
+                # Facebook returns data in backwards order, meaning more recent posts are
+                # provided first. If we do not have all data it means that we are missing
+                # OLDER data. So we update the `end` time period (which is the most recent
+                # time parameter) with the oldest/earliest post we find and ensure we do
+                # not pull the same data twice by subtracting by one second to make sure
+                # there is no overlap.
+                # ---------------------------------------
+                oldest_date_dt = datetime.datetime.strptime(
+                    oldest_date_str, "%Y-%m-%d %H:%M:%S"
+                )
+                oldest_date_dt = oldest_date_dt - datetime.timedelta(seconds=1)
+
+            # If this is true, we have a bad query.
+            # More than 500 queries (~5M posts), we break the script.
+            have_all = oldest_date_dt <= window_start
+            query_count += 1
+            end = oldest_date_dt.strftime(API_DATE_FORMAT)
+            if plan and query_count == 1 and not have_all:
+                windows = plan_sub_windows(
+                    window_start, num_posts, most_recent_date_str, oldest_date_dt
+                )
+            done = have_all or query_count > 500 or windows is not None
+            checkpoint.save(
+                domain,
+                None if done else end,
+                total_posts,
+                query_count,
+                done,
+                output_size,
+                window=window,
+                windows=windows,
+            )
+            if windows is not None:
+                logger.info(f"[{label}]\t|--> Split into {len(windows)} sub-windows.")
+                break
+            if have_all:
+                logger.info(f"[{label}]\t|--> end <= start so we have all data.")
+                break
+            if query_count > 500:
+                break
+
+            # If all conditionals are passed, we update the date string for query
+            logger.info(f"[{label}]\t|--> New end date: {end}")
+            logger.info(f"[{label}]\t|--> {'-'*50}")
+
+    # Searches that ran out of retries are not tried again when resuming either
+    state = checkpoint.get_state(domain, window)
+    if state is None or not state["done"]:
+        checkpoint.save(
+            domain, None, total_posts, query_count, True, f.flush(), window=window
+        )
+    return total_posts, windows
+
+
+def is_new_post(post, seen):
+    """
+    Return False if `post` was already written, according to its `platformId`.
+    Otherwise, add it to `seen` and return True. Posts without an ID are kept.
+    """
+    post_id = post.get("platformId")
+    if post_id is None:
+        return True
+    return seen.add(str(post_id))
+
+
+def get_copy_key(post):
+    """
+    Return the key that orders the copies of one post: the copy with the most
+    shares (see data_model.FbIgPost.get_reshare_count) comes last, and copies
+    with as many shares are ordered by their content.
+    """
+    share_count = FbIgPost(post).get_reshare_count()
+    if share_count is None:
+        share_count = -1
+    return share_count, json.dumps(post, sort_keys=True)
+
+
+def load_best_copies(copies_path):
+    """
+    Return the copy with the largest `get_copy_key` of every post in the file of
+    copies, as a dictionary of post ID (str) -> (key, post). A line cut short
+    when the download stopped is skipped.
+    """
+    best_copies = dict()
+    with open(copies_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                continue
+            post = loads(line)
+            post_id = str(post["platformId"])
+            key = get_copy_key(post)
+            if post_id not in best_copies or key > best_copies[post_id][0]:
+                best_copies[post_id] = (key, post)
+    return best_copies
+
+
+def select_post_copies(output_file_path, copies_path):
+    """
+    Write a copy of the output file where every post returned more than once is
+    the copy with the largest `get_copy_key`, whichever copy was written first.
+    The kept copy thus does not depend on the order of the searches. The share
+    counts of a post only grow, so it is usually also the latest copy.
+
+    Parameters:
+    -----------
+    - output_file_path (str) : full path to the finished output file
+    - copies_path (str) : full path to the file of the copies that were skipped
+
+    Returns:
+    -----------
+    - new_file_path (str) : full path to the new output file, or None if no
+        post has to be replaced
+    - num_replaced (int) : number of posts replaced
+    """
+    best_copies = load_best_copies(copies_path)
+    if not best_copies:
+        return None, 0
+
+    num_replaced = 0
+    new_file_path = f"{output_file_path}.tmp"
+    with BgzfWriter(new_file_path) as f:
+        for line in iter_gzip_lines(output_file_path):
+            post = loads(line)
+            post_id = post.get("platformId")
+            if post_id is not None and str(post_id) in best_copies:
+                key, copy = best_copies.pop(str(post_id))
+                if key > get_copy_key(post):
+                    line = f"{json.dumps(copy)}\n".encode(encoding="utf-8")
+                    num_replaced += 1
+            f.write(line)
+    if num_replaced == 0:
+        os.remove(new_file_path)
+        return None, 0
+    return new_file_path, num_replaced
+
+
+def links_to_domain(post, matcher):
+    """
+    Return True if any link of `post` (see data_model.FbIgPost.get_links) matches
+    one of the domains of `matcher`.
+    """
+    return any(matcher.match_url(url) for url in FbIgPost(post).get_links())
+
+
+def load_post_ids(output_file_path):
+    """
+    Return the IDs of the posts in an (interrupted) output file, see
+    top_fibers_pkg.post_dedup.SeenPostIds.
+    """
+    seen = SeenPostIds()
+    for line in iter_gzip_lines(output_file_path):
+        post_id = loads(line).get("platformId")
+        if post_id is not None:
+            seen.add(str(post_id))
+    return seen
+
+
+def plan_sub_windows(window_start, num_posts, most_recent_date_str, oldest_date_dt):
+    """
+    Return the sub-windows (see top_fibers_pkg.download_planner.plan_windows) of
+    the rest of a period after its first page of `num_posts` posts, as [start, end]
+    strings (API_DATE_FORMAT), or None if the page is not full or the rest of the
+    period is expected to take only a few pages.
+    """
+    if num_posts < NUMBER_OF_POSTS_PER_CALL:
+        return None
+    post_rate = estimate_post_rate(
+        num_posts, oldest_date_dt, parse_ct_date(most_recent_date_str)
+    )
+    windows = plan_windows(
+        window_start,
+        oldest_date_dt,
+        post_rate,
+        WINDOW_PAGES * NUMBER_OF_POSTS_PER_CALL,
+    )
+    if len(windows) == 1:
+        return None
+    return [
+        [start.strftime(API_DATE_FORMAT), end.strftime(API_DATE_FORMAT)]
+        for start, end in windows
+    ]
+
+
+async def download_domain(
+    domain,
+    start_date,
+    end_date,
+    client,
+    limiter,
+    f,
+    checkpoint,
+    seen,
+    copies,
+    matcher=None,
+):
+    """
+    Download all posts that match one domain and write them to `f`.
+
+    The domain is first searched over the whole period. If its first page is full,
+    the rest of the period is split into sub-windows sized by the domain's post
+    rate, which are searched concurrently (WINDOW_CONCURRENCY at a time). See
+    `download_window` for the parameters.
+
+    Returns:
+    -----------
+    - total_posts (int) : number of posts written
+    """
+    period_start = datetime.datetime.combine(start_date, datetime.time(0, 0, 0))
+    total_posts, windows = await download_window(
+        domain,
+        period_start,
+        end_date,
+        client,
+        limiter,
+        f,
+        checkpoint,
+        seen,
+        copies,
+        plan=True,
+        matcher=matcher,
+    )
+    if not windows:
+        return total_posts
+
+    window_bounds = [
+        (
+            datetime.datetime.strptime(start, API_DATE_FORMAT),
+            datetime.datetime.strptime(end, API_DATE_FORMAT),
+        )
+        for start, end in windows
+    ]
+    semaphore = asyncio.Semaphore(WINDOW_CONCURRENCY)
+
+    async def download_sub_window(window_start, window_end):
+        async with semaphore:
+            posts, _ = await download_window(
+                domain,
+                window_start,
+                window_end.strftime(API_DATE_FORMAT),
+                client,
+                limiter,
+                f,
+                checkpoint,
+                seen,
+                copies,
+                window=window_start.strftime(API_DATE_FORMAT),
+                matcher=matcher,
+            )
+            return posts
+
+    posts = await asyncio.gather(
+        *[download_sub_window(start, end) for start, end in window_bounds]
+    )
+    return total_posts + sum(posts)
+
+
+async def wait_before_retry(domain, try_count):
+    """
+    Wait WAIT_BTWN_ERROR_BASE**try_count seconds before retrying a domain (or
+    one of its sub-windows).
+    """
+    wait_time = WAIT_BTWN_ERROR_BASE**try_count
+    if wait_time > 60:
+        logger.info(f"[{domain}] Waiting {wait_time / 60} minutes...")
+    else:
+        logger.info(f"[{domain}] Waiting {wait_time} seconds...")
+    await asyncio.sleep(wait_time)
+    logger.info(f"[{domain}] Retrying...")
+
+
+async def download_domains(
+    domains,
+    output_file_path,
+    start_date,
+    end_date,
+    client,
+    checkpoint,
+    workers=1,
+    calls_per_minute=6,
+    matcher=None,
+):
+    """
+    Download the posts that match every domain into one output file, with
+    `workers` domains downloaded at once.
+
+    Domains that `checkpoint` marks as finished are skipped. If it holds an
+    earlier run's state, the output file is cut back to its size at the last
+    checkpoint (which drops a page cut short or the end-of-file block) and new
+    pages are added to it.
+
+    Every post is written once, however many domains (or sub-windows) return it.
+    The other copies are added to the output file path + COPIES_SUFFIX (see
+    `select_post_copies`).
+
+    Parameters:
+    -----------
+    - domains (list) : the domains to search for. Workers take them in order.
+    - output_file_path (str) : full path to the output `.jsonl.gzip` file
+    - start_date (datetime.date) : the earliest date to download
+    - end_date (datetime.date) : the (excluded) last date to download
+    - client (top_fibers_pkg.crowdtangle_helpers.CrowdTangleClient) : see
+        `get_client`. Its pool should hold `workers` connections.
+    - checkpoint (top_fibers_pkg.download_checkpoint.DownloadCheckpoint) : the
+        download's checkpoint
+    - workers (int) : number of domains downloaded concurrently. Default = 1
+    - calls_per_minute (float) : the most API calls made per minute, by all
+        workers together. Default = 6
+    - matcher (top_fibers_pkg.domains.DomainMatcher) : if provided, only posts that
+        link to one of its domains are written. Default = None
+
+    Returns:
+    -----------
+    None
+    """
+    limiter = TokenBucket.per_minute(calls_per_minute)
+    num_domains = len(domains)
+    # Workers share the iterator, so each domain is downloaded exactly once
+    next_domains = enumerate(domains, start=1)
+
+    async def worker(f):
+        for idx, domain in next_domains:
+            if checkpoint.is_done(domain):
+                logger.info(
+                    f"Skipping finished domain {idx} of {num_domains}: {domain}"
+                )
+                continue
+            logger.info(
+                f"Collect posts matching domain {idx} of {num_domains}: {domain}"
+            )
+            total_posts = await download_domain(
+                domain,
+                start_date,
+                end_date,
+                client,
+                limiter,
+                f,
+                checkpoint,
+                seen,
+                copies,
+                matcher,
+            )
+            logger.info(f"[{domain}] Done. Posts collected: {total_posts:,}")
+
+    resume = checkpoint.output_size > 0
+    if resume:
+        with open(output_file_path, "r+b") as f:
+            f.truncate(checkpoint.output_size)
+        seen = load_post_ids(output_file_path)
+        logger.info(f"Posts already written: {len(seen):,}")
+    else:
+        seen = SeenPostIds()
+
+    # Open file here so we don't have to hold data in memory
+    # Written as BGZF so the blocks can be decompressed in parallel later
+    copies_mode = "ab" if resume else "wb"
+    with BgzfWriter(output_file_path, append=resume) as f, open(
+        f"{output_file_path}{COPIES_SUFFIX}", copies_mode
+    ) as copies:
+        await asyncio.gather(*[worker(f) for _ in range(max(1, workers))])
+    logger.info(
+        f"Unique posts written: {len(seen):,} "
+        f"(checked against the exact set: {seen.num_checked:,})"
+    )
+
+
 if __name__ == "__main__":
     script_name = os.path.basename(__file__)
     logger = get_logger(LOG_DIR, LOG_FNAME, script_name=script_name)
@@ -68,8 +673,7 @@ if __name__ == "__main__":
     num_months = int(args.num_months)
 
     logger.info(f"Domains dir: {domains_dir}")
-    all_domains_files = sorted(glob.glob(os.path.join(domains_dir, "*iffy_list.txt")))
-    latest_domains_filepath = all_domains_files[-1]
+    latest_domains_filepath = get_latest_domains_file(domains_dir)
     logger.info(f"Domains file: {latest_domains_filepath}")
 
     # Load domains to match in below query and clean up
@@ -113,164 +717,51 @@ if __name__ == "__main__":
 
     logger.info(f"Output file : {output_file_path}")
 
-    # Open file here so we don't have to hold data in memory
-    with gzip.open(output_file_path, "wb") as f:
-        # Iterate through each site
-        for idx, domain in enumerate(domains, start=1):
-            logger.info(
-                f"Collect posts matching domain {idx} of {len(domains)}: {domain}"
+    workers = int(args.workers)
+    calls_per_minute = float(args.calls_per_minute)
+    api_url = args.api_url or CT_SEARCH_URL
+    logger.info(f"Workers     : {workers}")
+    logger.info(f"Rate limit  : {calls_per_minute} calls/minute")
+
+    # CrowdTangle search terms also match post text, so returned posts can be
+    # filtered down to those that actually link to an Iffy domain
+    matcher = DomainMatcher(domains) if args.match_links else None
+    logger.info(f"Match links : {args.match_links}")
+
+    checkpoint = DownloadCheckpoint(output_file_path, resume=args.resume)
+    if args.resume:
+        num_done = sum(checkpoint.is_done(domain) for domain in domains)
+        logger.info(f"Resuming download. Finished domains: {num_done}")
+
+    # One connection per concurrent search is kept alive for the whole download
+    pool_size = workers * WINDOW_CONCURRENCY
+    with get_client(ct_token, api_url, pool_size=pool_size) as client:
+        asyncio.run(
+            download_domains(
+                domains,
+                output_file_path,
+                start_date,
+                end_date,
+                client,
+                checkpoint,
+                workers,
+                calls_per_minute,
+                matcher,
             )
-
-            total_posts = 0
-            try_count = 0
-            query_count = 0
-            max_attempts = MAX_ATTEMPTS
-            zero_post_count = 0
-            max_empty_attempts = MAX_EMPTY_ATTEMPTS
-
-            start = start_date
-            end = end_date
-            while True:
-                try:
-                    # count = 10000 only if you request it, otherwise it's 100
-                    # NOTE: This is more than the function says is allowed because we requested
-                    # increased API limits from CrowdTangle folks.
-                    time.sleep(WAIT_BTWN_POSTS)
-                    response = ct_get_search_posts(
-                        count=NUMBER_OF_POSTS_PER_CALL,
-                        start_time=start,
-                        end_time=end,
-                        include_history=None,
-                        sort_by="date",
-                        types=None,
-                        search_term=domain,
-                        account_types=None,
-                        min_interactions=0,
-                        offset=0,
-                        api_token=ct_token,
-                        platforms="facebook",
-                        lang=None,
-                    )
-                    response_json = response.json()
-
-                    # Returns a list of dictionaries where each dict represents one post.
-                    # We sort by `date` so the MOST RECENT post will be at the first index.
-                    posts = response_json["result"]["posts"]
-
-                    # If we get no results, we try a few more times and then break the loop
-                    num_posts = len(posts)
-
-                except Exception as e:  # 6 calls/minute limit if you request them
-                    logger.exception(e)
-                    try:
-                        logger.info(f"FB message: {response_json['message']}")
-                    except:
-                        pass
-
-                    # Handle the retries...
-                    try_count += 1
-                    logger.info(f"There are {max_attempts-try_count} tries left.")
-                    if (max_attempts - try_count) <= 0:
-                        logger.info("Breaking out of loop!")
-                        break
-                    else:
-                        wait_time = WAIT_BTWN_ERROR_BASE**try_count
-                        if wait_time > 60:
-                            wait_time = wait_time / 60
-                            logger.info(f"Waiting {wait_time} minutes...")
-                        else:
-                            logger.info(f"Waiting {wait_time} seconds...")
-                        time.sleep(wait_time)
-                        logger.info(f"Retrying...")
-                        continue
-
-                else:
-                    # Returned CT results successfully, with zero posts
-                    if num_posts == 0:
-                        logger.info("Zero posts were returned.")
-                        try_count += 1
-                        zero_post_count += 1
-                        logger.info(
-                            f"Empty retries remaining: {max_empty_attempts-try_count}"
-                        )
-                        logger.info(
-                            f"Total retries remaining: {max_attempts-try_count}"
-                        )
-                        if zero_post_count >= MAX_EMPTY_ATTEMPTS:
-                            logger.info(
-                                "Two consecutive queries with no posts. "
-                                "Breaking out of loop!"
-                            )
-                            break
-
-                        elif (max_attempts - try_count) <= 0:
-                            logger.info("Breaking out of loop!")
-                            break
-                        else:
-                            wait_time = WAIT_BTWN_ERROR_BASE**try_count
-                            if wait_time > 60:
-                                wait_time = wait_time / 60
-                                logger.info(f"Waiting {wait_time} minutes...")
-                            else:
-                                logger.info(f"Waiting {wait_time} seconds...")
-                            time.sleep(wait_time)
-                            logger.info(f"Retrying...")
-                            continue
-
-                    # Returned CT results successfully, with new posts
-                    else:
-                        # Reset the retry count to zero
-                        try_count = 0
-                        zero_post_count = 0
-
-                        most_recent_date_str = posts[0]["date"]
-                        oldest_date_str = posts[-1]["date"]
-                        logger.info(
-                            f"\t|--> {oldest_date_str} - {most_recent_date_str}"
-                            f": {num_posts:,} posts."
-                        )
-
-                        # Convert each post into bytes with a new-line (`\n`)
-                        for post in posts:
-                            post_in_bytes = f"{json.dumps(post)}\n".encode(
-                                encoding="utf-8"
-                            )
-                            f.write(post_in_bytes)
-
-                        total_posts += num_posts
-                        logger.info(f"Total posts collected: {total_posts:,}")
-
-                        # Update the time period we're searching.
-                        # ---------------------------------------
-                        # Facebook returns data in backwards order, meaning more recent posts are
-                        # provided first. If we do not have all data it means that we are missing
-                        # OLDER data. So we update the `end` time period (which is the most recent
-                        # time parameter) with the oldest/earliest post we find and ensure we do
-                        # not pull the same data twice by subtracting by one second to make sure
-                        # there is no overlap.
-                        # ---------------------------------------
-                        oldest_date_dt = datetime.datetime.strptime(
-                            oldest_date_str, "%Y-%m-%d %H:%M:%S"
-                        )
-                        oldest_date_dt = oldest_date_dt - datetime.timedelta(seconds=1)
-
-                    # If this is true, we have a bad query. (start_date is a date object)
-                    empty_time = datetime.time(0, 0, 0)
-                    if oldest_date_dt <= datetime.datetime.combine(
-                        start_date, empty_time
-                    ):
-                        logger.info(f"\t|--> end <= start so we have all data.")
-                        break
-
-                    # More than 500 queries (~5M posts), we break the script.
-                    query_count += 1
-                    if query_count > 500:
-                        break
-
-                    # If all conditionals are passed, we update the date string for query
-                    end = oldest_date_dt.strftime("%Y-%m-%dT%H:%M:%S")
-                    logger.info(f"\t|--> New end date: {end}")
-                    logger.info(f"\t|--> {'-'*50}")
+        )
+        logger.info(f"Response times (seconds): {client.metrics.summary()}")
+
+    # Keep the same copy of every post returned more than once, whatever the
+    # order of the searches
+    copies_path = f"{output_file_path}{COPIES_SUFFIX}"
+    new_file_path, num_replaced = select_post_copies(output_file_path, copies_path)
+    logger.info(f"Posts replaced by another copy: {num_replaced:,}")
+
+    # The download is complete, so there is nothing left to resume
+    checkpoint.remove()
+    if new_file_path is not None:
+        os.replace(new_file_path, output_file_path)
+    os.remove(copies_path)
     with open(os.path.join(REPO_ROOT, SUCCESS_FNAME), "w+") as outfile:
         pass
     logger.info("~~~ Script complete! ~~~")
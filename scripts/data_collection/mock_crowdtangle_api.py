@@ -0,0 +1,362 @@
+"""
+Purpose:
+    Serve a mock of the CrowdTangle search endpoint on localhost, so that
+    crowdtangle_dl_fb_links.py can be run (with --api-url) without a token or
+    quota. E.g., to check how dense domains are split into sub-windows (see
+    top_fibers_pkg.download_planner), how posts returned by several domains are
+    written once (see top_fibers_pkg.post_dedup), or how rate limit errors and
+    --resume are handled.
+
+    Every domain (the search term) has a fixed, pseudo-random set of posts sent
+    during the period of --last-month and --num-months, so runs are repeatable.
+    A search returns the posts of its domain sent between `startDate` and
+    `endDate` (both inclusive), most recent first, up to `count` posts.
+
+    NOTE:
+        - Domains passed to --dense-domains get --dense-posts posts. The
+            downloader splits the period of a domain when it holds more than
+            WINDOW_PAGES pages of posts (see top_fibers_pkg.download_planner).
+        - About --shared-fraction of the posts are drawn from a pool of post IDs
+            shared by all domains, as if they linked to several domains.
+        - With --fail-every N, every Nth call returns a 429 (rate limited) error.
+
+Inputs:
+    -p / --port: Port to listen on (default: 8765)
+    -l / --last-month: The last month of the posts (YYYY_MM)
+    -n / --num-months: The number of months of posts (works backwards from
+        --last-month, like crowdtangle_dl_fb_links.py)
+    --max-posts: The most posts of a domain (default: 300)
+    --dense-domains: Domains that get --dense-posts posts
+    --dense-posts: The number of posts of every dense domain (default: 150,000)
+    --shared-fraction: Fraction of posts drawn from the shared pool (default: 0.1)
+    --fail-every: Return a 429 error every this many calls (default: 0, never)
+    --delay: Seconds to wait before every response (default: 0.05)
+
+Outputs:
+    The parameters of every call are logged.
+
+Example:
+    python mock_crowdtangle_api.py -l 2023_01 -n 1 --dense-domains example.com
+    TOP_FIBERS_TOKEN=mock python crowdtangle_dl_fb_links.py -d <domains_dir> \\
+        -o <out_dir> -l 2023_01 -n 1 --api-url http://127.0.0.1:8765/
+
+Author: Matthew DeVerna
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from top_fibers_pkg.dates import get_start_and_end_dates
+from top_fibers_pkg.download_planner import CT_DATE_FORMAT
+from top_fibers_pkg.utils import get_logger
+
+SCRIPT_PURPOSE = "Serve a mock of the CrowdTangle search endpoint on localhost."
+LOG_DIR = "./logs"
+LOG_FNAME = "mock_crowdtangle_api.log"
+
+# Date formats accepted for `startDate` and `endDate`
+REQUEST_DATE_FORMATS = ["%Y-%m-%dT%H:%M:%S", CT_DATE_FORMAT, "%Y-%m-%d"]
+
+# Number of post IDs in the pool shared by all domains
+SHARED_POOL_SIZE = 1_000
+
+
+def parse_cl_args(script_purpose="", logger=None):
+    """
+    Read command line arguments.
+
+    Parameters:
+    --------------
+    - script_purpose (str) : Purpose of the script being utilized. When printing
+        script help message via `python script.py -h`, this will represent the
+        script's description. Default = "" (an empty string)
+    - logger : a logging object
+
+    Returns
+    --------------
+    None
+
+    Exceptions
+    --------------
+    None
+    """
+    logger.info("Parsing command line arguments...")
+
+    # Initiate the parser
+    parser = argparse.ArgumentParser(description=script_purpose)
+
+    parser.add_argument(
+        "-p",
+        "--port",
+        metavar="Port",
+        help="Port to listen on (default: 8765)",
+        type=int,
+        default=8765,
+    )
+    parser.add_argument(
+        "-l",
+        "--last-month",
+        metavar="Last month",
+        help="The last month of the posts (YYYY_MM)",
+        required=True,
+    )
+    parser.add_argument(
+        "-n",
+        "--num-months",
+        metavar="Number of months",
+        help="The number of months of posts (works backwards from --last-month)",
+        type=int,
+        required=True,
+    )
+    parser.add_argument(
+        "--max-posts",
+        metavar="Max posts",
+        help="The most posts of a domain (default: 300)",
+        type=int,
+        default=300,
+    )
+    parser.add_argument(
+        "--dense-domains",
+        metavar="Dense domains",
+        help="Domains that get --dense-posts posts",
+        nargs="*",
+        default=[],
+    )
+    parser.add_argument(
+        "--dense-posts",
+        metavar="Dense posts",
+        help="The number of posts of every dense domain (default: 150,000)",
+        type=int,
+        default=150_000,
+    )
+    parser.add_argument(
+        "--shared-fraction",
+        metavar="Shared fraction",
+        help="Fraction of posts drawn from a pool shared by all domains (default: 0.1)",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--fail-every",
+        metavar="Fail every",
+        help="Return a 429 error every this many calls (default: 0, never)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--delay",
+        metavar="Delay",
+        help="Seconds to wait before every response (default: 0.05)",
+        type=float,
+        default=0.05,
+    )
+
+    # Read parsed arguments from the command line into "args"
+    args = parser.parse_args()
+
+    return args
+
+
+def parse_request_date(date_str):
+    """
+    Parse a `startDate` or `endDate` parameter (see REQUEST_DATE_FORMATS).
+    """
+    for date_format in REQUEST_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date_str, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"Unknown date format: {date_str}")
+
+
+def make_post(post_num, domain, post_time, rng):
+    """
+    Return a post in the format of the CrowdTangle API (the fields read by
+    top_fibers_pkg.data_model.FbIgPost), which links to `domain`.
+    """
+    account_id = str(rng.randrange(1_000))
+    platform_id = f"{account_id}_{post_num}"
+    link = f"https://{domain}/article/{post_num}"
+    return {
+        "id": f"{rng.randrange(10**6)}|{platform_id}",
+        "platformId": platform_id,
+        "platform": "Facebook",
+        "date": post_time.strftime(CT_DATE_FORMAT),
+        "postUrl": f"https://www.facebook.com/{account_id}/posts/{post_num}",
+        "link": link,
+        "expandedLinks": [{"original": link, "expanded": link}],
+        "statistics": {"actual": {"shareCount": rng.randrange(50)}},
+        "account": {
+            "platformId": account_id,
+            "handle": f"account{account_id}",
+            "name": f"Account {account_id}",
+            "url": f"https://www.facebook.com/{account_id}",
+        },
+    }
+
+
+class MockCrowdTangle:
+    """
+    The posts of every domain, built the first time the domain is searched (see
+    the module docstring).
+
+    Parameters:
+    -----------
+    - start (datetime.datetime) : the earliest time of the posts
+    - end (datetime.datetime) : the latest time of the posts
+    - max_posts (int) : the most posts of a domain
+    - dense_domains (list) : domains that get `dense_posts` posts
+    - dense_posts (int) : the number of posts of every dense domain
+    - shared_fraction (float) : fraction of posts drawn from the shared pool
+    """
+
+    def __init__(
+        self, start, end, max_posts, dense_domains, dense_posts, shared_fraction
+    ):
+        self.start = start
+        self.end = end
+        self.max_posts = max_posts
+        self.dense_domains = set(dense_domains)
+        self.dense_posts = dense_posts
+        self.shared_fraction = shared_fraction
+        self._posts = dict()
+        self._lock = threading.Lock()
+
+    def _get_post_time(self, rng):
+        seconds = int((self.end - self.start).total_seconds())
+        return self.start + datetime.timedelta(seconds=rng.randrange(seconds + 1))
+
+    def _build_posts(self, domain):
+        rng = random.Random(domain)
+        num_posts = rng.randint(0, self.max_posts)
+        if domain in self.dense_domains:
+            num_posts = self.dense_posts
+
+        posts = dict()
+        for _ in range(num_posts):
+            if rng.random() < self.shared_fraction:
+                # Shared posts have the same ID and date whatever the domain
+                post_num = rng.randrange(SHARED_POOL_SIZE)
+                post_rng = random.Random(post_num)
+            else:
+                post_num = rng.randrange(SHARED_POOL_SIZE, 10**12)
+                post_rng = rng
+            post_time = self._get_post_time(post_rng)
+            posts[post_num] = make_post(post_num, domain, post_time, post_rng)
+
+        return sorted(posts.values(), key=lambda post: post["date"], reverse=True)
+
+    def get_posts(self, domain):
+        """
+        Return the posts of `domain`, most recent first.
+        """
+        with self._lock:
+            if domain not in self._posts:
+                self._posts[domain] = self._build_posts(domain)
+            return self._posts[domain]
+
+    def search(self, domain, start, end, count):
+        """
+        Return the posts of `domain` sent between `start` and `end` (strings in
+        CT_DATE_FORMAT, both inclusive), most recent first, up to `count` posts.
+        """
+        posts = []
+        for post in self.get_posts(domain):
+            if post["date"] > end:
+                continue
+            if post["date"] < start or len(posts) >= count:
+                break
+            posts.append(post)
+        return posts
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answer search requests with the posts of `server.mock` (a MockCrowdTangle).
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Calls are logged in `do_GET`
+        pass
+
+    def send_json(self, status, response):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        params = {
+            key: values[0]
+            for key, values in parse_qs(urlparse(self.path).query).items()
+        }
+        with self.server.lock:
+            self.server.num_calls += 1
+            call_num = self.server.num_calls
+        logger.info(f"Call {call_num}: {params}")
+
+        fail_every = self.server.fail_every
+        if fail_every and call_num % fail_every == 0:
+            self.send_json(429, {"status": 429, "message": "Rate limit exceeded"})
+            return
+
+        time.sleep(self.server.delay)
+        try:
+            start = parse_request_date(params["startDate"])
+            end = parse_request_date(params["endDate"])
+            posts = self.server.mock.search(
+                params["searchTerm"],
+                start.strftime(CT_DATE_FORMAT),
+                end.strftime(CT_DATE_FORMAT),
+                int(params.get("count", 100)),
+            )
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"status": 400, "message": str(e)})
+            return
+        self.send_json(200, {"status": 200, "result": {"posts": posts}})
+
+
+if __name__ == "__main__":
+    script_name = os.path.basename(__file__)
+    logger = get_logger(LOG_DIR, LOG_FNAME, script_name=script_name, also_print=True)
+    logger.info("-" * 50)
+    logger.info(f"Begin script: {__file__}")
+
+    args = parse_cl_args(SCRIPT_PURPOSE, logger)
+    start_date, end_date = get_start_and_end_dates(args.num_months, args.last_month)
+    logger.info(f"Start date : {start_date}")
+    logger.info(f"End date   : {end_date}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), MockRequestHandler)
+    server.mock = MockCrowdTangle(
+        start_date,
+        end_date,
+        args.max_posts,
+        args.dense_domains,
+        args.dense_posts,
+        args.shared_fraction,
+    )
+    server.fail_every = args.fail_every
+    server.delay = args.delay
+    server.lock = threading.Lock()
+    server.num_calls = 0
+
+    logger.info(f"Serving at: http://127.0.0.1:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping server...")
+    finally:
+        server.server_close()
+    logger.info("~~~ Script complete! ~~~")
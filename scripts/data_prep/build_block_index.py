@@ -0,0 +1,138 @@
+"""
+Purpose:
+    Build the block index of raw post files, which lets readers seek straight to
+    the parts of a file that can hold given users or time slices (see
+    top_fibers_pkg.block_index). Each raw file is indexed once; its index is only
+    rebuilt if the raw file's size or modification time changes.
+
+Inputs:
+    -d / --data-dir: Full path to the raw posts directory of one platform
+    -i / --index-dir: Full path to the directory where indexes are saved
+    -p / --platform: The platform of the raw posts
+
+Outputs:
+    One Parquet file per raw file, saved in `index_dir`. E.g.:
+        - 2023-01-01__tweets_w_links.jsonl.gzip ->
+            2023-01-01__tweets_w_links__block_index.parquet
+    Columns are described in top_fibers_pkg.block_index.BLOCK_INDEX_SCHEMA.
+
+Author: Matthew DeVerna
+"""
+import argparse
+import glob
+import os
+import sys
+
+from top_fibers_pkg.block_index import build_block_index, is_block_index_current
+from top_fibers_pkg.utils import get_logger
+
+SCRIPT_PURPOSE = (
+    "Build the block index of raw post files. Files with a current index are "
+    "skipped."
+)
+REPO_ROOT = "/home/data/apps/topfibers/repo"
+LOG_DIR = "./logs"
+LOG_FNAME = "build_block_index.log"
+SUCCESS_FNAME = "success.log"
+MATCHING_STR = "*.jsonl.gzip"
+
+
+def parse_cl_args(script_purpose="", logger=None):
+    """
+    Read command line arguments.
+
+    Parameters:
+    --------------
+    - script_purpose (str) : Purpose of the script being utilized. When printing
+        script help message via `python script.py -h`, this will represent the
+        script's description. Default = "" (an empty string)
+    - logger : a logging object
+
+    Returns
+    --------------
+    None
+
+    Exceptions
+    --------------
+    None
+    """
+    logger.info("Parsing command line arguments...")
+
+    # Initiate the parser
+    parser = argparse.ArgumentParser(description=script_purpose)
+
+    help_msg = (
+        "Full path to the raw posts directory of one platform. "
+        "Ex: /home/data/apps/topfibers/repo/data/raw/twitter"
+    )
+    parser.add_argument(
+        "-d",
+        "--data-dir",
+        metavar="Data dir",
+        help=help_msg,
+        required=True,
+    )
+    help_msg = (
+        "Full path to the directory where indexes are saved. "
+        "Ex: /home/data/apps/topfibers/repo/data/derived/block_index/twitter"
+    )
+    parser.add_argument(
+        "-i",
+        "--index-dir",
+        metavar="Index dir",
+        help=help_msg,
+        required=True,
+    )
+    parser.add_argument(
+        "-p",
+        "--platform",
+        metavar="Platform",
+        help="The platform of the raw posts. Options: [twitter, facebook]",
+        choices=["twitter", "facebook"],
+        required=True,
+    )
+
+    # Read parsed arguments from the command line into "args"
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    if not (os.getcwd() == REPO_ROOT):
+        sys.exit(
+            "ALL SCRIPTS MUST BE RUN FROM THE REPO ROOT!!\n"
+            f"\tCurrent directory: {os.getcwd()}\n"
+            f"\tRepo root        : {REPO_ROOT}\n"
+        )
+    script_name = os.path.basename(__file__)
+    logger = get_logger(LOG_DIR, LOG_FNAME, script_name=script_name, also_print=True)
+    logger.info("-" * 50)
+    logger.info(f"Begin script: {__file__}")
+
+    args = parse_cl_args(SCRIPT_PURPOSE, logger)
+    data_dir = args.data_dir
+    index_dir = args.index_dir
+    platform = args.platform
+
+    files = sorted(glob.glob(os.path.join(data_dir, MATCHING_STR)))
+    num_files = len(files)
+    logger.info(f"Indexing {platform} files found here: {data_dir}")
+    logger.info(f"Number of files: {num_files}")
+
+    for fnum, file in enumerate(files, start=1):
+        logger.info(f"Working on file ({fnum}/{num_files}): {file}")
+        if is_block_index_current(file, index_dir):
+            logger.info("Skipping file because its index is current.")
+            continue
+
+        try:
+            index_path = build_block_index(file, index_dir, platform)
+        except Exception as e:
+            logger.exception(f"Problem indexing data file: {file}")
+            raise Exception(e)
+        logger.info(f"\t- Saved: {index_path}")
+
+    with open(os.path.join(REPO_ROOT, SUCCESS_FNAME), "w+") as outfile:
+        pass
+    logger.info("~~~ Script complete! ~~~")
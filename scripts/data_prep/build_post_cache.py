@@ -0,0 +1,136 @@
+"""
+Purpose:
+    Convert raw post files into slim Parquet caches that the FIB calculation
+    scripts read instead of the raw JSON. Each raw file is converted once; its
+    cache is only rebuilt if the raw file's size or modification time changes.
+
+Inputs:
+    -d / --data-dir: Full path to the raw posts directory of one platform
+    -c / --cache-dir: Full path to the directory where caches are saved
+    -p / --platform: The platform of the raw posts
+
+Outputs:
+    One Parquet file per raw file, saved in `cache_dir`. E.g.:
+        - 2023-01-01__tweets_w_links.jsonl.gzip -> 2023-01-01__tweets_w_links.parquet
+    Columns are described in top_fibers_pkg.post_cache.POST_CACHE_SCHEMA.
+
+Author: Matthew DeVerna
+"""
+import argparse
+import glob
+import os
+import sys
+
+from top_fibers_pkg.post_cache import build_post_cache, is_cache_current
+from top_fibers_pkg.utils import get_logger
+
+SCRIPT_PURPOSE = (
+    "Convert raw post files into Parquet caches for the FIB calculation scripts. "
+    "Files with a current cache are skipped."
+)
+REPO_ROOT = "/home/data/apps/topfibers/repo"
+LOG_DIR = "./logs"
+LOG_FNAME = "build_post_cache.log"
+SUCCESS_FNAME = "success.log"
+MATCHING_STR = "*.jsonl.gzip"
+
+
+def parse_cl_args(script_purpose="", logger=None):
+    """
+    Read command line arguments.
+
+    Parameters:
+    --------------
+    - script_purpose (str) : Purpose of the script being utilized. When printing
+        script help message via `python script.py -h`, this will represent the
+        script's description. Default = "" (an empty string)
+    - logger : a logging object
+
+    Returns
+    --------------
+    None
+
+    Exceptions
+    --------------
+    None
+    """
+    logger.info("Parsing command line arguments...")
+
+    # Initiate the parser
+    parser = argparse.ArgumentParser(description=script_purpose)
+
+    help_msg = (
+        "Full path to the raw posts directory of one platform. "
+        "Ex: /home/data/apps/topfibers/repo/data/raw/twitter"
+    )
+    parser.add_argument(
+        "-d",
+        "--data-dir",
+        metavar="Data dir",
+        help=help_msg,
+        required=True,
+    )
+    help_msg = (
+        "Full path to the directory where caches are saved. "
+        "Ex: /home/data/apps/topfibers/repo/data/derived/post_cache/twitter"
+    )
+    parser.add_argument(
+        "-c",
+        "--cache-dir",
+        metavar="Cache dir",
+        help=help_msg,
+        required=True,
+    )
+    parser.add_argument(
+        "-p",
+        "--platform",
+        metavar="Platform",
+        help="The platform of the raw posts. Options: [twitter, facebook]",
+        choices=["twitter", "facebook"],
+        required=True,
+    )
+
+    # Read parsed arguments from the command line into "args"
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    if not (os.getcwd() == REPO_ROOT):
+        sys.exit(
+            "ALL SCRIPTS MUST BE RUN FROM THE REPO ROOT!!\n"
+            f"\tCurrent directory: {os.getcwd()}\n"
+            f"\tRepo root        : {REPO_ROOT}\n"
+        )
+    script_name = os.path.basename(__file__)
+    logger = get_logger(LOG_DIR, LOG_FNAME, script_name=script_name, also_print=True)
+    logger.info("-" * 50)
+    logger.info(f"Begin script: {__file__}")
+
+    args = parse_cl_args(SCRIPT_PURPOSE, logger)
+    data_dir = args.data_dir
+    cache_dir = args.cache_dir
+    platform = args.platform
+
+    files = sorted(glob.glob(os.path.join(data_dir, MATCHING_STR)))
+    num_files = len(files)
+    logger.info(f"Caching {platform} files found here: {data_dir}")
+    logger.info(f"Number of files: {num_files}")
+
+    for fnum, file in enumerate(files, start=1):
+        logger.info(f"Working on file ({fnum}/{num_files}): {file}")
+        if is_cache_current(file, cache_dir):
+            logger.info("Skipping file because its cache is current.")
+            continue
+
+        try:
+            cache_path = build_post_cache(file, cache_dir, platform, logger)
+        except Exception as e:
+            logger.exception(f"Problem caching data file: {file}")
+            raise Exception(e)
+        logger.info(f"\t- Saved: {cache_path}")
+
+    with open(os.path.join(REPO_ROOT, SUCCESS_FNAME), "w+") as outfile:
+        pass
+    logger.info("~~~ Script complete! ~~~")
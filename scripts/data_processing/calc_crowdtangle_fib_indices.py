@@ -10,6 +10,9 @@ Inputs:
     NOTE:
     - Call the calc_crowdtangle_fib_indices.py -h flag to get input/flag details.
     - Input files contain Facebook posts.
+    - Passing a range of months to --month-calculated (e.g., 2022_01..2023_05)
+        calculates every month in one run. In that case, --data-dir must be the
+        directory of raw CrowdTangle files; each file is parsed only once.
 
 
 Output:
@@ -24,7 +27,8 @@ Output:
         - num_reshares (int) : the number of times post_id was reshared
         - timestamp (str) : timestamp when post was sent
 
-    NOTE: YYYY_mm_dd will be representative of the machine's current date
+    NOTE: YYYY_mm_dd will be representative of the machine's current date.
+        Files are saved in a subdirectory of --out-dir named after the month calculated.
 
 What is the FIB-index?
     Please see our working paper for details.
@@ -35,21 +39,34 @@ Author: Matthew DeVerna
 ### ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Load Packages ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 import datetime
 import glob
-import gzip
-import json
+import multiprocessing
 import os
 import sys
 
-from collections import defaultdict
-from top_fibers_pkg.data_model import FbIgPost
-from top_fibers_pkg.dates import get_earliest_date
-from top_fibers_pkg.utils import parse_cl_args_fib, get_logger
-from top_fibers_pkg.fib_helpers import (
-    create_userid_total_reshares,
-    create_userid_reshare_lists,
-    create_fib_frame,
-    get_top_spreaders,
-    create_top_spreader_df,
+from top_fibers_pkg.aggregates import (
+    aggregate_post_records,
+    combine_aggregates,
+    get_month_aggregate_path,
+    is_month_aggregate_current,
+    read_month_aggregate,
+    save_month_aggregate,
+)
+from top_fibers_pkg.post_store import PostStore
+from top_fibers_pkg.post_cache import (
+    is_cache_current,
+    iter_cached_records,
+    iter_post_records,
+)
+from top_fibers_pkg.dates import (
+    get_earliest_date,
+    get_months_in_range,
+    get_window_months,
+    group_files_by_month,
+)
+from top_fibers_pkg.utils import (
+    parse_cl_args_fib,
+    get_logger,
+    set_fixed_mmap_threshold,
 )
 
 REPO_ROOT = "/home/data/apps/topfibers/repo"
@@ -66,179 +83,273 @@ SUCCESS_FNAME = "success.log"
 NUM_SPREADERS = 50
 SPREADER_TYPE = "fib_index"  # Options: ["total_reshares", "fib_index"]
 
+# Posts are downloaded again as their statistics change, so keep the latest count
+RESHARE_RULE = "last"
+
 # Set the number of months to calculate the FIB index from
 NUM_MONTHS = 3
 
 ### ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Set Functions ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def extract_data_from_files(data_files, earliest_date_tstamp):
+def extract_data_from_file(file, earliest_date_tstamp, cache_dir=None):
     """
-    Extract necessary data from the list of input files.
+    Aggregate the posts in a single input file into one row per post.
 
     Parameters:
     -----------
-    - data_files (list) : list of full paths to data files to parse
-    - earliest_date_tstamp (timestamp) : the earliest date from which to consider
+    - file (str) : full path to a data file
+    - earliest_date_tstamp (int) : the earliest date from which to consider
         data for calculating FIB indices
+    - cache_dir (str) : directory of Parquet post caches (see
+        scripts/data_prep/build_post_cache.py). If it holds a current cache for
+        `file`, the cache is read instead of the raw JSON. Default = None
 
     Returns:
     -----------
-    - userid_username (dict) : maps user IDs to usernames
-    - userid_postids (dict) : maps user IDs to a set of (str) post IDs
-    - postid_timestamp (dict) : maps post IDs to (str) timestamps
-    - postid_num_reshares (dict) : maps post IDs to number of reshares (int)
-    - postid_url (dict) : maps post IDs to (str) post URLs
+    - aggregate (pandas.DataFrame) : see top_fibers_pkg.aggregates.aggregate_post_records
 
     Exceptions:
     -----------
-    TypeError
+    Exception
     """
-    if not isinstance(data_files, list):
-        raise TypeError("`data_files` must be a list!")
-
-    # Initialize data objects to populate
-    userid_username = dict()
-    userid_postids = defaultdict(set)
-
-    postid_timestamp = dict()
-    postid_url = dict()
-    postid_num_reshares = defaultdict(int)
-
-    logger.info("Begin extracting data.")
     try:
-        for file in data_files:
+        if cache_dir is not None and is_cache_current(file, cache_dir):
+            logger.info(f"\t- Processing (cached): {os.path.basename(file)} ...")
+            records = iter_cached_records(file, cache_dir, earliest_date_tstamp)
+        else:
             logger.info(f"\t- Processing: {os.path.basename(file)} ...")
-            with gzip.open(file, "rb") as f:
-                for line in f:
-                    post_obj = FbIgPost(json.loads(line.decode()))
-                    if not post_obj.is_valid():
-                        continue
-
-                    post_id = post_obj.get_post_ID()
-                    post_url = post_obj.get_link_to_post()
-                    timestamp_str = post_obj.get_post_time(timestamp=True)
-                    timestamp = datetime.datetime.fromtimestamp(
-                        int(timestamp_str)
-                    ).timestamp()
-                    # Skip anything posted before the earliest date
-                    if timestamp < earliest_date_tstamp:
-                        continue
-                    user_id = post_obj.get_user_ID()
-                    username = post_obj.get_user_handle()
-
-                    # This handles certain types of accounts like groups and pages that
-                    # do not have "handles" (or don't provide one) but instead have "names"
-                    if username in [None, ""]:
-                        username = post_obj.get_account_name()
-                    reshare_count = post_obj.get_reshare_count()
-                    if reshare_count is None:
-                        reshare_count = 0
-
-                    postid_num_reshares[post_id] = reshare_count
-                    postid_timestamp[post_id] = timestamp_str
-                    postid_url[post_id] = post_url
-                    userid_username[user_id] = username
-                    userid_postids[user_id].add(post_id)
-
-        num_posts = len(postid_num_reshares.keys())
-        num_users = len(userid_username.keys())
-        logger.info(f"Total Posts Ingested = {num_posts:,}")
-        logger.info(f"Total Number of Users = {num_users:,}")
-
-        return (
-            userid_username,
-            dict(userid_postids),
-            postid_timestamp,
-            dict(postid_num_reshares),
-            postid_url,
-        )
+            # Lines with posts outside the window are skipped before decoding
+            records = iter_post_records(
+                file, "facebook", logger, earliest_tstamp=earliest_date_tstamp
+            )
+
+        # Usernames fall back to account names and missing reshare counts are
+        # set to zero when records are created
+        return aggregate_post_records(records, RESHARE_RULE, earliest_date_tstamp)
 
     except Exception as e:
         logger.exception(f"Problem parsing data file: {file}")
         raise Exception(e)
 
 
-# Execute the program
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-if __name__ == "__main__":
-    if not (os.getcwd() == REPO_ROOT):
-        sys.exit(
-            "ALL SCRIPTS MUST BE RUN FROM THE REPO ROOT!!\n"
-            f"\tCurrent directory: {os.getcwd()}\n"
-            f"\tRepo root        : {REPO_ROOT}\n"
-        )
-    script_name = os.path.basename(__file__)
-    logger = get_logger(LOG_DIR, LOG_FNAME, script_name=script_name, also_print=True)
-    logger.info("-" * 50)
-    logger.info(f"Begin script: {__file__}")
+def _extract_data_from_file_star(file_args):
+    """
+    Unpack arguments for `extract_data_from_file` (used by Pool.imap).
+    """
+    return extract_data_from_file(*file_args)
 
-    # Parse input flags
-    args = parse_cl_args_fib(SCRIPT_PURPOSE, logger)
-    data_dir = args.data_dir
-    output_dir = args.out_dir
-    month_calculated = args.month_calculated
-    num_months = int(args.num_months)
 
-    # Retrieve all paths to data files
-    logger.info("Data will be extracted from here:")
-    logger.info(f"\t- {data_dir}")
-    data_files = sorted(glob.glob(os.path.join(data_dir, MATCHING_STR)))
+def iter_file_aggregates(data_files, earliest_date_tstamps, workers=1, cache_dir=None):
+    """
+    Yield the aggregate of every data file, in the order of `data_files`.
 
-    num_files = len(data_files)
-    logger.info(f"Num. files to process: {num_files}")
+    Parameters:
+    -----------
+    - data_files (list) : list of full paths to data files to parse
+    - earliest_date_tstamps (list) : the earliest date to consider for each file
+    - workers (int) : number of processes used to parse files in parallel. Each
+        file is parsed by one process. Default = 1 (parse files one after another)
+    - cache_dir (str) : directory of Parquet post caches. Files with a current
+        cache are read from it instead of the raw JSON. Default = None
+
+    Yields:
+    -----------
+    - aggregate (pandas.DataFrame) : see `extract_data_from_file`
+
+    Exceptions:
+    -----------
+    TypeError
+    """
+    if not isinstance(data_files, list):
+        raise TypeError("`data_files` must be a list!")
+    if not isinstance(workers, int) or workers < 1:
+        raise TypeError("`workers` must be a positive integer!")
+
+    file_args = [
+        (file, tstamp, cache_dir)
+        for file, tstamp in zip(data_files, earliest_date_tstamps)
+    ]
+    if workers == 1 or len(data_files) <= 1:
+        yield from map(_extract_data_from_file_star, file_args)
+    else:
+        num_procs = min(workers, len(data_files))
+        logger.info(f"Parsing files with {num_procs} processes...")
+        with multiprocessing.Pool(num_procs) as pool:
+            # imap keeps file order, which `PostStore` relies on
+            yield from pool.imap(_extract_data_from_file_star, file_args)
+
+
+def iter_month_aggregates(
+    month_files, earliest_date_tstamps, workers=1, cache_dir=None, aggregate_dir=None
+):
+    """
+    Yield the aggregate of every month of data files, in the order of `month_files`.
 
-    # Get the first date of
-    earliest_date_tstamp = get_earliest_date(
-        months_earlier=num_months, as_timestamp=True, month_calculated=month_calculated
+    Months with a current aggregate saved in `aggregate_dir` are read from it. All
+    other months are parsed from their data files (see `iter_file_aggregates`),
+    and their aggregates are saved to `aggregate_dir` for later windows.
+
+    Parameters:
+    -----------
+    - month_files (dict) : {"YYYY_MM" : [paths to the month's data files]}, with
+        months in chronological order (see top_fibers_pkg.dates.group_files_by_month)
+    - earliest_date_tstamps (dict) : {"YYYY_MM" : the earliest date to consider for
+        the month's data}
+    - workers (int) : number of processes used to parse files in parallel.
+        Default = 1 (parse files one after another)
+    - cache_dir (str) : directory of Parquet post caches. Default = None
+    - aggregate_dir (str) : directory of saved month aggregates. If None, every
+        month is parsed and nothing is saved. Default = None
+
+    Yields:
+    -----------
+    - month (str) : "YYYY_MM"
+    - aggregate (pandas.DataFrame) : the month's aggregate, see
+        top_fibers_pkg.aggregates.combine_aggregates
+    """
+    saved_months = set()
+    if aggregate_dir is not None:
+        for month, files in month_files.items():
+            path = get_month_aggregate_path(aggregate_dir, month, "facebook")
+            if is_month_aggregate_current(
+                path, files, earliest_date_tstamps[month], RESHARE_RULE
+            ):
+                saved_months.add(month)
+
+    # Parse the files of all other months in one (possibly parallel) pass
+    parse_files = []
+    parse_tstamps = []
+    for month, files in month_files.items():
+        if month not in saved_months:
+            parse_files.extend(files)
+            parse_tstamps.extend([earliest_date_tstamps[month]] * len(files))
+    file_aggregates = iter_file_aggregates(
+        parse_files, parse_tstamps, workers, cache_dir
     )
 
-    # Wrangle data and calculate FIB indices
-    (
-        userid_username,
-        userid_postids,
-        postid_timestamp,
-        postid_num_reshares,
-        postid_url,
-    ) = extract_data_from_files(data_files, earliest_date_tstamp)
+    for month, files in month_files.items():
+        if aggregate_dir is not None:
+            path = get_month_aggregate_path(aggregate_dir, month, "facebook")
+        if month in saved_months:
+            logger.info(f"Loading saved aggregate for month: {month} ...")
+            yield month, read_month_aggregate(path)
+            continue
 
-    logger.info("Creating output dataframes...")
-    try:
-        userid_total_reshares = create_userid_total_reshares(
-            postid_num_reshares, userid_postids
+        aggregate = combine_aggregates(
+            [next(file_aggregates) for _ in files], RESHARE_RULE
         )
-        userid_reshare_lists = create_userid_reshare_lists(
-            postid_num_reshares, userid_postids
+        if aggregate_dir is not None:
+            logger.info(f"Saving aggregate for month: {month} ...")
+            save_month_aggregate(
+                aggregate, path, files, earliest_date_tstamps[month], RESHARE_RULE
+            )
+        yield month, aggregate
+
+
+def get_window_data(aggregates, earliest_date_tstamp):
+    """
+    Merge per-file aggregates into the posts of one FIB-index window.
+
+    Parameters:
+    -----------
+    - aggregates (list) : aggregates of the window's files, in file order. The
+        list is emptied as the posts are read (see PostStore)
+    - earliest_date_tstamp (int) : the earliest date from which to consider
+        data for calculating FIB indices
+
+    Returns:
+    -----------
+    - post_store (top_fibers_pkg.post_store.PostStore) : the window's posts
+    """
+    post_store = PostStore(aggregates, RESHARE_RULE, earliest_date_tstamp)
+
+    logger.info(f"Total Posts Ingested = {post_store.num_posts:,}")
+    logger.info(f"Total Number of Users = {post_store.num_users:,}")
+
+    return post_store
+
+
+def extract_data_from_files(
+    data_files, earliest_date_tstamp, workers=1, cache_dir=None, aggregate_dir=None
+):
+    """
+    Extract necessary data from the list of input files.
+
+    Parameters:
+    -----------
+    - data_files (list) : list of full paths to data files to parse
+    - earliest_date_tstamp (int) : the earliest date from which to consider
+        data for calculating FIB indices
+    - workers (int) : number of processes used to parse files in parallel.
+        Default = 1 (parse files one after another)
+    - cache_dir (str) : directory of Parquet post caches. Files with a current
+        cache are read from it instead of the raw JSON. Default = None
+    - aggregate_dir (str) : directory of saved month aggregates. If provided,
+        months with a current aggregate are not parsed again and the aggregates
+        of all other months are saved (see `iter_month_aggregates`).
+        Default = None
+
+    Returns:
+    -----------
+    - post_store (top_fibers_pkg.post_store.PostStore) : see `get_window_data`
+
+    Exceptions:
+    -----------
+    TypeError
+    """
+    logger.info("Begin extracting data.")
+    if aggregate_dir is None:
+        aggregates = list(
+            iter_file_aggregates(
+                data_files, [earliest_date_tstamp] * len(data_files), workers, cache_dir
+            )
         )
-    except Exception as e:
-        logger.exception(f"Problem creating secondary lookup maps!")
-        raise Exception(e)
+    else:
+        month_files = group_files_by_month(data_files)
+        month_tstamps = dict.fromkeys(month_files, earliest_date_tstamp)
+        aggregates = [
+            aggregate
+            for _, aggregate in iter_month_aggregates(
+                month_files, month_tstamps, workers, cache_dir, aggregate_dir
+            )
+        ]
+    return get_window_data(aggregates, earliest_date_tstamp)
+
+
+def save_fib_results(post_store, output_dir, month_calculated):
+    """
+    Calculate FIB indices and top spreader posts for one window and save them.
 
+    Parameters:
+    -----------
+    - post_store (top_fibers_pkg.post_store.PostStore) : see `get_window_data`
+    - output_dir (str) : files are saved in the `month_calculated` subdirectory
+    - month_calculated (str) : the month FIB indices are calculated for ("YYYY_MM")
+
+    Returns:
+    -----------
+    None
+
+    Exceptions:
+    -----------
+    Exception
+    """
+    logger.info("Calculating FIB indices...")
     try:
-        fib_frame = create_fib_frame(
-            userid_reshare_lists, userid_username, userid_total_reshares
-        )
+        post_store.calc_fib_indices()
     except Exception as e:
-        logger.exception(f"Problem creating FIB frame!")
+        logger.exception(f"Problem calculating FIB indices!")
         raise Exception(e)
 
     logger.info("Top spreader information:")
     logger.info(f"\t- Num. spreaders to select   : {NUM_SPREADERS}")
     logger.info(f"\t- Type of spreaders to select: {SPREADER_TYPE}")
     try:
-        top_spreaders = get_top_spreaders(fib_frame, NUM_SPREADERS, SPREADER_TYPE)
-        top_spreader_df = create_top_spreader_df(
-            top_spreaders,
-            userid_postids,
-            postid_num_reshares,
-            postid_timestamp,
-            postid_url,
-        )
+        top_spreaders = post_store.get_top_spreaders(NUM_SPREADERS, SPREADER_TYPE)
+        top_spreader_df = post_store.get_top_spreader_df(top_spreaders)
     except Exception as e:
         logger.exception(f"Problem creating top spreaders df")
         raise Exception(e)
 
-    fib_frame = fib_frame.sort_values("fib_index", ascending=False).reset_index(
-        drop=True
-    )
     top_spreader_df = top_spreader_df.sort_values(
         "num_reshares", ascending=False
     ).reset_index(drop=True)
@@ -256,9 +367,164 @@ if __name__ == "__main__":
     output_rt_fname = os.path.join(
         outdir_with_month, f"{today}__top_spreader_posts_crowdtangle.parquet"
     )
-    fib_frame.to_parquet(output_fib_fname, index=False, engine="pyarrow")
+    # The full per-user table is written in chunks, sorted by FIB index
+    post_store.write_fib_frame(output_fib_fname)
     top_spreader_df.to_parquet(output_rt_fname, index=False, engine="pyarrow")
 
+
+def save_fib_results_for_months(
+    data_files,
+    months,
+    num_months,
+    output_dir,
+    workers=1,
+    cache_dir=None,
+    aggregate_dir=None,
+):
+    """
+    Calculate and save FIB results for every month in `months`, parsing each data
+    file at most once.
+
+    Data files are grouped by month and each month is aggregated in chronological
+    order. A window is calculated as soon as all of its months are aggregated,
+    and a month's aggregate is dropped once no remaining window needs it.
+
+    Parameters:
+    -----------
+    - data_files (list) : chronologically sorted paths to raw data files
+    - months (list) : chronologically sorted months to calculate ("YYYY_MM")
+    - num_months (int) : the number of months in each window
+    - output_dir (str) : results for each month are saved in a subdirectory
+    - workers (int) : number of processes used to parse files in parallel
+    - cache_dir (str) : directory of Parquet post caches. Default = None
+    - aggregate_dir (str) : directory of saved month aggregates (see
+        `iter_month_aggregates`). Default = None
+
+    Returns:
+    -----------
+    None
+    """
+    month_files = group_files_by_month(data_files)
+
+    windows = []
+    for month in months:
+        window_months = [
+            m for m in get_window_months(month, num_months) if m in month_files
+        ]
+        if not window_months:
+            logger.info(f"No data files found for month {month}. Skipping.")
+            continue
+        earliest_date_tstamp = get_earliest_date(
+            months_earlier=num_months, as_timestamp=True, month_calculated=month
+        )
+        windows.append((month, window_months, earliest_date_tstamp))
+
+    # Each month is filtered by the earliest date of the first window that uses it
+    month_tstamps = dict()
+    for _, window_months, earliest_date_tstamp in windows:
+        for m in window_months:
+            month_tstamps.setdefault(m, earliest_date_tstamp)
+    needed_month_files = {
+        m: files for m, files in month_files.items() if m in month_tstamps
+    }
+    num_files = sum(len(files) for files in needed_month_files.values())
+    logger.info(f"Num. files to process: {num_files}")
+
+    month_aggregates = dict()
+    next_window = 0
+    aggregates = iter_month_aggregates(
+        needed_month_files, month_tstamps, workers, cache_dir, aggregate_dir
+    )
+    for data_month, aggregate in aggregates:
+        month_aggregates[data_month] = aggregate
+
+        # Calculate every window whose months have all been aggregated
+        while next_window < len(windows):
+            month, window_months, earliest_date_tstamp = windows[next_window]
+            if not all(m in month_aggregates for m in window_months):
+                break
+            logger.info("-" * 50)
+            logger.info(f"Calculating FIB indices for month: {month}")
+            post_store = get_window_data(
+                [month_aggregates[m] for m in window_months], earliest_date_tstamp
+            )
+            save_fib_results(post_store, output_dir, month)
+            next_window += 1
+
+            # Free the aggregates of months that no remaining window uses
+            still_needed = set(
+                m
+                for _, window_months, _ in windows[next_window:]
+                for m in window_months
+            )
+            for m in list(month_aggregates):
+                if m not in still_needed:
+                    del month_aggregates[m]
+
+
+# Execute the program
+if __name__ == "__main__":
+    if not (os.getcwd() == REPO_ROOT):
+        sys.exit(
+            "ALL SCRIPTS MUST BE RUN FROM THE REPO ROOT!!\n"
+            f"\tCurrent directory: {os.getcwd()}\n"
+            f"\tRepo root        : {REPO_ROOT}\n"
+        )
+    script_name = os.path.basename(__file__)
+    logger = get_logger(LOG_DIR, LOG_FNAME, script_name=script_name, also_print=True)
+    logger.info("-" * 50)
+    logger.info(f"Begin script: {__file__}")
+
+    # Return freed arrays to the system, so windows use about as much memory as
+    # they hold
+    if set_fixed_mmap_threshold():
+        logger.info("Set a fixed mmap threshold for large allocations.")
+
+    # Parse input flags
+    args = parse_cl_args_fib(SCRIPT_PURPOSE, logger)
+    data_dir = args.data_dir
+    output_dir = args.out_dir
+    month_calculated = args.month_calculated
+    num_months = int(args.num_months)
+    workers = int(args.workers)
+    cache_dir = args.cache_dir
+    aggregate_dir = args.aggregate_dir
+
+    # Retrieve all paths to data files
+    logger.info("Data will be extracted from here:")
+    logger.info(f"\t- {data_dir}")
+    data_files = sorted(glob.glob(os.path.join(data_dir, MATCHING_STR)))
+
+    months = get_months_in_range(month_calculated)
+    if len(months) > 1:
+        logger.info(f"Calculating FIB indices for {len(months)} months...")
+        save_fib_results_for_months(
+            data_files,
+            months,
+            num_months,
+            output_dir,
+            workers,
+            cache_dir,
+            aggregate_dir,
+        )
+
+    else:
+        num_files = len(data_files)
+        logger.info(f"Num. files to process: {num_files}")
+
+        # Get the first date of
+        earliest_date_tstamp = get_earliest_date(
+            months_earlier=num_months,
+            as_timestamp=True,
+            month_calculated=month_calculated,
+        )
+
+        # Wrangle data and calculate FIB indices
+        post_store = extract_data_from_files(
+            data_files, earliest_date_tstamp, workers, cache_dir, aggregate_dir
+        )
+        save_fib_results(post_store, output_dir, month_calculated)
+
     with open(os.path.join(REPO_ROOT, SUCCESS_FNAME), "w+") as outfile:
         pass
     logger.info("~~~ Script complete! ~~~")
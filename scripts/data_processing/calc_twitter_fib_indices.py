@@ -10,6 +10,9 @@ Inputs:
     NOTE:
     - Call the calc_twitter_fib_indices.py -h flag to get input/flag details.
     - Input files contain Twitter posts.
+    - Passing a range of months to --month-calculated (e.g., 2022_01..2023_05)
+        calculates every month in one run. In that case, --data-dir must be the
+        directory of raw Twitter files; each file is parsed only once.
 
 Output:
     Two .parquet files containing:
@@ -22,8 +25,15 @@ Output:
         - post_id (str) : a unique Twitter post ID
         - num_reshares (int) : the number of times post_id was reshared
         - timestamp (str) : timestamp when post was sent
+    With --profile-images, a third file:
+    3. {YYYY_mm_dd}__profile_image_links_twitter.parquet: the latest profile image
+        links of the top NUM_PROFILE_IMAGES users by FIB index (read by
+        get_latest_profile_image_links.py), with the following columns:
+        - user_id (str) : a unique Twitter user ID
+        - profile_image_url (str) : the url to user_id's profile image
 
-    NOTE: YYYY_mm_dd will be representative of the machine's current date
+    NOTE: YYYY_mm_dd will be representative of the machine's current date.
+        Files are saved in a subdirectory of --out-dir named after the month calculated.
 
 What is the FIB-index?
     Please see our working paper for details.
@@ -34,21 +44,34 @@ Author: Matthew DeVerna
 ### ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Load Packages ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 import datetime
 import glob
-import gzip
-import json
+import multiprocessing
 import os
 import sys
 
-from collections import defaultdict
-from top_fibers_pkg.data_model import Tweet_v1
-from top_fibers_pkg.dates import get_earliest_date
-from top_fibers_pkg.utils import parse_cl_args_fib, get_logger
-from top_fibers_pkg.fib_helpers import (
-    create_userid_total_reshares,
-    create_userid_reshare_lists,
-    create_fib_frame,
-    get_top_spreaders,
-    create_top_spreader_df,
+from top_fibers_pkg.aggregates import (
+    aggregate_post_records,
+    combine_aggregates,
+    get_month_aggregate_path,
+    is_month_aggregate_current,
+    read_month_aggregate,
+    save_month_aggregate,
+)
+from top_fibers_pkg.post_store import PostStore, TWEET_URL_TEMPLATE
+from top_fibers_pkg.post_cache import (
+    is_cache_current,
+    iter_cached_records,
+    iter_post_records,
+)
+from top_fibers_pkg.dates import (
+    get_earliest_date,
+    get_months_in_range,
+    get_window_months,
+    group_files_by_month,
+)
+from top_fibers_pkg.utils import (
+    parse_cl_args_fib,
+    get_logger,
+    set_fixed_mmap_threshold,
 )
 
 REPO_ROOT = "/home/data/apps/topfibers/repo"
@@ -65,154 +88,458 @@ SUCCESS_FNAME = "success.log"
 NUM_SPREADERS = 50
 SPREADER_TYPE = "fib_index"  # Options: ["total_reshares", "fib_index"]
 
+# NOTE: Number of top users (by FIB index) whose profile image links are saved
+NUM_PROFILE_IMAGES = 1000
+
+# Every retweet embeds the original's retweet count, so keep the largest one seen
+RESHARE_RULE = "max"
+
 
 ### ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Set Functions ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def extract_data_from_files(data_files, earliest_date_tstamp):
+def extract_data_from_file(
+    file, earliest_date_tstamp, cache_dir=None, profile_images=False
+):
     """
-    Load tweet data into three dictionaries that include only the
-    needed information: user IDs/screennames and retweet counts
+    Aggregate the tweets in a single file into one row per tweet.
 
     Parameters:
     -----------
-    - data_files(list) : a list of paths to files
-    - earliest_date_tstamp (timestamp) : the earliest date from which to consider
+    - file (str) : path to a data file
+    - earliest_date_tstamp (int) : the earliest date from which to consider
         data for calculating FIB indices
+    - cache_dir (str) : directory of Parquet post caches (see
+        scripts/data_prep/build_post_cache.py). If it holds a current cache for
+        `file`, the cache is read instead of the raw JSON. Default = None
+    - profile_images (bool) : if True, profile image links are kept.
+        Default = False
 
     Returns:
     -----------
-    - tweetid_max_rts (dict) : {tweet_id_str : max number of retweets in data}
-    - userid_tweetids (dict) : {userid_x : set([tweetids sent by userid_x])}
-    - userid_username (dict) : {userid : username}
-        NOTE: the username will be the last one encountered, which will also be
-        the most recent.
+    - aggregate (pandas.DataFrame) : see top_fibers_pkg.aggregates.aggregate_post_records
 
     Exceptions:
     -----------
-    - Exception, TypeError
+    - Exception
+    """
+    try:
+        if cache_dir is not None and is_cache_current(file, cache_dir):
+            logger.info(f"Loading tweets from cache of file: {file} ...")
+            records = iter_cached_records(
+                file,
+                cache_dir,
+                earliest_date_tstamp,
+                with_urls=False,
+                with_images=profile_images,
+            )
+        else:
+            logger.info(f"Loading tweets from file: {file} ...")
+            # Lines without any tweet inside the window are skipped before decoding
+            records = iter_post_records(
+                file,
+                "twitter",
+                logger,
+                with_urls=False,
+                earliest_tstamp=earliest_date_tstamp,
+                with_images=profile_images,
+            )
+
+        # Records include the base-level tweet followed by its retweeted and quoted
+        # tweets, each with its own post time. Tweet IDs are stored as integers and
+        # URLs are only built for the posts of the top spreaders (see PostStore)
+        return aggregate_post_records(
+            records,
+            RESHARE_RULE,
+            earliest_date_tstamp,
+            int_ids=True,
+            keep_urls=False,
+            keep_images=profile_images,
+        )
+
+    # Raise this error if something weird happens loading the data
+    except Exception as e:
+        logger.exception(f"Problem parsing data file: {file}")
+        raise Exception(e)
+
+
+def _extract_data_from_file_star(file_args):
+    """
+    Unpack arguments for `extract_data_from_file` (used by Pool.imap).
+    """
+    return extract_data_from_file(*file_args)
+
+
+def iter_file_aggregates(
+    data_files, earliest_date_tstamps, workers=1, cache_dir=None, profile_images=False
+):
+    """
+    Yield the aggregate of every data file, in the order of `data_files`.
+
+    Parameters:
+    -----------
+    - data_files (list) : a list of paths to files
+    - earliest_date_tstamps (list) : the earliest date to consider for each file
+    - workers (int) : number of processes used to parse files in parallel. Each
+        file is parsed by one process. Default = 1 (parse files one after another)
+    - cache_dir (str) : directory of Parquet post caches. Files with a current
+        cache are read from it instead of the raw JSON. Default = None
+    - profile_images (bool) : if True, profile image links are kept.
+        Default = False
+
+    Yields:
+    -----------
+    - aggregate (pandas.DataFrame) : see `extract_data_from_file`
+
+    Exceptions:
+    -----------
+    - TypeError
     """
     if not isinstance(data_files, list):
         raise TypeError("`data_files` must be a list!")
     if not all(isinstance(path, str) for path in data_files):
         raise TypeError("All `data_files` must be a string!")
+    if not isinstance(workers, int) or workers < 1:
+        raise TypeError("`workers` must be a positive integer!")
+
+    file_args = [
+        (file, tstamp, cache_dir, profile_images)
+        for file, tstamp in zip(data_files, earliest_date_tstamps)
+    ]
+    if workers == 1 or len(data_files) <= 1:
+        yield from map(_extract_data_from_file_star, file_args)
+    else:
+        num_procs = min(workers, len(data_files))
+        logger.info(f"Parsing files with {num_procs} processes...")
+        with multiprocessing.Pool(num_procs) as pool:
+            # imap keeps file order, which `PostStore` relies on
+            yield from pool.imap(_extract_data_from_file_star, file_args)
+
+
+def iter_month_aggregates(
+    month_files,
+    earliest_date_tstamps,
+    workers=1,
+    cache_dir=None,
+    aggregate_dir=None,
+    profile_images=False,
+):
+    """
+    Yield the aggregate of every month of data files, in the order of `month_files`.
 
-    tweetid_timestamp = dict()
-    tweetid_url = dict()
-    tweetid_max_rts = defaultdict(int)
+    Months with a current aggregate saved in `aggregate_dir` are read from it. All
+    other months are parsed from their data files (see `iter_file_aggregates`),
+    and their aggregates are saved to `aggregate_dir` for later windows.
 
-    userid_tweetids = defaultdict(set)
-    userid_username = dict()
+    Parameters:
+    -----------
+    - month_files (dict) : {"YYYY_MM" : [paths to the month's data files]}, with
+        months in chronological order (see top_fibers_pkg.dates.group_files_by_month)
+    - earliest_date_tstamps (dict) : {"YYYY_MM" : the earliest date to consider for
+        the month's data}
+    - workers (int) : number of processes used to parse files in parallel.
+        Default = 1 (parse files one after another)
+    - cache_dir (str) : directory of Parquet post caches. Default = None
+    - aggregate_dir (str) : directory of saved month aggregates. If None, every
+        month is parsed and nothing is saved. Default = None
+    - profile_images (bool) : if True, profile image links are kept (and saved
+        aggregates without them are not used). Default = False
+
+    Yields:
+    -----------
+    - month (str) : "YYYY_MM"
+    - aggregate (pandas.DataFrame) : the month's aggregate, see
+        top_fibers_pkg.aggregates.combine_aggregates
+    """
+    saved_months = set()
+    if aggregate_dir is not None:
+        for month, files in month_files.items():
+            path = get_month_aggregate_path(aggregate_dir, month, "twitter")
+            if is_month_aggregate_current(
+                path,
+                files,
+                earliest_date_tstamps[month],
+                RESHARE_RULE,
+                keep_images=profile_images,
+            ):
+                saved_months.add(month)
+
+    # Parse the files of all other months in one (possibly parallel) pass
+    parse_files = []
+    parse_tstamps = []
+    for month, files in month_files.items():
+        if month not in saved_months:
+            parse_files.extend(files)
+            parse_tstamps.extend([earliest_date_tstamps[month]] * len(files))
+    file_aggregates = iter_file_aggregates(
+        parse_files, parse_tstamps, workers, cache_dir, profile_images
+    )
 
-    try:
-        for file in data_files:
-            logger.info(f"Loading tweets from file: {file} ...")
-            with gzip.open(file, "rb") as f:
-                for line in f:
-                    tweet = Tweet_v1(json.loads(line.decode()))
-
-                    if not tweet.is_valid():
-                        logger.info("Skipping invalid tweet!!")
-                        logger.info("-" * 50)
-                        logger.info(tweet.post_object)
-                        logger.info("-" * 50)
-                        continue
-
-                    timestamp_str = tweet.get_post_time(timestamp=True)
-                    timestamp = datetime.datetime.fromtimestamp(
-                        int(timestamp_str)
-                    ).timestamp()
-                    # Skip anything posted before the earliest date
-                    if timestamp < earliest_date_tstamp:
-                        continue
-
-                    # Parse the base-level tweet
-                    tweet_id = tweet.get_post_ID()
-                    tweet_url = tweet.get_link_to_post()
-                    user_id = tweet.get_user_ID()
-                    username = tweet.get_user_handle()
-
-                    rt_count = tweet.get_reshare_count()
-                    prev_rt_val = tweetid_max_rts[tweet_id]
-                    if prev_rt_val > rt_count:
-                        rt_count = prev_rt_val
-
-                    # Store the data
-                    tweetid_timestamp[tweet_id] = timestamp_str
-                    tweetid_max_rts[tweet_id] = rt_count
-                    tweetid_url[tweet_id] = tweet_url
-                    userid_tweetids[user_id].add(tweet_id)
-                    userid_username[user_id] = username
-
-                    # Handle retweets
-                    if tweet.is_retweet:
-
-                        # Only keep base retweet objs that occurred on or after the earliest date
-                        timestamp_str = tweet.retweet_object.get_post_time(
-                            timestamp=True
-                        )
-                        timestamp = datetime.datetime.fromtimestamp(
-                            int(timestamp_str)
-                        ).timestamp()
-                        if timestamp >= earliest_date_tstamp:
-                            tweet_id = tweet.retweet_object.get_post_ID()
-                            tweet_url = tweet.retweet_object.get_link_to_post()
-                            user_id = tweet.retweet_object.get_user_ID()
-                            username = tweet.retweet_object.get_user_handle()
-
-                            rt_count = tweet.retweet_object.get_reshare_count()
-                            prev_rt_val = tweetid_max_rts[tweet_id]
-                            if prev_rt_val > rt_count:
-                                rt_count = prev_rt_val
-
-                            # Store the data
-                            tweetid_timestamp[tweet_id] = timestamp_str
-                            tweetid_max_rts[tweet_id] = rt_count
-                            tweetid_url[tweet_id] = tweet_url
-                            userid_tweetids[user_id].add(tweet_id)
-                            userid_username[user_id] = username
-
-                    # Handle quotes
-                    if tweet.is_quote:
-
-                        # Only keep base quote objs that occurred on or after the earliest date
-                        timestamp_str = tweet.quote_object.get_post_time(timestamp=True)
-                        timestamp = datetime.datetime.fromtimestamp(
-                            int(timestamp_str)
-                        ).timestamp()
-                        if timestamp >= earliest_date_tstamp:
-                            tweet_id = tweet.quote_object.get_post_ID()
-                            tweet_url = tweet.quote_object.get_link_to_post()
-                            user_id = tweet.quote_object.get_user_ID()
-                            username = tweet.quote_object.get_user_handle()
-
-                            rt_count = tweet.quote_object.get_reshare_count()
-                            prev_rt_val = tweetid_max_rts[tweet_id]
-                            if prev_rt_val > rt_count:
-                                rt_count = prev_rt_val
-
-                            # Store the data
-                            tweetid_timestamp[tweet_id] = timestamp_str
-                            tweetid_max_rts[tweet_id] = rt_count
-                            tweetid_url[tweet_id] = tweet_url
-                            userid_tweetids[user_id].add(tweet_id)
-                            userid_username[user_id] = username
-
-        num_tweets = len(tweetid_max_rts.keys())
-        num_users = len(userid_tweetids.keys())
-        logger.info(f"Total Tweets Ingested = {num_tweets:,}")
-        logger.info(f"Total Number of Users = {num_users:,}")
-
-        return (
-            dict(tweetid_max_rts),
-            dict(userid_tweetids),
-            userid_username,
-            tweetid_timestamp,
-            tweetid_url,
+    for month, files in month_files.items():
+        if aggregate_dir is not None:
+            path = get_month_aggregate_path(aggregate_dir, month, "twitter")
+        if month in saved_months:
+            logger.info(f"Loading saved aggregate for month: {month} ...")
+            yield month, read_month_aggregate(path)
+            continue
+
+        aggregate = combine_aggregates(
+            [next(file_aggregates) for _ in files], RESHARE_RULE
         )
+        if aggregate_dir is not None:
+            logger.info(f"Saving aggregate for month: {month} ...")
+            save_month_aggregate(
+                aggregate,
+                path,
+                files,
+                earliest_date_tstamps[month],
+                RESHARE_RULE,
+                keep_images=profile_images,
+            )
+        yield month, aggregate
+
+
+def get_window_data(aggregates, earliest_date_tstamp, profile_images=False):
+    """
+    Merge per-file aggregates into the posts of one FIB-index window.
 
-    # Raise this error if something weird happens loading the data
-    except Exception as e:
-        logger.exception(f"Problem parsing data file: {file}")
-        raise Exception(e)
+    Parameters:
+    -----------
+    - aggregates (list) : aggregates of the window's files, in file order. The
+        list is emptied as the posts are read (see PostStore)
+    - earliest_date_tstamp (int) : the earliest date from which to consider
+        data for calculating FIB indices
+    - profile_images (bool) : if True, the latest profile image link of every user
+        is kept. Default = False
+
+    Returns:
+    -----------
+    - post_store (top_fibers_pkg.post_store.PostStore) : the window's posts
+    """
+    post_store = PostStore(
+        aggregates,
+        RESHARE_RULE,
+        earliest_date_tstamp,
+        url_template=TWEET_URL_TEMPLATE,
+        keep_profile_images=profile_images,
+    )
+
+    logger.info(f"Total Tweets Ingested = {post_store.num_posts:,}")
+    logger.info(f"Total Number of Users = {post_store.num_users:,}")
+
+    return post_store
+
+
+def extract_data_from_files(
+    data_files,
+    earliest_date_tstamp,
+    workers=1,
+    cache_dir=None,
+    aggregate_dir=None,
+    profile_images=False,
+):
+    """
+    Load tweet data into dictionaries that include only the needed information:
+    user IDs/screennames, retweet counts, timestamps and URLs
+
+    Parameters:
+    -----------
+    - data_files(list) : a list of paths to files
+    - earliest_date_tstamp (int) : the earliest date from which to consider
+        data for calculating FIB indices
+    - workers (int) : number of processes used to parse files in parallel.
+        Default = 1 (parse files one after another)
+    - cache_dir (str) : directory of Parquet post caches. Files with a current
+        cache are read from it instead of the raw JSON. Default = None
+    - aggregate_dir (str) : directory of saved month aggregates. If provided,
+        months with a current aggregate are not parsed again and the aggregates
+        of all other months are saved (see `iter_month_aggregates`).
+        Default = None
+    - profile_images (bool) : if True, the latest profile image link of every user
+        is kept. Default = False
+
+    Returns:
+    -----------
+    - post_store (top_fibers_pkg.post_store.PostStore) : see `get_window_data`
+
+    Exceptions:
+    -----------
+    - Exception, TypeError
+    """
+    if aggregate_dir is None:
+        aggregates = list(
+            iter_file_aggregates(
+                data_files,
+                [earliest_date_tstamp] * len(data_files),
+                workers,
+                cache_dir,
+                profile_images,
+            )
+        )
+    else:
+        month_files = group_files_by_month(data_files)
+        month_tstamps = dict.fromkeys(month_files, earliest_date_tstamp)
+        aggregates = [
+            aggregate
+            for _, aggregate in iter_month_aggregates(
+                month_files,
+                month_tstamps,
+                workers,
+                cache_dir,
+                aggregate_dir,
+                profile_images,
+            )
+        ]
+    return get_window_data(aggregates, earliest_date_tstamp, profile_images)
+
+
+def save_fib_results(post_store, output_dir, month_calculated):
+    """
+    Calculate FIB indices and top spreader posts for one window and save them.
+
+    Parameters:
+    -----------
+    - post_store (top_fibers_pkg.post_store.PostStore) : see `get_window_data`
+    - output_dir (str) : files are saved in the `month_calculated` subdirectory
+    - month_calculated (str) : the month FIB indices are calculated for ("YYYY_MM")
+
+    Returns:
+    -----------
+    None
+    """
+    logger.info("Calculating FIB indices...")
+    post_store.calc_fib_indices()
+
+    logger.info("Top spreader information:")
+    logger.info(f"\t- Num. spreaders to select   : {NUM_SPREADERS}")
+    logger.info(f"\t- Type of spreaders to select: {SPREADER_TYPE}")
+    top_spreaders = post_store.get_top_spreaders(NUM_SPREADERS, SPREADER_TYPE)
+    top_spreader_df = post_store.get_top_spreader_df(top_spreaders)
+
+    top_spreader_df = top_spreader_df.sort_values(
+        "num_reshares", ascending=False
+    ).reset_index(drop=True)
+
+    # Save files
+    outdir_with_month = os.path.join(output_dir, month_calculated)
+    logger.info("Saving data here:")
+    logger.info(f"\t- {outdir_with_month}")
+    if not os.path.exists(outdir_with_month):
+        os.makedirs(outdir_with_month)
+    today = datetime.datetime.now().strftime("%Y_%m_%d")
+    output_fib_fname = os.path.join(
+        outdir_with_month, f"{today}__fib_indices_twitter.parquet"
+    )
+    output_rt_fname = os.path.join(
+        outdir_with_month, f"{today}__top_spreader_posts_twitter.parquet"
+    )
+    # The full per-user table is written in chunks, sorted by FIB index
+    post_store.write_fib_frame(output_fib_fname)
+    top_spreader_df.to_parquet(output_rt_fname, index=False, engine="pyarrow")
+
+    if post_store.profile_image_urls is not None:
+        output_image_fname = os.path.join(
+            outdir_with_month, f"{today}__profile_image_links_twitter.parquet"
+        )
+        post_store.write_profile_image_links(output_image_fname, NUM_PROFILE_IMAGES)
+
+
+def save_fib_results_for_months(
+    data_files,
+    months,
+    num_months,
+    output_dir,
+    workers=1,
+    cache_dir=None,
+    aggregate_dir=None,
+    profile_images=False,
+):
+    """
+    Calculate and save FIB results for every month in `months`, parsing each data
+    file at most once.
+
+    Data files are grouped by month and each month is aggregated in chronological
+    order. A window is calculated as soon as all of its months are aggregated,
+    and a month's aggregate is dropped once no remaining window needs it.
+
+    Parameters:
+    -----------
+    - data_files (list) : chronologically sorted paths to raw data files
+    - months (list) : chronologically sorted months to calculate ("YYYY_MM")
+    - num_months (int) : the number of months in each window
+    - output_dir (str) : results for each month are saved in a subdirectory
+    - workers (int) : number of processes used to parse files in parallel
+    - cache_dir (str) : directory of Parquet post caches. Default = None
+    - aggregate_dir (str) : directory of saved month aggregates (see
+        `iter_month_aggregates`). Default = None
+    - profile_images (bool) : if True, the profile image links of the top users
+        are saved with each month's results. Default = False
+
+    Returns:
+    -----------
+    None
+    """
+    month_files = group_files_by_month(data_files)
+
+    windows = []
+    for month in months:
+        window_months = [
+            m for m in get_window_months(month, num_months) if m in month_files
+        ]
+        if not window_months:
+            logger.info(f"No data files found for month {month}. Skipping.")
+            continue
+        earliest_date_tstamp = get_earliest_date(
+            months_earlier=num_months, as_timestamp=True, month_calculated=month
+        )
+        windows.append((month, window_months, earliest_date_tstamp))
+
+    # Each month is filtered by the earliest date of the first window that uses it
+    month_tstamps = dict()
+    for _, window_months, earliest_date_tstamp in windows:
+        for m in window_months:
+            month_tstamps.setdefault(m, earliest_date_tstamp)
+    needed_month_files = {
+        m: files for m, files in month_files.items() if m in month_tstamps
+    }
+    num_files = sum(len(files) for files in needed_month_files.values())
+    logger.info(f"Num. files to process: {num_files}")
+
+    month_aggregates = dict()
+    next_window = 0
+    aggregates = iter_month_aggregates(
+        needed_month_files,
+        month_tstamps,
+        workers,
+        cache_dir,
+        aggregate_dir,
+        profile_images,
+    )
+    for data_month, aggregate in aggregates:
+        month_aggregates[data_month] = aggregate
+
+        # Calculate every window whose months have all been aggregated
+        while next_window < len(windows):
+            month, window_months, earliest_date_tstamp = windows[next_window]
+            if not all(m in month_aggregates for m in window_months):
+                break
+            logger.info("-" * 50)
+            logger.info(f"Calculating FIB indices for month: {month}")
+            post_store = get_window_data(
+                [month_aggregates[m] for m in window_months],
+                earliest_date_tstamp,
+                profile_images,
+            )
+            save_fib_results(post_store, output_dir, month)
+            next_window += 1
+
+            # Free the aggregates of months that no remaining window uses
+            still_needed = set(
+                m
+                for _, window_months, _ in windows[next_window:]
+                for m in window_months
+            )
+            for m in list(month_aggregates):
+                if m not in still_needed:
+                    del month_aggregates[m]
 
 
 # Execute the program
@@ -229,12 +556,21 @@ if __name__ == "__main__":
     logger.info("-" * 50)
     logger.info(f"Begin script: {__file__}")
 
+    # Return freed arrays to the system, so windows use about as much memory as
+    # they hold
+    if set_fixed_mmap_threshold():
+        logger.info("Set a fixed mmap threshold for large allocations.")
+
     # Parse input flags
     args = parse_cl_args_fib(SCRIPT_PURPOSE, logger)
     data_dir = args.data_dir
     output_dir = args.out_dir
     month_calculated = args.month_calculated
     num_months = int(args.num_months)
+    workers = int(args.workers)
+    cache_dir = args.cache_dir
+    aggregate_dir = args.aggregate_dir
+    profile_images = args.profile_images
     if output_dir is None:
         output_dir = "."
 
@@ -243,68 +579,41 @@ if __name__ == "__main__":
     logger.info(f"\t--> {data_dir}")
     data_files = sorted(glob.glob(os.path.join(data_dir, MATCHING_STR)))
 
-    num_files = len(data_files)
-    logger.info(f"Num. files to process: {num_files}")
-
-    # Get the first date of
-    earliest_date_tstamp = get_earliest_date(
-        months_earlier=num_months, as_timestamp=True, month_calculated=month_calculated
-    )
-
-    # Wrangle data and calculate FIB indices
-    (
-        postid_num_reshares,
-        userid_postids,
-        userid_username,
-        postid_timestamp,
-        tweetid_url,
-    ) = extract_data_from_files(data_files, earliest_date_tstamp)
-
-    logger.info("Creating output dataframes...")
-    userid_total_reshares = create_userid_total_reshares(
-        postid_num_reshares, userid_postids
-    )
-    userid_reshare_lists = create_userid_reshare_lists(
-        postid_num_reshares, userid_postids
-    )
-    fib_frame = create_fib_frame(
-        userid_reshare_lists, userid_username, userid_total_reshares
-    )
+    months = get_months_in_range(month_calculated)
+    if len(months) > 1:
+        logger.info(f"Calculating FIB indices for {len(months)} months...")
+        save_fib_results_for_months(
+            data_files,
+            months,
+            num_months,
+            output_dir,
+            workers,
+            cache_dir,
+            aggregate_dir,
+            profile_images,
+        )
 
-    logger.info("Top spreader information:")
-    logger.info(f"\t- Num. spreaders to select   : {NUM_SPREADERS}")
-    logger.info(f"\t- Type of spreaders to select: {SPREADER_TYPE}")
-    top_spreaders = get_top_spreaders(fib_frame, NUM_SPREADERS, SPREADER_TYPE)
-    top_spreader_df = create_top_spreader_df(
-        top_spreaders,
-        userid_postids,
-        postid_num_reshares,
-        postid_timestamp,
-        tweetid_url,
-    )
+    else:
+        num_files = len(data_files)
+        logger.info(f"Num. files to process: {num_files}")
 
-    fib_frame = fib_frame.sort_values("fib_index", ascending=False).reset_index(
-        drop=True
-    )
-    top_spreader_df = top_spreader_df.sort_values(
-        "num_reshares", ascending=False
-    ).reset_index(drop=True)
+        # Get the first date of
+        earliest_date_tstamp = get_earliest_date(
+            months_earlier=num_months,
+            as_timestamp=True,
+            month_calculated=month_calculated,
+        )
 
-    # Save files
-    outdir_with_month = os.path.join(output_dir, month_calculated)
-    logger.info("Saving data here:")
-    logger.info(f"\t- {outdir_with_month}")
-    if not os.path.exists(outdir_with_month):
-        os.makedirs(outdir_with_month)
-    today = datetime.datetime.now().strftime("%Y_%m_%d")
-    output_fib_fname = os.path.join(
-        outdir_with_month, f"{today}__fib_indices_twitter.parquet"
-    )
-    output_rt_fname = os.path.join(
-        outdir_with_month, f"{today}__top_spreader_posts_twitter.parquet"
-    )
-    fib_frame.to_parquet(output_fib_fname, index=False, engine="pyarrow")
-    top_spreader_df.to_parquet(output_rt_fname, index=False, engine="pyarrow")
+        # Wrangle data and calculate FIB indices
+        post_store = extract_data_from_files(
+            data_files,
+            earliest_date_tstamp,
+            workers,
+            cache_dir,
+            aggregate_dir,
+            profile_images,
+        )
+        save_fib_results(post_store, output_dir, month_calculated)
 
     with open(os.path.join(REPO_ROOT, SUCCESS_FNAME), "w+") as outfile:
         pass
@@ -9,7 +9,11 @@
 #   NOTES:
 #   - Output files are marked with the date that they are created. If FIB files already exist for that period
 #   this means you will have two versions of the same file and you must manually remove the old files
-#   - If you would like to specify specific months, uncomment the line just before the loop
+#   - All months are calculated in a single run that parses every raw file only once. Months whose
+#   aggregate was already saved by the monthly pipeline (and whose raw files are unchanged) are not parsed at all
+#   - If you would like to specify a different range of months, uncomment the line that sets `months`
+#   - Raw files with a Parquet post cache (see scripts/data_prep/build_post_cache.py) are read
+#   from the cache, so it is much faster to build the caches before running this script
 #
 # Inputs:
 #   platform: either "twitter" or "facebook"
@@ -32,54 +36,33 @@
 if [ "$1" == "twitter" ]; then
   echo "#### Calculating Twitter FIB indices ####"
   script_path=/home/data/apps/topfibers/repo/scripts/data_processing/calc_twitter_fib_indices.py
-  data_path=/home/data/apps/topfibers/repo/data/symbolic_links/twitter
+  data_path=/home/data/apps/topfibers/repo/data/raw/twitter
   out_path=/home/data/apps/topfibers/repo/data/derived/fib_results/twitter
+  cache_path=/home/data/apps/topfibers/repo/data/derived/post_cache/twitter
+  aggregate_path=/home/data/apps/topfibers/repo/data/derived/post_aggregates/twitter
 elif [ "$1" == "facebook" ]; then
   echo "#### Calculating Facebook FIB indices ####"
   script_path=/home/data/apps/topfibers/repo/scripts/data_processing/calc_crowdtangle_fib_indices.py
-  data_path=/home/data/apps/topfibers/repo/data/symbolic_links/facebook
+  data_path=/home/data/apps/topfibers/repo/data/raw/facebook
   out_path=/home/data/apps/topfibers/repo/data/derived/fib_results/facebook
+  cache_path=/home/data/apps/topfibers/repo/data/derived/post_cache/facebook
+  aggregate_path=/home/data/apps/topfibers/repo/data/derived/post_aggregates/facebook
 else
   echo "Invalid input. Please enter either 'twitter' or 'facebook'."
   exit 1
 fi
 
-# Get the current year and month
-current_year=$(date +%Y)
-current_month=$(date +%m)
-
-# Define the start year and month
-start_year=2022
-start_month=01
-
-# Create an empty array to hold the months
-months=()
-
-# Loop over the years and months and append to the array
-for year in $(seq $start_year $current_year); do
-    for month in $(seq -f "%02g" $start_month 12); do
-
-        # Append the year-month string to the array
-        months+=("${year}_${month}")
-
-        # If we've reached the current month, exit the loop
-        if [[ $year -eq $current_year && $month -eq $current_month ]]; then
-            break 2
-        fi
-    done
-    # Reset the start month to January after the first year
-    start_month=01
-done
+# Calculate every month from 2022_01 through the current month
+current_month=$(date +%Y_%m)
+months="2022_01..${current_month}"
 
 # Ensures we run the script with the correct python environment for this project
 env_python=/home/data/apps/topfibers/repo/environments/env_code/bin/python
 n_months=3
 
 ### UNCOMMENT THE BELOW IF YOU WOULD LIKE TO SPECIFY MONTHS  ###
-# months=("2022_01" "2022_05" "2023_01")
+# months="2022_05..2023_01"
 
-for month in "${months[@]}"; do
-    $env_python $script_path -d $data_path/$month -o $out_path -m $month -n $n_months
-done
+$env_python $script_path -d $data_path -o $out_path -m $months -n $n_months -c $cache_path -a $aggregate_path
 
 echo ~~~ Script complete. ~~~
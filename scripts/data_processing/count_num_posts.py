@@ -19,10 +19,10 @@ Author: Matthew DeVerna
 import argparse
 import datetime
 import glob
-import gzip
 import os
 import sys
 
+from top_fibers_pkg.gzip_io import iter_gzip_lines
 from top_fibers_pkg.utils import get_logger
 
 import pandas as pd
@@ -141,8 +141,8 @@ if __name__ == "__main__":
             logger.info("Skipping file because it has already been counted.")
             continue
 
-        with gzip.open(file, "rb") as f:
-            data.append({"file_name": file, "num_posts": sum(1 for post in f)})
+        num_posts = sum(1 for post in iter_gzip_lines(file))
+        data.append({"file_name": file, "num_posts": num_posts})
 
     logger.info("Creating counts dataframe...")
     today = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -9,6 +9,14 @@ Purpose:
         FIBers that have been found in the latest month are updated, however, to look for
         and update ALL top FIBers, make sure to pass the --all-users flag to the script.
 
+        With --profile-index, links are looked up in a persistent index of every
+        user's latest profile image link (see top_fibers_pkg.profile_index) instead.
+        Only raw files that are new since the last run are read to update it.
+
+        With --fib-results, links are first read from the profile image link files
+        saved with the FIB results (see calc_twitter_fib_indices.py --profile-images),
+        newest month first. Only FIBers not found there are looked up as above.
+
 Inputs:
     - Those loaded by top_fibers_pkg.utils.parse_cl_args_fib
 
@@ -39,8 +47,6 @@ Author: Matthew DeVerna
 import argparse
 import datetime
 import glob
-import gzip
-import json
 import os
 import sys
 
@@ -48,7 +54,19 @@ import pandas as pd
 
 from dateutil.relativedelta import relativedelta
 from top_fibers_pkg.utils import get_logger
-from top_fibers_pkg.data_model import Tweet_v1
+from top_fibers_pkg.block_index import (
+    is_block_index_current,
+    iter_block_lines,
+    read_block_index,
+    select_blocks,
+)
+from top_fibers_pkg.data_model import Tweet_v1, iter_post_wrappers
+from top_fibers_pkg.decoding import get_post_decoder
+from top_fibers_pkg.gzip_io import iter_gzip_lines
+from top_fibers_pkg.profile_index import (
+    lookup_profile_image_links,
+    update_profile_index,
+)
 
 
 SCRIPT_PURPOSE = "Update the profile image links for Top FIBers."
@@ -59,10 +77,14 @@ DATA_DIR = "/home/data/apps/topfibers/repo/data/raw/twitter"
 DATA_FILE_SUFFIX = "__tweets_w_links.jsonl.gzip"
 FIBER_DATA_DIR = "/home/data/apps/topfibers/repo/data/derived/fib_results/twitter/"
 FIBER_FILE_SUFFIX = "__fib_indices_twitter.parquet"
+FIBER_IMAGE_FILE_SUFFIX = "__profile_image_links_twitter.parquet"
 OUTPUT_FILE = "/home/data/apps/topfibers/repo/data/derived/twitter_profile_links/top_fiber_profile_image_links.parquet"
 SUCCESS_FNAME = "success.log"
 NUM_FIBERS = 50
 
+# Only decodes the tweet fields that Tweet_v1 reads
+decode_post = get_post_decoder("twitter")
+
 
 def parse_cl_args(script_purpose="", logger=None):
     """
@@ -97,6 +119,41 @@ def parse_cl_args(script_purpose="", logger=None):
         help=msg,
         action="store_true",
     )
+    msg = (
+        "Full path to the directory holding the block indexes of the raw files "
+        "(see scripts/data_prep/build_block_index.py). If included, only the parts "
+        "of indexed files that may hold a top FIBer's tweets are read."
+    )
+    parser.add_argument(
+        "-i",
+        "--index-dir",
+        metavar="Index dir",
+        help=msg,
+        default=None,
+    )
+    msg = (
+        "Full path to the profile index file (created if missing). If included, "
+        "the index is updated with any new raw files and links are looked up in "
+        "it instead of scanning raw files. Links are then found for all FIBers "
+        "who ever tweeted in our data."
+    )
+    parser.add_argument(
+        "-p",
+        "--profile-index",
+        metavar="Profile index",
+        help=msg,
+        default=None,
+    )
+    msg = (
+        "If included, links are first read from the profile image link files saved "
+        "with the FIB results (see calc_twitter_fib_indices.py --profile-images)"
+    )
+    parser.add_argument(
+        "-f",
+        "--fib-results",
+        help=msg,
+        action="store_true",
+    )
 
     # Read parsed arguments from the command line into "args"
     args = parser.parse_args()
@@ -183,7 +240,65 @@ def load_top_fiber_uids(files):
     return fiber_uids
 
 
-def get_profile_image_links(fiber_uids, files):
+def get_FIBer_image_files(fiber_files):
+    """
+    Return the full paths to the profile image link files saved along with the top
+    FIBers files, newest first.
+
+    Parameters
+    -----------
+    - fiber_files (list) : list of full paths to top FIBers files
+
+    Returns
+    -----------
+    - files (list): list containing full path strings to profile image link files
+    """
+    files = []
+    for file in fiber_files:
+        image_file = file[: -len(FIBER_FILE_SUFFIX)] + FIBER_IMAGE_FILE_SUFFIX
+        if os.path.exists(image_file):
+            files.append(image_file)
+
+    # Results are saved in a subdirectory named after their month (YYYY_MM)
+    return sorted(
+        files, key=lambda f: (os.path.basename(os.path.dirname(f)), f), reverse=True
+    )
+
+
+def load_FIBer_image_links(fiber_uids, files):
+    """
+    Collect profile image links for the provided user_ids from the profile image
+    link files saved with the FIB results. Every user's link is taken from the
+    first file (i.e., the newest) that has one, and that user is removed from
+    `fiber_uids`.
+
+    Parameters
+    -----------
+    - fiber_uids (set) : set of user IDs for the top FIBers
+    - files (list) : profile image link files, newest first (see
+        `get_FIBer_image_files`)
+
+    Returns
+    -----------
+    - image_link_df (pandas.DataFrame): a dataframe containing the following
+        columns:
+            - user_id (str) : the top FIBer user ID,
+            - profile_image_url : the url to `user_id`'s profile image
+    """
+    found_dfs = []
+    for file in files:
+        if len(fiber_uids) == 0:
+            break
+        df = pd.read_parquet(file, engine="pyarrow")
+        found = df[df.user_id.isin(fiber_uids)]
+        found_dfs.append(found)
+        fiber_uids.difference_update(found.user_id)
+    if not found_dfs:
+        return pd.DataFrame(columns=["user_id", "profile_image_url"])
+    return pd.concat(found_dfs, ignore_index=True)
+
+
+def get_profile_image_links(fiber_uids, files, index_dir=None):
     """
     Collect profile image links for all provided user_ids.
 
@@ -191,6 +306,9 @@ def get_profile_image_links(fiber_uids, files):
     -----------
     - fiber_uids (set) : set of user IDs for the top FIBers
     - files (list) : the files to iterate through to find profile image links
+    - index_dir (str) : directory holding the block indexes of `files`. Files with
+        a current index are only read where a remaining FIBer may have tweeted.
+        Default = None (read every file in full)
 
     Returns
     -----------
@@ -205,25 +323,29 @@ def get_profile_image_links(fiber_uids, files):
     remaining_uids = True
     for file in files:
         logger.info(f"Loading tweets from file: {file} ...")
-        with gzip.open(file, "rb") as f:
-            for line in f:
-                tweet = Tweet_v1(json.loads(line.decode()))
-
-                uid = tweet.get_user_ID()
-                if uid in fiber_uids:
-                    profile_image_url = tweet.get_user_profile_image_url()
-                    uid_imageurl_records.append(
-                        {"user_id": uid, "profile_image_url": profile_image_url}
-                    )
-                    fiber_uids.remove(uid)
-                    urls_collected += 1
-                    logger.info(
-                        f"\t- Collected: {urls_collected}/{num_urls_to_collect}"
-                    )
-
-                    if len(fiber_uids) == 0:
-                        remaining_uids = False
-                        break
+        if index_dir is not None and is_block_index_current(file, index_dir):
+            index = read_block_index(file, index_dir)
+            blocks = select_blocks(index, user_ids=fiber_uids)
+            logger.info(f"\t- Reading {len(blocks)}/{len(index)} indexed blocks")
+            lines = iter_block_lines(file, blocks)
+        else:
+            lines = iter_gzip_lines(file)
+        tweets = iter_post_wrappers(map(decode_post, lines), Tweet_v1, flyweight=True)
+        for tweet in tweets:
+
+            uid = tweet.get_user_ID()
+            if uid in fiber_uids:
+                profile_image_url = tweet.get_user_profile_image_url()
+                uid_imageurl_records.append(
+                    {"user_id": uid, "profile_image_url": profile_image_url}
+                )
+                fiber_uids.remove(uid)
+                urls_collected += 1
+                logger.info(f"\t- Collected: {urls_collected}/{num_urls_to_collect}")
+
+                if len(fiber_uids) == 0:
+                    remaining_uids = False
+                    break
 
         if not remaining_uids:
             logger.info("All profile image links have been collected!")
@@ -248,10 +370,6 @@ if __name__ == "__main__":
     args = parse_cl_args(SCRIPT_PURPOSE, logger)
     update_all = args.all_users
 
-    logger.info("Building a list of raw files to load...")
-    raw_files = get_raw_files(update_all)
-    logger.info("\t- Success.")
-
     logger.info("Building a list of top FIBer files to load...")
     fiber_files = get_FIBer_files(update_all)
     logger.info("\t- Success.")
@@ -260,9 +378,45 @@ if __name__ == "__main__":
     fiber_uid_set = load_top_fiber_uids(fiber_files)
     logger.info("\t- Success.")
 
-    logger.info(f"Retrieving profile image links for {len(fiber_uid_set)} FIBers...")
-    image_link_df = get_profile_image_links(fiber_uid_set, raw_files)
-    logger.info("\t- Success.")
+    image_link_dfs = []
+    if args.fib_results:
+        num_fibers = len(fiber_uid_set)
+        logger.info("Loading profile image links saved with the FIB results...")
+        # Found FIBers are removed from `fiber_uid_set`
+        image_link_dfs.append(
+            load_FIBer_image_links(fiber_uid_set, get_FIBer_image_files(fiber_files))
+        )
+        logger.info(f"\t- Found: {num_fibers - len(fiber_uid_set)}/{num_fibers}")
+
+    if args.fib_results and len(fiber_uid_set) == 0:
+        logger.info("All profile image links have been collected!")
+
+    elif args.profile_index is not None:
+        logger.info(f"Updating the profile index: {args.profile_index}")
+        # Only files that are not in the index yet are read
+        index = update_profile_index(
+            args.profile_index, get_raw_files(update_all=True), logger
+        )
+        logger.info(
+            f"Looking up profile image links for {len(fiber_uid_set)} FIBers..."
+        )
+        image_link_dfs.append(lookup_profile_image_links(index, fiber_uid_set))
+        logger.info("\t- Success.")
+
+    else:
+        logger.info("Building a list of raw files to load...")
+        raw_files = get_raw_files(update_all)
+        logger.info("\t- Success.")
+
+        logger.info(
+            f"Retrieving profile image links for {len(fiber_uid_set)} FIBers..."
+        )
+        image_link_dfs.append(
+            get_profile_image_links(fiber_uid_set, raw_files, args.index_dir)
+        )
+        logger.info("\t- Success.")
+
+    image_link_df = pd.concat(image_link_dfs, ignore_index=True)
 
     logger.info(f"Saving profile image link file here:")
     logger.info(f"\t- {OUTPUT_FILE}")
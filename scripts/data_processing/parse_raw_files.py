@@ -1,58 +1,134 @@
 """
 Purpose:
-    On 2023-4-21 we decided to only use the Iffy News list of low-credibility domains
-    that were marked as "low" or "very-low" in the MBFC "factual" category.
-    This script is for parsing out tweets that had matched the "mixed" category domains.
-
-    IMPORTANT NOTE:
-    - THIS SCRIPT WAS NOT UTILIZED IN THE PIPELINE FOR THE PURPOSE DESCRIBED ABOVE.
-      WE KEEP IT HERE ONLY IN CASE IT MIGHT BE USEFUL IN THE FUTURE. INSTEAD OF USING
-      THE (potentially error prone) APPROACH OF PARSING THE POSTS, DATA WAS RE-DOWNLOADED
-      FOR CT AND REPULLED FOR TWITTER. AS A RESULT, THIS SCRIPTS IS **NOT COMPLETE** AND
-      STILL NEEDS TO BE UPDATED TO PARSE POSTS FOR CT. SHOULD YOU BE USING IT, PLEASE MAKE
-      SURE TO TEST IT PROPERLY BEFORE USE.
+    Re-filter raw data files against the latest Iffy News list of domains, e.g.
+    after a change to the list. On 2023-4-21 we decided to only use the Iffy News
+    domains marked as "low" or "very-low" in the MBFC "factual" category, which
+    meant dropping the posts that had only matched "mixed" category domains.
+
+    A post is kept if at least one of its links (see data_model.Tweet_v1.get_links
+    and data_model.FbIgPost.get_links) matches a domain of the list or one of its
+    subdomains (see top_fibers_pkg.domains). For retweets, the links of the
+    retweeted tweet are used, as they are the same for the original tweet and the
+    retweet. The links of quoted tweets are not used, as they can differ.
+
+    NOTE:
+        - Files are re-filtered in parallel, one file per process (--workers).
+        - Kept lines are written as they were read, without being encoded again.
+        - Each output file is written to a temporary file that is then moved into
+            place, so an interrupted run never leaves a partial file behind (and
+            --in-dir and --out-dir may be the same directory).
 
 Inputs:
-    None. See below for hardcoded paths/files.
+    -p / --platform: The platform of the raw posts
+    -d / --domains-dir: Directory of Iffy list files; the latest is used
+    -i / --in-dir: Directory of the raw files to re-filter
+    -o / --out-dir: Directory where the re-filtered files are saved
+    -w / --workers: Number of files re-filtered in parallel
 
 Outputs:
-    New parsed files will be saved in the specified directory
+    One re-filtered (BGZF) file per raw file, saved in `out_dir` with the same
+    name (without "_OLD"). The number of posts kept and the throughput of every
+    file are logged.
 """
 import argparse
 import glob
-import gzip
-import json
+import multiprocessing
 import os
+import time
 
-import pandas as pd
-
-from urllib.parse import urlparse
-
-from top_fibers_pkg.utils import load_lines
+from top_fibers_pkg.utils import get_logger, load_lines
 from top_fibers_pkg.data_model import Tweet_v1, FbIgPost
+from top_fibers_pkg.domains import DomainMatcher, get_latest_domains_file
+from top_fibers_pkg.decoding import loads
+from top_fibers_pkg.gzip_io import BgzfWriter, iter_gzip_lines
 
-
+SCRIPT_PURPOSE = "Re-filter raw data files against the latest Iffy News list."
 DOMAINS_DIR = "/home/data/apps/topfibers/repo/data/iffy_files"
 RAW_DIR_OLD = "/home/data/apps/topfibers/repo/data/raw_old"
 RAW_DIR_NEW = "/home/data/apps/topfibers/repo/data/raw"
+LOG_DIR = "./logs"
+LOG_FNAME = "parse_raw_files.log"
+MATCHING_STR = "*.gzip"
 
+# Kept lines are written to the output in batches of this many bytes
+WRITE_BATCH_BYTES = 4 * 1024 * 1024
 
-def get_platform():
+# Set in every worker process by `init_worker`
+matcher = None
+
+
+def parse_cl_args(script_purpose="", logger=None):
     """
-    Load social media platform data to parse from command line argument.
+    Read command line arguments.
+
+    Parameters:
+    --------------
+    - script_purpose (str) : Purpose of the script being utilized. When printing
+        script help message via `python script.py -h`, this will represent the
+        script's description. Default = "" (an empty string)
+    - logger : a logging object
+
+    Returns
+    --------------
+    None
+
+    Exceptions
+    --------------
+    None
     """
-    parser = argparse.ArgumentParser(
-        description="Parse the tweets/FB posts to match less Iffy News domains."
-    )
+    logger.info("Parsing command line arguments...")
+
+    # Initiate the parser
+    parser = argparse.ArgumentParser(description=script_purpose)
+
     parser.add_argument(
         "-p",
         "--platform",
+        metavar="Platform",
+        help="The platform of the raw posts. Options: [twitter, facebook]",
         choices=["twitter", "facebook"],
-        help="Which social media platform to load data from. Options: ['twitter', 'facebook']",
+        required=True,
+    )
+    parser.add_argument(
+        "-d",
+        "--domains-dir",
+        metavar="Domains dir",
+        help=f"Directory of Iffy list files; the latest is used. Default: {DOMAINS_DIR}",
+        default=DOMAINS_DIR,
+    )
+    help_msg = (
+        f"Directory of the raw files to re-filter. Default: {RAW_DIR_OLD}/<platform>"
+    )
+    parser.add_argument(
+        "-i",
+        "--in-dir",
+        metavar="Input dir",
+        help=help_msg,
+        default=None,
+    )
+    help_msg = (
+        "Directory where the re-filtered files are saved. "
+        f"Default: {RAW_DIR_NEW}/<platform>"
+    )
+    parser.add_argument(
+        "-o",
+        "--out-dir",
+        metavar="Output dir",
+        help=help_msg,
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        metavar="Number of workers",
+        help="The number of files re-filtered in parallel (default: 4)",
+        default=4,
     )
 
+    # Read parsed arguments from the command line into "args"
     args = parser.parse_args()
-    return args.platform
+
+    return args
 
 
 def load_domains(domains_dir):
@@ -68,8 +144,7 @@ def load_domains(domains_dir):
     ------------
     - domains (list) : list of domains
     """
-    all_domains_files = sorted(glob.glob(os.path.join(domains_dir, "*iffy_list.txt")))
-    latest_domains_filepath = all_domains_files[-1]
+    latest_domains_filepath = get_latest_domains_file(domains_dir)
 
     # Load domains to match in below query and clean up
     domains = load_lines(latest_domains_filepath)
@@ -80,104 +155,183 @@ def load_domains(domains_dir):
     return domains
 
 
-def get_base_domain(url):
+def init_worker(domains):
+    """
+    Build the domain matcher of a worker process once, rather than for every file.
     """
-    Extract the base domain from a full URL
+    global matcher
+    matcher = DomainMatcher(domains)
+
+
+def get_post_links(post_object, platform):
+    """
+    Return the links of a post that are matched against the domains, or None if
+    the post is not valid.
+    """
+    if platform == "twitter":
+        tweet = Tweet_v1(post_object)
+        if not tweet.is_valid():
+            return None
+        # We check the retweeted status object because its links are the same for
+        # the original tweet and the retweet. We don't check the quoted status
+        # object because it can contain different links.
+        if tweet.is_retweet:
+            tweet = tweet.retweet_object
+        return tweet.get_links()
+
+    post = FbIgPost(post_object)
+    if not post.is_valid():
+        return None
+    return post.get_links()
+
+
+def refilter_file(in_path, out_path, platform):
+    """
+    Write the lines of `in_path` whose post matches the domains (see the module
+    docstring) to `out_path`, as they were read.
 
     Parameters
     ------------
-    - url (str) : full URL
+    - in_path (str) : full path to a raw data file
+    - out_path (str) : full path to the re-filtered file
+    - platform (str) : one of ["twitter", "facebook"]
 
     Returns
     ------------
-    - base_domain (str) : base domain
+    - stats (dict) : the file's number of lines (`num_lines`), posts kept
+        (`num_kept`) and invalid posts (`num_invalid`), its decompressed size
+        (`num_bytes`) and the seconds taken (`seconds`)
     """
-    parsed_url = urlparse(url)
-    domain_parts = parsed_url.netloc.split(".")
-    base_domain = ".".join(domain_parts[-2:])
-    return base_domain
+    start = time.perf_counter()
+    num_lines = num_kept = num_invalid = num_bytes = 0
+    kept_lines = []
+    kept_bytes = 0
+
+    tmp_path = f"{out_path}.tmp"
+    # Written as BGZF so the blocks can be decompressed in parallel later
+    with BgzfWriter(tmp_path) as f:
+        # Files are already read in parallel, so each one is read by one thread
+        for line in iter_gzip_lines(in_path, threads=1):
+            num_lines += 1
+            num_bytes += len(line)
+            if not line.strip():
+                continue
+            links = get_post_links(loads(line), platform)
+            if links is None:
+                num_invalid += 1
+                continue
+            if not any(matcher.match_url(link) for link in links):
+                continue
+
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            kept_lines.append(line)
+            kept_bytes += len(line)
+            num_kept += 1
+            if kept_bytes >= WRITE_BATCH_BYTES:
+                f.write(b"".join(kept_lines))
+                kept_lines = []
+                kept_bytes = 0
+        f.write(b"".join(kept_lines))
+    os.replace(tmp_path, out_path)
+
+    return {
+        "num_lines": num_lines,
+        "num_kept": num_kept,
+        "num_invalid": num_invalid,
+        "num_bytes": num_bytes,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def _refilter_file_star(file_args):
+    """
+    Unpack arguments for `refilter_file` (used by Pool.imap_unordered) and return
+    them along with the file's stats.
+    """
+    return file_args, refilter_file(*file_args)
 
 
-def get_tweets(file_path, domains_set):
+def iter_refiltered_files(file_args, domains, workers=1):
     """
-    Extract tweets from `file_path` that contain the domains we want.
+    Re-filter files and yield their arguments and stats as each one finishes.
 
     Parameters
     ------------
-    - file_path (str) : path to the raw tweet file
-    - domains_set (set) : set of domains
+    - file_args (list) : (in_path, out_path, platform) of every file
+    - domains (list) : the domains that posts must match
+    - workers (int) : number of files re-filtered in parallel. Default = 1
 
     Yields
     ------------
-    - tweet_dict (dict) : tweet dictionary
+    - file_args (tuple) : (in_path, out_path, platform)
+    - stats (dict) : see `refilter_file`
     """
-    with gzip.open(file_path, "rb") as f:
-        for line in f:
-            tweet_dict = json.loads(line.decode())
-            tweet = Tweet_v1(tweet_dict)
-
-            if not tweet.is_valid():
-                print("Skipping invalid tweet!!")
-                print("-" * 50)
-                print(tweet.post_object)
-                print("-" * 50)
-                continue
-
-            # We want to check the retweeted status object if it has domains bc they are
-            # the same for the original tweet and the retweet. We don't want to check
-            # the quoted status object because they can contain different domains.
-            if tweet.is_retweet:
-                tweet = tweet.retweet_object
-
-            # Get list of all tweet URL objects
-            urls = tweet.get_value(["entities", "urls"])
-
-            # Collect a set of domains
-            base_domains = set()
-            for u in urls:
-                url = u.get("expanded_url", u.get("url"))
-                base_domain = get_base_domain(url)
-                base_domains.add(base_domain)
-
-            if base_domains.issubset(domains_set):
-                yield tweet_dict
+    if workers == 1 or len(file_args) <= 1:
+        init_worker(domains)
+        yield from map(_refilter_file_star, file_args)
+    else:
+        num_procs = min(workers, len(file_args))
+        logger.info(f"Re-filtering files with {num_procs} processes...")
+        with multiprocessing.Pool(
+            num_procs, initializer=init_worker, initargs=(domains,)
+        ) as pool:
+            yield from pool.imap_unordered(_refilter_file_star, file_args)
 
 
 if __name__ == "__main__":
-    # Get platform from command-line flag
-    platform = get_platform()
+    script_name = os.path.basename(__file__)
+    logger = get_logger(LOG_DIR, LOG_FNAME, script_name=script_name, also_print=True)
+    logger.info("-" * 50)
+    logger.info(f"Begin script: {__file__}")
+
+    args = parse_cl_args(SCRIPT_PURPOSE, logger)
+    platform = args.platform
+    in_dir = args.in_dir or os.path.join(RAW_DIR_OLD, platform)
+    out_dir = args.out_dir or os.path.join(RAW_DIR_NEW, platform)
+    workers = int(args.workers)
 
     # Load domains list
-    domains_set = set(load_domains(DOMAINS_DIR))
+    domains = load_domains(args.domains_dir)
+    logger.info(f"Domains file: {get_latest_domains_file(args.domains_dir)}")
+    logger.info(f"Number of domains: {len(domains):,}")
 
     # Get a list of the full paths to each file that we want to parse through
-    files_to_clean = glob.glob(
-        os.path.join(os.path.join(RAW_DIR_OLD, platform), "*.gzip")
-    )
+    files_to_clean = sorted(glob.glob(os.path.join(in_dir, MATCHING_STR)))
+    logger.info(f"Re-filtering {platform} files found here: {in_dir}")
+    logger.info(f"Number of files: {len(files_to_clean)}")
+    os.makedirs(out_dir, exist_ok=True)
 
-    for file in sorted(files_to_clean):
+    file_args = []
+    for file in files_to_clean:
         # Create the new output file path
         basename = os.path.basename(file)
-        output_path = os.path.join(RAW_DIR_NEW, platform, basename.replace("_OLD", ""))
-
-        with gzip.open(output_path, "wb") as f:
-            if platform == "twitter":
-                for tweet_dict in get_tweets(file, domains_set):
-                    json_str = json.dumps(tweet_dict)
-                    f.write(json_str.encode("utf-8"))
-                    f.write(b"\n")
-                print(f"\t- Completed: {basename}")
-
-            elif platform == "facebook":
-                if "fb_posts" not in file:
-                    raise TypeError("")
-                print("Facebook not developed yet. Passing and will do nothing.")
-                pass
-
-            # This shouldn't happen
-            else:
-                raise TypeError(
-                    f"Platform must be 'twitter' or 'facebook'. Currently: {platform}"
-                )
-
-    print("-- Script complete. ---")
+        output_path = os.path.join(out_dir, basename.replace("_OLD", ""))
+        file_args.append((file, output_path, platform))
+
+    start = time.perf_counter()
+    total_lines = total_kept = total_bytes = 0
+    try:
+        for fnum, ((file, output_path, _), stats) in enumerate(
+            iter_refiltered_files(file_args, domains, workers), start=1
+        ):
+            total_lines += stats["num_lines"]
+            total_kept += stats["num_kept"]
+            total_bytes += stats["num_bytes"]
+            mb_per_second = stats["num_bytes"] / 1e6 / max(stats["seconds"], 1e-9)
+            logger.info(
+                f"\t- Completed ({fnum}/{len(file_args)}): {os.path.basename(file)}"
+                f" | kept {stats['num_kept']:,} of {stats['num_lines']:,} posts"
+                f" ({stats['num_invalid']:,} invalid)"
+                f" | {stats['seconds']:.1f} seconds, {mb_per_second:.1f} MB/s"
+            )
+    except Exception as e:
+        logger.exception("Problem re-filtering data files")
+        raise Exception(e)
+
+    seconds = time.perf_counter() - start
+    logger.info(
+        f"Kept {total_kept:,} of {total_lines:,} posts in {seconds:.1f} seconds "
+        f"({total_bytes / 1e6 / max(seconds, 1e-9):.1f} MB/s)"
+    )
+    logger.info("~~~ Script complete! ~~~")
@@ -33,6 +33,12 @@ TWITTER_SYM_DIR="/home/data/apps/topfibers/repo/data/symbolic_links/twitter"
 FIB_OUT_DIR_TWITTER="/home/data/apps/topfibers/repo/data/derived/fib_results/twitter"
 FIB_OUT_DIR_FACBOOK="/home/data/apps/topfibers/repo/data/derived/fib_results/facebook"
 POST_COUNTS_DIR="/home/data/apps/topfibers/repo/data/derived/post_counts"
+TWITTER_CACHE_DIR="/home/data/apps/topfibers/repo/data/derived/post_cache/twitter"
+FACEBOOK_CACHE_DIR="/home/data/apps/topfibers/repo/data/derived/post_cache/facebook"
+TWITTER_AGGREGATE_DIR="/home/data/apps/topfibers/repo/data/derived/post_aggregates/twitter"
+FACEBOOK_AGGREGATE_DIR="/home/data/apps/topfibers/repo/data/derived/post_aggregates/facebook"
+TWITTER_INDEX_DIR="/home/data/apps/topfibers/repo/data/derived/block_index/twitter"
+TWITTER_PROFILE_INDEX="/home/data/apps/topfibers/repo/data/derived/twitter_profile_links/profile_index.parquet"
 
 # Logs, dates, and files
 LOG_DIR="/home/data/apps/topfibers/repo/logs"
@@ -114,6 +120,47 @@ fi
 # Remove after checking for successful completion
 rm success.log
 
+### Convert new raw files into Parquet post caches (existing caches are skipped)
+# Log file saved here: ./logs/build_post_cache.log
+# -------------------------------------
+# TWITTER
+echo "$(date -Is) : Building post caches for Twitter..." >> $MASTER_LOG
+$PYTHON_ENV scripts/data_prep/build_post_cache.py -d $TWITTER_DATA_DIR -c $TWITTER_CACHE_DIR -p twitter
+if [ -e success.log ]; then
+   echo "$(date -Is) : SUCCESS." >> $MASTER_LOG
+else
+   echo "$(date -Is) : FAILED. Exiting <${SCRIPT_NAME}>." >> $MASTER_LOG
+   exit 1
+fi
+# Remove after checking for successful completion
+rm success.log
+
+# FACEBOOK
+echo "$(date -Is) : Building post caches for Facebook..." >> $MASTER_LOG
+$PYTHON_ENV scripts/data_prep/build_post_cache.py -d $FACEBOOK_DATA_DIR -c $FACEBOOK_CACHE_DIR -p facebook
+if [ -e success.log ]; then
+   echo "$(date -Is) : SUCCESS." >> $MASTER_LOG
+else
+   echo "$(date -Is) : FAILED. Exiting <${SCRIPT_NAME}>." >> $MASTER_LOG
+   exit 1
+fi
+# Remove after checking for successful completion
+rm success.log
+
+### Build block indexes of new raw Twitter files (existing indexes are skipped)
+# Log file saved here: ./logs/build_block_index.log
+# -------------------------------------
+echo "$(date -Is) : Building block indexes for Twitter..." >> $MASTER_LOG
+$PYTHON_ENV scripts/data_prep/build_block_index.py -d $TWITTER_DATA_DIR -i $TWITTER_INDEX_DIR -p twitter
+if [ -e success.log ]; then
+   echo "$(date -Is) : SUCCESS." >> $MASTER_LOG
+else
+   echo "$(date -Is) : FAILED. Exiting <${SCRIPT_NAME}>." >> $MASTER_LOG
+   exit 1
+fi
+# Remove after checking for successful completion
+rm success.log
+
 ### Create the symbolic links
 # -------------------------------------
 # TWITTER
@@ -147,7 +194,7 @@ rm success.log
 # TWITTER
 # Log file saved here: UPDATE ME
 echo "$(date -Is) : Calculating FIB indices for Twitter..." >> $MASTER_LOG
-$PYTHON_ENV scripts/data_processing/calc_twitter_fib_indices.py -d $TWITTER_SYM_DIR/${CURR_YYYY_MM} -o $FIB_OUT_DIR_TWITTER -m $CURR_YYYY_MM -n 3
+$PYTHON_ENV scripts/data_processing/calc_twitter_fib_indices.py -d $TWITTER_SYM_DIR/${CURR_YYYY_MM} -o $FIB_OUT_DIR_TWITTER -m $CURR_YYYY_MM -n 3 -c $TWITTER_CACHE_DIR -a $TWITTER_AGGREGATE_DIR -p
 if [ -e success.log ]; then
    echo "$(date -Is) : SUCCESS." >> $MASTER_LOG
 else
@@ -160,7 +207,7 @@ rm success.log
 # FACEBOOK
 # Log file saved here: UPDATE ME
 echo "$(date -Is) : Calculating FIB indices for Facebook..." >> $MASTER_LOG
-$PYTHON_ENV scripts/data_processing/calc_crowdtangle_fib_indices.py -d $FACEBOOK_SYM_DIR/${CURR_YYYY_MM} -o $FIB_OUT_DIR_FACBOOK -m $CURR_YYYY_MM -n 3
+$PYTHON_ENV scripts/data_processing/calc_crowdtangle_fib_indices.py -d $FACEBOOK_SYM_DIR/${CURR_YYYY_MM} -o $FIB_OUT_DIR_FACBOOK -m $CURR_YYYY_MM -n 3 -c $FACEBOOK_CACHE_DIR -a $FACEBOOK_AGGREGATE_DIR
 if [ -e success.log ]; then
    echo "$(date -Is) : SUCCESS." >> $MASTER_LOG
 else
@@ -176,9 +223,12 @@ rm success.log
 # NOTE: The script updates images for FIBers found for the new month.
 #    To update links for ALL FIBers found since the inception of this project,
 #    include either "-a" or "--all-users" when executing the script below.
+#    Links are read from the FIB results (saved by the Twitter FIB calculation
+#    above) and any missing ones are looked up in the profile index, which only
+#    reads new raw files.
 # -------------------------------------
 echo "$(date -Is) : Updating new top FIBer Twitter profile image links..." >> $MASTER_LOG
-$PYTHON_ENV scripts/data_processing/get_latest_profile_image_links.py
+$PYTHON_ENV scripts/data_processing/get_latest_profile_image_links.py -f -p $TWITTER_PROFILE_INDEX
 if [ -e success.log ]; then
    echo "$(date -Is) : SUCCESS." >> $MASTER_LOG
 else